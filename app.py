@@ -1,17 +1,46 @@
 import streamlit as st
-import joblib
 import pandas as pd
 import numpy as np
+import os
+import sys
+
+# The scoring helpers and fitted feature transform live in src/, which must be importable to unpickle it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from scoring import load_scoring_artifacts, load_risk_thresholds, assign_risk_tiers
+from drift_monitor import DriftMonitor, load_drift_reference, PSI_WARN
+from explanations import load_explainer, top_contributions
+from instrumentation import span
 
 # Set page config
 st.set_page_config(page_title="Loan Default Predictor", page_icon="🏦", layout="centered")
 
 @st.cache_resource
 def load_model_and_features():
-    """Load model and feature names, cached so it doesn't reload on every UI interaction."""
-    model = joblib.load("models/best_model.pkl")
-    feature_names = joblib.load("models/feature_names.pkl")
-    return model, feature_names
+    """Load model and the fitted feature transform, cached so they don't reload on every UI interaction."""
+    # The compiled NumPy export answers one applicant in microseconds instead of dispatching 100 trees via joblib
+    return load_scoring_artifacts("models", engine="compiled")
+
+@st.cache_resource
+def load_tier_thresholds():
+    """(medium, high) risk-tier cutoffs tuned at training time."""
+    return load_risk_thresholds("models")
+
+@st.cache_resource
+def load_model_explainer():
+    """Per-applicant attributions for the served model, from statistics cached at training time (or None)."""
+    model, _ = load_model_and_features()
+    return load_explainer("models", model)
+
+@st.cache_resource
+def load_drift_monitor():
+    """
+    One drift monitor shared by every session, counting all applicants scored by this app against
+    the training profile. None for models registered without one.
+    """
+    reference = load_drift_reference("models")
+    if reference is None:
+        return None
+    return DriftMonitor(reference, export_path=DRIFT_METRICS_PATH, export_interval=DRIFT_EXPORT_SECONDS)
 
 def load_custom_css():
     st.markdown("""
@@ -230,61 +259,70 @@ def load_custom_css():
     """, unsafe_allow_html=True)
 
 
-def map_user_input_to_model(age, income, loan_amount, credit_score, emp_years, debt_ratio, feature_names):
+# Columns an uploaded file needs for the same mapping as the single-applicant form
+SIMPLE_INPUT_COLS = ['age', 'income', 'loan_amount', 'credit_score', 'emp_years', 'debt_ratio']
+# Rows scored per step for bulk uploads, so large files render progressively
+BULK_CHUNK_SIZE = 50_000
+# Drift gauges of everything the app has scored, rewritten at most this often
+DRIFT_METRICS_PATH = "logs/drift_app.prom"
+DRIFT_EXPORT_SECONDS = 60
+# Time the single-applicant explanation may take; slower walks report only the splits they reached
+EXPLAIN_BUDGET_MS = 50
+# Contributing features listed for one applicant / added as columns to bulk results
+SINGLE_TOP_FEATURES = 5
+BULK_TOP_FEATURES = 3
+
+def map_user_input_to_model(age, income, loan_amount, credit_score, emp_years, debt_ratio, transform):
     """
-    Since the backend model was trained on 30 highly specific, standardized features 
-    from the UCI dataset, we must map the user's intuitive inputs to approximate those features.
+    Since the backend model was trained on 30 highly specific features from the UCI dataset,
+    we map the user's intuitive inputs to an approximate raw UCI applicant record. The fitted
+    feature transform then applies exactly the encoding, scaling and feature engineering used
+    in training, so no statistics are hardcoded here. Fields we cannot infer (e.g. SEX,
+    EDUCATION) are imputed with their training medians by the transform.
+    Every input may be a scalar (one applicant) or an array (a whole uploaded file).
     """
-    # Initialize a dictionary with zeros for all required features
-    input_data = {feat: [0.0] for feat in feature_names}
+    age, income, loan_amount, credit_score, emp_years, debt_ratio = (
+        np.asarray(value, dtype=np.float64) for value in (age, income, loan_amount, credit_score, emp_years, debt_ratio))
     
-    # 1. MAP AGE (Model expects standardized age. Mean ~35, STD ~9.2)
-    # If the model wasn't standardized, we'd just pass age. Here we approximate:
-    std_age = (age - 35.48) / 9.21
-    if 'AGE' in input_data:
-        input_data['AGE'] = [std_age]
-        
-    # Age grouping features we engineered
-    if 'IS_YOUNG' in input_data:
-        input_data['IS_YOUNG'] = [1 if age < 25 else 0]
-    if 'IS_SENIOR' in input_data:
-        input_data['IS_SENIOR'] = [1 if age > 55 else 0]
-        
-    # 2. MAP LOAN AMOUNT & INCOME -> LIMIT_BAL proxies
-    # UCI dataset used LIMIT_BAL (Mean ~167k, STD ~129k)
-    std_limit_bal = (loan_amount - 167484) / 129747
-    if 'LIMIT_BAL' in input_data:
-        input_data['LIMIT_BAL'] = [std_limit_bal]
-        
-    # 3. MAP DEBT RATIO -> PAY_TO_BILL_RATIO
-    # A high debt ratio implies high credit utilization.
-    if 'PAY_TO_BILL_RATIO' in input_data:
-        input_data['PAY_TO_BILL_RATIO'] = [debt_ratio]
-        
-    # 4. MAP CREDIT SCORE -> TOTAL_SEVERE_DELAYS & PAYMENT STATUS
+    # 1. MAP AGE & LOAN AMOUNT -> AGE, LIMIT_BAL (scaled by the transform)
+    applicant = {'AGE': age, 'LIMIT_BAL': loan_amount}
+    
+    # 2. MAP CREDIT SCORE -> PAYMENT STATUS HISTORY
     # Credit score is a proxy for past repayment behavior.
     # Suppose < 600 means bad history (delays), > 700 means good history.
-    severe_delays = 0
-    recent_delay_status = 0 # 0 means paid on time
-    if credit_score < 600:
-        severe_delays = 3
-        recent_delay_status = 2 # 2 months delayed recently
-    elif credit_score < 680:
-        severe_delays = 1
-        recent_delay_status = 1
+    # 0 means paid on time, 2 means 2 months delayed recently
+    recent_delay_status = np.select([credit_score < 600, credit_score < 680], [2, 1], default=0)
+    past_delay_status = np.where(credit_score < 600, 2, 0)
     
-    if 'TOTAL_SEVERE_DELAYS' in input_data:
-        input_data['TOTAL_SEVERE_DELAYS'] = [severe_delays]
-        
-    if 'PAY_0' in input_data:
-        input_data['PAY_0'] = [recent_delay_status]
-        
-    # 5. MAPPING EMPLOYMENT YEARS
-    # Employment years gives stability. If employed > 5 years, less likely to have worsening trend.
-    if 'DELAY_TREND_WORSENING' in input_data:
-        input_data['DELAY_TREND_WORSENING'] = [1 if emp_years < 2 and credit_score < 650 else 0]
+    # 3. MAPPING EMPLOYMENT YEARS
+    # Employment years gives stability. Short tenure with a weak score means the delays are recent,
+    # i.e. the oldest status (PAY_6) is better than the latest one (PAY_0).
+    oldest_delay_status = np.where((emp_years < 2) & (credit_score < 650), recent_delay_status - 1, recent_delay_status)
+    applicant.update({'PAY_0': recent_delay_status, 'PAY_2': past_delay_status, 'PAY_3': 0,
+                      'PAY_4': 0, 'PAY_5': 0, 'PAY_6': oldest_delay_status})
+    
+    # 4. MAP DEBT RATIO & INCOME -> BILL_AMT / PAY_AMT
+    # A high debt ratio implies high credit utilization and less income left over to repay it.
+    monthly_bill = debt_ratio * loan_amount
+    monthly_payment = np.minimum(monthly_bill, (1 - debt_ratio) * income / 12)
+    for month in range(1, 7):
+        applicant[f'BILL_AMT{month}'] = monthly_bill
+        applicant[f'PAY_AMT{month}'] = monthly_payment
 
-    return pd.DataFrame(input_data)
+    return transform.transform(applicant)
+
+def map_uploaded_frame_to_model(df, transform):
+    """
+    Builds the model matrix for an uploaded file. Files in the raw UCI layout go straight through
+    the fitted transform; files with the six form fields use the same mapping as the form.
+    """
+    if set(transform.raw_columns) & set(df.columns):
+        return transform.transform(df)
+    missing = [col for col in SIMPLE_INPUT_COLS if col not in df.columns]
+    if missing:
+        raise ValueError(f"Uploaded file needs either the UCI dataset columns or: {', '.join(SIMPLE_INPUT_COLS)} "
+                         f"(missing {', '.join(missing)})")
+    return map_user_input_to_model(*(df[col].to_numpy() for col in SIMPLE_INPUT_COLS), transform)
 
 def main():
     st.set_page_config(page_title="Loan Default Predictor", page_icon="🏦", layout="centered")
@@ -302,11 +340,36 @@ def main():
     
     # Load model
     try:
-        model, feature_names = load_model_and_features()
+        model, transform = load_model_and_features()
+        thresholds = load_tier_thresholds()
+        monitor = load_drift_monitor()
+        explainer = load_model_explainer()
     except Exception as e:
         st.error("Error loading model. Please ensure Phase 8 was completed successfully.")
         return
         
+    single_tab, bulk_tab = st.tabs(["Single Applicant", "Bulk Upload"])
+    with single_tab:
+        render_single_applicant(model, transform, thresholds, monitor, explainer)
+    with bulk_tab:
+        render_bulk_upload(model, transform, thresholds, monitor, explainer)
+
+def render_explanation(explainer, X_input):
+    """Table of the features that moved one applicant's score the most, computed within EXPLAIN_BUDGET_MS."""
+    contributions, base_value, complete = explainer.explain(X_input, budget_ms=EXPLAIN_BUDGET_MS)
+    names, values = top_contributions(contributions, explainer.feature_names, SINGLE_TOP_FEATURES)
+    st.markdown("<h3 style='margin-top: 2rem;'>What Drove This Score</h3>", unsafe_allow_html=True)
+    st.dataframe(pd.DataFrame({'Feature': names[0], 'Contribution': values[0].round(4),
+                               'Effect': np.where(values[0] > 0, 'raises risk', 'lowers risk')}),
+                 use_container_width=True, hide_index=True)
+    caption = (f"Contributions ({explainer.units}) add up from the average training applicant's "
+               f"{base_value:.3f} to this applicant's score.")
+    if not complete:
+        caption += " Time budget reached: only the upper splits of each tree are included."
+    st.caption(caption)
+
+def render_single_applicant(model, transform, thresholds, monitor=None, explainer=None):
+    """Form for scoring one applicant at a time."""
     # Layout using columns
     col1, col2 = st.columns(2)
     
@@ -325,20 +388,21 @@ def main():
     # Prediction Button
     if st.button("Predict Default Risk", type="primary", use_container_width=True):
         with st.spinner("Analyzing applicant profile..."):
-            import time
-            time.sleep(1) # Add a small artificial delay to show off the spinner/animations
-            
-            # Map UI inputs to model inputs
-            df_input = map_user_input_to_model(age, income, loan_amount, credit_score, emp_years, debt_ratio, feature_names)
-            
-            # Predict
-            probability = model.predict_proba(df_input)[0][1]
+            with span('app.predict', rows=1, mode='single'):
+                # Map UI inputs to model inputs
+                X_input = map_user_input_to_model(age, income, loan_amount, credit_score, emp_years, debt_ratio, transform)
+                
+                # Predict
+                probability = model.predict_proba(X_input)[0][1]
+                if monitor is not None:
+                    monitor.update(X_input, [probability])
             
             # Display Results
             st.markdown("<h3 style='margin-top: 2rem;'>Risk Assessment</h3>", unsafe_allow_html=True)
             
             # Custom Animated Result Cards
-            if probability >= 0.8:
+            medium_threshold, high_threshold = thresholds
+            if probability >= high_threshold:
                 st.markdown(f"""
                 <div class="result-card" style="background: rgba(255, 50, 50, 0.15); border: 2px solid #ff3232; border-radius: 16px; padding: 30px; text-align: center; box-shadow: 0 0 25px rgba(255,50,50,0.4), inset 0 0 15px rgba(255,50,50,0.2);">
                     <h2 style="color: #ff3232; margin:0; font-family: 'Space Grotesk', sans-serif;">🚨 HIGH RISK</h2>
@@ -349,7 +413,7 @@ def main():
                     </div>
                 </div>
                 """, unsafe_allow_html=True)
-            elif probability >= 0.5:
+            elif probability >= medium_threshold:
                 st.markdown(f"""
                 <div class="result-card" style="background: rgba(255, 215, 0, 0.15); border: 2px solid #ffd700; border-radius: 16px; padding: 30px; text-align: center; box-shadow: 0 0 25px rgba(255,215,0,0.4), inset 0 0 15px rgba(255,215,0,0.2);">
                     <h2 style="color: #ffd700; margin:0; font-family: 'Space Grotesk', sans-serif;">⚠️ MEDIUM RISK</h2>
@@ -371,6 +435,99 @@ def main():
                     </div>
                 </div>
                 """, unsafe_allow_html=True)
+            
+            if explainer is not None:
+                render_explanation(explainer, X_input)
+
+def render_tier_summary(tier_counts):
+    st.markdown("<h3>Risk Tier Distribution</h3>", unsafe_allow_html=True)
+    st.bar_chart(tier_counts.astype(int))
+
+def score_upload(uploaded, model, transform, thresholds, monitor=None, explainer=None):
+    """
+    Scores an uploaded CSV in large vectorized chunks, refreshing the tier summary as each one lands.
+    Returns the results table, its CSV, the tier counts and the upload's drift report (or None when
+    the file doesn't fit the model).
+    """
+    df = pd.read_csv(uploaded)
+    try:
+        X = map_uploaded_frame_to_model(df, transform)
+    except ValueError as e:
+        st.error(str(e))
+        return None
+    
+    progress = st.progress(0.0, text=f"Scoring {len(df):,} applicants...")
+    summary = st.empty()
+    probabilities = np.empty(len(df))
+    tier_counts = pd.Series(0, index=['LOW', 'MEDIUM', 'HIGH'])
+    # The upload's own histograms, for its drift table; they are added to the app-wide monitor too
+    upload_monitor = DriftMonitor(monitor.reference) if monitor is not None else None
+    top_features = np.empty((len(df), BULK_TOP_FEATURES), dtype=object)
+    top_values = np.zeros((len(df), BULK_TOP_FEATURES))
+    for start in range(0, len(df), BULK_CHUNK_SIZE):
+        stop = min(start + BULK_CHUNK_SIZE, len(df))
+        with span('app.predict', rows=stop - start, mode='bulk'):
+            probabilities[start:stop] = model.predict_proba(X[start:stop])[:, 1]
+            if upload_monitor is not None:
+                upload_monitor.update(X[start:stop], probabilities[start:stop])
+        if explainer is not None:
+            with span('app.explain', rows=stop - start, mode='bulk'):
+                contributions, _, _ = explainer.explain(X[start:stop])
+                top_features[start:stop], top_values[start:stop] = top_contributions(
+                    contributions, explainer.feature_names, BULK_TOP_FEATURES)
+        tier_counts = tier_counts.add(pd.Series(assign_risk_tiers(probabilities[start:stop], thresholds)).value_counts(), fill_value=0)
+        progress.progress(stop / len(df), text=f"Scored {stop:,} of {len(df):,} applicants")
+        with summary.container():
+            render_tier_summary(tier_counts)
+    progress.empty()
+    summary.empty()
+    report = None
+    if upload_monitor is not None:
+        # The file stays attached across reruns and a later upload can bring it back; its rows are
+        # counted in the app-wide monitor once
+        merged = st.session_state.setdefault('drift_merged_uploads', set())
+        if uploaded.file_id not in merged:
+            monitor.merge(upload_monitor.feature_counts, upload_monitor.prediction_counts, upload_monitor.rows)
+            merged.add(uploaded.file_id)
+        report = upload_monitor.report()
+    
+    ids = df['ID'] if 'ID' in df.columns else pd.RangeIndex(1, len(df) + 1)
+    results = pd.DataFrame({'ID': ids, 'DEFAULT_PROBABILITY': probabilities.round(4),
+                            'RISK_TIER': assign_risk_tiers(probabilities, thresholds)})
+    if explainer is not None:
+        for rank in range(BULK_TOP_FEATURES):
+            results[f'TOP_FEATURE_{rank + 1}'] = top_features[:, rank]
+            results[f'TOP_CONTRIBUTION_{rank + 1}'] = top_values[:, rank].round(4)
+    return {'file_id': uploaded.file_id, 'results': results, 'csv': results.to_csv(index=False),
+            'tier_counts': tier_counts, 'drift_report': report}
+
+def render_bulk_upload(model, transform, thresholds, monitor=None, explainer=None):
+    """Scores a whole uploaded CSV of applicants and offers the results for download."""
+    uploaded = st.file_uploader("Upload applicants (CSV)", type="csv",
+                                help="Either the raw UCI dataset columns, or: " + ", ".join(SIMPLE_INPUT_COLS))
+    if uploaded is None:
+        return
+    
+    # Streamlit reruns the whole script on every interaction while the file stays attached, so the
+    # session keeps the scored result of its latest upload instead of rescoring it each time
+    scored = st.session_state.get('bulk_scores')
+    if scored is None or scored['file_id'] != uploaded.file_id:
+        scored = score_upload(uploaded, model, transform, thresholds, monitor, explainer)
+        if scored is None:
+            return
+        st.session_state['bulk_scores'] = scored
+    
+    render_tier_summary(scored['tier_counts'])
+    report = scored['drift_report']
+    if report is not None:
+        flagged = int((report['status'] != 'stable').sum())
+        with st.expander(f"Drift vs. training data: {flagged} of {len(report)} columns on watch or shifted "
+                         f"(PSI >= {PSI_WARN})"):
+            st.dataframe(report.round(4), use_container_width=True, hide_index=True)
+    st.dataframe(scored['results'], use_container_width=True, hide_index=True)
+    # on_click="ignore": downloading doesn't rerun the script
+    st.download_button("Download Scores (CSV)", scored['csv'], file_name="default_scores.csv",
+                       mime="text/csv", use_container_width=True, on_click="ignore")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from data_preprocessing import read_raw_csv
+from scoring import load_scoring_artifacts, load_risk_thresholds, predict_default_probability, assign_risk_tiers
+from drift_monitor import DriftMonitor, load_drift_reference, print_report
+from explanations import load_explainer, top_contributions, TOP_FEATURES
+from champion_challenger import ShadowLog, load_multi_model_scorer
+from model_registry import ModelRegistry
+from instrumentation import span
+
+# Each worker process loads the model once and keeps it for every chunk it scores
+_worker_model = None
+_worker_transform = None
+_worker_thresholds = None
+_worker_drift_reference = None
+_worker_explainer = None
+_worker_top_features = 0
+_worker_scorer = None
+
+def _init_worker(models_dir, engine, monitor_drift, top_features, exact_attributions, shadow_log_dir):
+    global _worker_model, _worker_transform, _worker_thresholds, _worker_drift_reference, _worker_explainer, \
+        _worker_top_features, _worker_scorer
+    if shadow_log_dir:
+        # Challengers score each chunk inline: a batch job has no request latency to protect
+        _worker_scorer = load_multi_model_scorer(models_dir, engine=engine, single_threaded=True,
+                                                 log_dir=shadow_log_dir, background=False)
+        _worker_model = _worker_scorer.champion
+    else:
+        _worker_model, _worker_transform = load_scoring_artifacts(models_dir, single_threaded=True, engine=engine)
+    _worker_thresholds = load_risk_thresholds(models_dir)
+    _worker_drift_reference = load_drift_reference(models_dir) if monitor_drift else None
+    if top_features:
+        _worker_explainer = load_explainer(models_dir, _worker_model, exact=exact_attributions)
+        _worker_top_features = top_features
+
+def output_columns(top_features=0):
+    """Columns of the scores file; each top feature adds its name and its signed contribution."""
+    columns = ['ID', 'DEFAULT_PROBABILITY', 'RISK_TIER']
+    for rank in range(1, top_features + 1):
+        columns += [f'TOP_FEATURE_{rank}', f'TOP_CONTRIBUTION_{rank}']
+    return columns
+
+def _score_chunk(ids, raw):
+    """
+    Scores one chunk inside a worker and returns it as ready-to-write CSV text, plus the chunk's
+    drift histograms (feature counts, prediction counts) when drift is monitored.
+    """
+    monitor = DriftMonitor(_worker_drift_reference) if _worker_drift_reference is not None else None
+    # The chunk's feature matrix is built once, for scoring and attribution alike
+    if _worker_scorer is not None:
+        probabilities, X = _worker_scorer.score(raw, ids, monitor=monitor, return_features=True)
+    else:
+        probabilities, X = predict_default_probability(_worker_model, _worker_transform, raw, monitor=monitor,
+                                                       return_features=True)
+    result = pd.DataFrame({'ID': ids,
+                           'DEFAULT_PROBABILITY': np.round(probabilities, 6),
+                           'RISK_TIER': assign_risk_tiers(probabilities, _worker_thresholds)})
+    if _worker_explainer is not None:
+        with span('score.explain', rows=len(raw)):
+            contributions, _, _ = _worker_explainer.explain(X)
+            names, values = top_contributions(contributions, _worker_explainer.feature_names, _worker_top_features)
+        for rank in range(names.shape[1]):
+            result[f'TOP_FEATURE_{rank + 1}'] = names[:, rank]
+            result[f'TOP_CONTRIBUTION_{rank + 1}'] = np.round(values[:, rank], 6)
+    drift_counts = (monitor.feature_counts, monitor.prediction_counts) if monitor is not None else None
+    return result.to_csv(index=False, header=False), drift_counts
+
+def _load_checkpoint(checkpoint_path, input_path, chunksize):
+    """
+    Returns (chunks_done, output_bytes, drift) from a checkpoint written by a previous run of the
+    same job; drift holds the histograms of the finished chunks, or None.
+    """
+    if not os.path.exists(checkpoint_path):
+        return 0, 0, None
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    if checkpoint['input'] != os.path.abspath(input_path) or checkpoint['chunksize'] != chunksize:
+        print("Checkpoint belongs to a different job, starting from scratch.")
+        return 0, 0, None
+    return checkpoint['chunks_done'], checkpoint['output_bytes'], checkpoint.get('drift')
+
+def _save_checkpoint(checkpoint_path, input_path, chunksize, chunks_done, output_bytes, monitor=None):
+    tmp_path = checkpoint_path + '.tmp'
+    checkpoint = {'input': os.path.abspath(input_path), 'chunksize': chunksize,
+                  'chunks_done': chunks_done, 'output_bytes': output_bytes}
+    if monitor is not None:
+        checkpoint['drift'] = {'feature_counts': monitor.feature_counts.tolist(),
+                               'prediction_counts': monitor.prediction_counts.tolist(), 'rows': monitor.rows}
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+def batch_score(input_path, output_path, models_dir="../models", chunksize=100_000, workers=None, resume=True,
+                engine="native", drift_path=None, top_features=TOP_FEATURES, exact_attributions=False,
+                shadow_log_dir=None):
+    """
+    Scores a raw applicant CSV with the saved model and feature transform.
+
+    The input is read in chunks that are scored in parallel by a process pool; results are
+    appended to `output_path` in input order as soon as each chunk finishes. After every chunk a
+    checkpoint records how much of the input and output is complete, so a crashed run restarts
+    from the last finished chunk instead of from the beginning.
+    engine="compiled" scores with the NumPy-only model export, so workers never import sklearn/XGBoost.
+    With a drift_path, every chunk is also binned against the model's training profile
+    (drift_monitor.py); the job's drift report is printed at the end and written there as
+    Prometheus text.
+    Each row also gets the `top_features` features that moved its score the most, with their signed
+    contributions (explanations.py; 0 turns this off). exact_attributions=True uses XGBoost's exact
+    TreeSHAP for a native XGBoost model instead of the much faster path attribution.
+    With a shadow_log_dir, the registry's challenger versions also score every chunk on the same
+    feature matrix, and all models' scores go to the shadow log there (champion_challenger.py).
+    """
+    workers = workers or os.cpu_count()
+    checkpoint_path = output_path + '.checkpoint'
+    chunks_done, output_bytes, drift_state = _load_checkpoint(checkpoint_path, input_path, chunksize) if resume \
+        else (0, 0, None)
+    if top_features and load_explainer(models_dir) is None:
+        print("The current model has no attribution statistics, scoring without top features.")
+        top_features = 0
+    header = ','.join(output_columns(top_features)) + '\n'
+    if chunks_done:
+        with open(output_path) as f:
+            if f.readline() != header:
+                print("Existing output has different columns, starting from scratch.")
+                chunks_done, output_bytes, drift_state = 0, 0, None
+    if shadow_log_dir:
+        registry = ModelRegistry(models_dir)
+        if registry.current_version() is None or not registry.challengers():
+            print("The registry lists no challenger versions, scoring with the current model only.")
+            shadow_log_dir = None
+        else:
+            # Headers are written here, before the workers start appending
+            ShadowLog(shadow_log_dir)
+    monitor = None
+    if drift_path:
+        reference = load_drift_reference(models_dir)
+        if reference is None:
+            print("The current model has no drift reference profile, scoring without drift monitoring.")
+        else:
+            monitor = DriftMonitor(reference)
+            if chunks_done and drift_state:
+                monitor.merge(np.array(drift_state['feature_counts']), np.array(drift_state['prediction_counts']),
+                              drift_state['rows'])
+
+    if chunks_done:
+        print(f"Resuming after {chunks_done} completed chunks.")
+        with open(output_path, 'r+b') as f:
+            f.truncate(output_bytes) # drop anything written after the last checkpoint
+    else:
+        with open(output_path, 'w') as f:
+            f.write(header)
+        output_bytes = os.path.getsize(output_path)
+        _save_checkpoint(checkpoint_path, input_path, chunksize, 0, output_bytes, monitor)
+
+    start_time = time.perf_counter()
+    rows_scored = 0
+    # Keep a bounded number of chunks in flight so memory does not grow with the input size
+    max_in_flight = 2 * workers
+    pending = []
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(models_dir, engine, monitor is not None, top_features, exact_attributions,
+                                       shadow_log_dir)) as pool, \
+         open(output_path, 'a') as out:
+
+        def write_oldest():
+            nonlocal chunks_done, output_bytes, rows_scored
+            future, n_rows = pending.pop(0)
+            csv_text, drift_counts = future.result()
+            out.write(csv_text)
+            out.flush()
+            output_bytes = out.tell()
+            chunks_done += 1
+            rows_scored += n_rows
+            if monitor is not None:
+                monitor.merge(*drift_counts, n_rows)
+            _save_checkpoint(checkpoint_path, input_path, chunksize, chunks_done, output_bytes, monitor)
+
+        # The raw layout's compact dtypes and range checks, like the rest of the pipeline
+        for chunk_index, chunk in enumerate(read_raw_csv(input_path, chunksize=chunksize)):
+            if chunk_index < chunks_done:
+                continue
+            ids = chunk['ID'].to_numpy() if 'ID' in chunk.columns else np.arange(len(chunk)) + chunk_index * chunksize
+            pending.append((pool.submit(_score_chunk, ids, chunk), len(chunk)))
+            if len(pending) >= max_in_flight:
+                write_oldest()
+                elapsed = time.perf_counter() - start_time
+                print(f"  scored {rows_scored:,} rows ({rows_scored / elapsed:,.0f} rows/sec)")
+        while pending:
+            write_oldest()
+
+    elapsed = time.perf_counter() - start_time
+    os.remove(checkpoint_path)
+    print(f"Scored {rows_scored:,} rows in {elapsed:.1f}s ({rows_scored / max(elapsed, 1e-9):,.0f} rows/sec) with {workers} workers.")
+    print(f"Scores saved to {output_path}")
+    if monitor is not None:
+        print()
+        print_report(monitor, limit=10)
+        monitor.write_prometheus(drift_path)
+        print(f"Drift metrics saved to {drift_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a raw applicant file with the saved model.")
+    parser.add_argument("--input", default="../data/raw/loan_default_data.csv")
+    parser.add_argument("--output", default="../data/processed/scores.csv")
+    parser.add_argument("--models-dir", default="../models")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=None, help="Defaults to the number of CPU cores")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore an existing checkpoint and start over")
+    parser.add_argument("--engine", choices=["native", "compiled"], default="native",
+                        help="native: the pickled estimator (fastest for large chunks); compiled: NumPy-only export")
+    parser.add_argument("--drift-metrics", default="../logs/drift_batch.prom",
+                        help="Prometheus text file for the drift report of the scored rows")
+    parser.add_argument("--no-drift", action="store_true", help="Don't compare the scored rows with the training profile")
+    parser.add_argument("--top-features", type=int, default=TOP_FEATURES,
+                        help="Most influential features written per row with their contributions (0: none)")
+    parser.add_argument("--exact-attributions", action="store_true",
+                        help="Exact TreeSHAP from XGBoost for a native XGBoost model (much slower than path attribution)")
+    parser.add_argument("--challengers", action="store_true",
+                        help="Also score with the registry's challenger versions and log every model's scores")
+    parser.add_argument("--shadow-log-dir", default="../logs", help="Where --challengers writes the shadow logs")
+    args = parser.parse_args()
+
+    # Worker processes log a score.predict span per chunk; this one covers the whole job
+    with span('batch.score_file', engine=args.engine):
+        batch_score(args.input, args.output, args.models_dir, args.chunksize, args.workers, resume=not args.no_resume,
+                    engine=args.engine, drift_path=None if args.no_drift else args.drift_metrics,
+                    top_features=args.top_features, exact_attributions=args.exact_attributions,
+                    shadow_log_dir=args.shadow_log_dir if args.challengers else None)
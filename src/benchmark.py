@@ -0,0 +1,222 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+from data_preprocessing import TARGET_COL, load_data, handle_missing_values, encode_categorical, normalize_numerical, read_raw_csv
+from feature_engineering import feature_engineering
+from scoring import load_scoring_artifacts, predict_default_probability
+from train_model import build_models
+from instrumentation import reset_peak_rss, current_rss, peak_rss
+from synthetic_data import SyntheticCreditGenerator, generate_csv
+
+# Dataset sizes benchmarked by default
+DEFAULT_SCALES = [30_000, 300_000, 3_000_000]
+HISTORY_PATH = "../benchmarks/history.json"
+BASELINE_PATH = "../benchmarks/baseline.json"
+# A stage is flagged when it takes this much longer, or peaks this much higher in memory, than the baseline
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.25
+# Repeats of a stage stop early once they have used this many seconds; the fastest repeat counts
+REPEAT_BUDGET_SECONDS = 10
+# predict_proba calls on single rows timed per repeat
+SINGLE_ROW_CALLS = 200
+
+def measure(stage, n_rows, fn, make_input=None, repeats=3, calls=1):
+    """
+    Runs fn(make_input()) up to `repeats` times and returns (result record, last output).
+    make_input runs outside the timed region, so stages that modify their input get a fresh copy.
+    The record keeps the fastest wall time and the highest peak RSS over the repeats. When fn makes
+    `calls` single-row calls (instead of processing all n_rows), seconds is the time per call.
+    """
+    best = np.inf
+    peak = 0
+    increase = 0
+    spent = 0.0
+    done = 0
+    output = None
+    while done < repeats and (done == 0 or spent < REPEAT_BUDGET_SECONDS):
+        data = make_input() if make_input else None
+        output = None
+        reset_peak_rss()
+        before = current_rss()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            output = fn(data) if make_input else fn()
+        seconds = time.perf_counter() - start
+        stage_peak = peak_rss()
+        best = min(best, seconds)
+        peak = max(peak, stage_peak)
+        increase = max(increase, stage_peak - before)
+        spent += seconds
+        done += 1
+    rows_done = n_rows if calls == 1 else calls
+    record = {'stage': stage, 'rows': n_rows, 'seconds': best / calls, 'rows_per_sec': rows_done / max(best, 1e-12),
+              'peak_rss_mb': peak / 2**20, 'peak_rss_increase_mb': increase / 2**20, 'repeats': done}
+    print(f"  {stage:<28} {record['seconds']:>10.4f}s {record['rows_per_sec']:>14,.0f} rows/s "
+          f"{record['peak_rss_mb']:>9.1f} MB peak (+{record['peak_rss_increase_mb']:.1f})")
+    return record, output
+
+def scaled_raw_file(n_rows, source_path, data_dir, seed=42):
+    """
+    Path of a raw file with `n_rows` rows: the source itself at its own size, otherwise synthetic
+    rows from a generator fitted on it (synthetic_data.py), written once to data_dir and reused.
+    """
+    source = read_raw_csv(source_path)
+    if n_rows == len(source):
+        return source_path
+    path = os.path.join(data_dir, f"synthetic_{n_rows}_seed{seed}.csv")
+    if os.path.exists(path):
+        return path
+
+    print(f"Generating {n_rows:,} synthetic rows from {source_path} into {path}...")
+    os.makedirs(data_dir, exist_ok=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate_csv(SyntheticCreditGenerator().fit(source), n_rows, path, seed)
+    return path
+
+def benchmark_scale(n_rows, source_path, data_dir, models_dir, repeats=3, fit=True, predict=True):
+    """Benchmarks every pipeline stage on an n_rows dataset and returns the result records."""
+    path = scaled_raw_file(n_rows, source_path, data_dir)
+    print(f"\n--- {n_rows:,} rows ---")
+    results = []
+
+    def run(stage, fn, make_input=None, calls=1):
+        record, output = measure(stage, n_rows, fn, make_input, repeats, calls)
+        results.append(record)
+        return output
+
+    raw = run('load_data', lambda: load_data(path))
+    df = run('handle_missing_values', handle_missing_values, raw.copy)
+    df = run('encode_categorical', encode_categorical, df.copy)
+    df = run('normalize_numerical', normalize_numerical, df.copy)
+    df = run('feature_engineering', feature_engineering, df.copy)
+
+    if fit:
+        X = df.drop(columns=['ID', TARGET_COL])
+        y = df[TARGET_COL]
+        scale_pos_weight = (len(y) - y.sum()) / y.sum()
+        for name, model in build_models(scale_pos_weight).items():
+            run(f'fit {name}', lambda: model.fit(X, y))
+        del X, y
+    del df
+
+    if predict:
+        if not os.path.exists(os.path.join(models_dir, "best_model.pkl")):
+            print(f"  No saved model in {models_dir}, skipping predict_proba. Run train_model.py first.")
+        else:
+            model, transform = load_scoring_artifacts(models_dir)
+            applicants = raw.drop(columns=['ID', TARGET_COL])
+            single_rows = applicants.head(SINGLE_ROW_CALLS).to_dict('records')
+
+            def predict_single_rows():
+                for row in single_rows:
+                    predict_default_probability(model, transform, row)
+            run('predict_proba single row', predict_single_rows, calls=len(single_rows))
+            run('predict_proba batch', lambda: predict_default_probability(model, transform, applicants))
+    return results
+
+def git_commit():
+    """Short hash of the checked-out commit, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(scales=DEFAULT_SCALES, source_path="../data/raw/loan_default_data.csv", data_dir="../data/benchmark",
+                   models_dir="../models", repeats=3, fit=True, predict=True):
+    """Benchmarks all scales and returns one run record (environment + results) for the history."""
+    exact_peaks = reset_peak_rss()
+    if not exact_peaks:
+        print("Can't reset the peak-RSS counter on this system; peaks include earlier stages.")
+    results = []
+    for n_rows in scales:
+        results += benchmark_scale(n_rows, source_path, data_dir, models_dir, repeats, fit, predict)
+    return {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': git_commit(),
+            'host': platform.node(), 'platform': platform.platform(), 'python': platform.python_version(),
+            'cpu_count': os.cpu_count(), 'exact_peak_rss': exact_peaks, 'results': results}
+
+def load_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def save_json(obj, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(obj, f, indent=2)
+
+def append_history(run, path=HISTORY_PATH):
+    """Appends a run record to the JSON history (a list of runs, oldest first)."""
+    history = load_json(path, [])
+    history.append(run)
+    save_json(history, path)
+
+def find_regressions(run, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    """
+    Compares a run with a baseline run, stage by stage at the same row count. Returns one entry per
+    metric that got worse by more than its tolerance (wall time, or peak RSS increase of the stage).
+    """
+    reference = {(record['stage'], record['rows']): record for record in baseline['results']}
+    regressions = []
+    for record in run['results']:
+        base = reference.get((record['stage'], record['rows']))
+        if base is None:
+            continue
+        for metric, tolerance in (('seconds', time_tolerance), ('peak_rss_increase_mb', memory_tolerance)):
+            # Memory below 1 MB is allocator noise
+            if metric == 'peak_rss_increase_mb' and max(base[metric], record[metric]) < 1:
+                continue
+            if record[metric] > base[metric] * (1 + tolerance):
+                regressions.append({'stage': record['stage'], 'rows': record['rows'], 'metric': metric,
+                                    'baseline': base[metric], 'current': record[metric],
+                                    'change': record[metric] / max(base[metric], 1e-12) - 1})
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage at several dataset sizes.")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="Dataset sizes in rows")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per stage (the fastest counts)")
+    parser.add_argument("--skip-fit", action="store_true", help="Don't benchmark the model fits")
+    parser.add_argument("--skip-predict", action="store_true", help="Don't benchmark predict_proba with the saved model")
+    parser.add_argument("--input", default="../data/raw/loan_default_data.csv", help="Raw file the synthetic scales are modelled on")
+    parser.add_argument("--data-dir", default="../data/benchmark", help="Where the synthetic raw files are kept")
+    parser.add_argument("--models-dir", default="../models")
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    args = parser.parse_args()
+
+    run = run_benchmarks(args.scales, args.input, args.data_dir, args.models_dir, args.repeats,
+                         fit=not args.skip_fit, predict=not args.skip_predict)
+    append_history(run, args.history)
+    print(f"\nAppended results to {args.history}")
+
+    baseline = load_json(args.baseline)
+    regressions = []
+    if baseline is None:
+        print(f"No baseline at {args.baseline} yet; run with --save-baseline to store one.")
+    else:
+        if (baseline.get('host'), baseline.get('cpu_count')) != (run['host'], run['cpu_count']):
+            print(f"Note: the baseline was recorded on {baseline.get('host')} ({baseline.get('cpu_count')} CPUs).")
+        regressions = find_regressions(run, baseline, args.time_tolerance, args.memory_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['stage']} @ {regression['rows']:,} rows: {regression['metric']} "
+                  f"{regression['baseline']:.4g} -> {regression['current']:.4g} ({regression['change']:+.0%})")
+        if not regressions:
+            print(f"No regressions against the baseline from {baseline['timestamp']} ({baseline.get('commit')}).")
+    if args.save_baseline:
+        save_json(run, args.baseline)
+        print(f"Saved this run as the baseline in {args.baseline}")
+    sys.exit(1 if regressions else 0)
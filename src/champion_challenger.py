@@ -0,0 +1,278 @@
+import argparse
+import csv
+import io
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from data_preprocessing import TARGET_COL
+from data_store import FileHasher
+from evaluate_model import evaluate_predictions
+from model_registry import ModelRegistry, TRANSFORM_FILE
+from scoring import load_scoring_artifacts
+from instrumentation import span
+
+# Background threads scoring the challengers; one keeps them from competing with the champion for cores
+CHALLENGER_WORKERS = 1
+# Batches waiting for the challenger pool; further behind than this, new batches are not shadow-scored
+# (and counted as dropped) instead of queueing without bound
+MAX_PENDING_BATCHES = 64
+# Shadow logs: one row per (applicant, model) and one per (batch, model)
+SCORES_FILE = "shadow_scores.csv"
+LATENCY_FILE = "shadow_latency.csv"
+SCORE_COLUMNS = ['BATCH', 'ID', 'VERSION', 'ROLE', 'DEFAULT_PROBABILITY']
+LATENCY_COLUMNS = ['BATCH', 'TIMESTAMP', 'VERSION', 'ROLE', 'ROWS', 'FEATURES_MS', 'LATENCY_MS']
+# Batch latencies kept per model for the running summary
+LATENCY_WINDOW = 10_000
+
+class ShadowLog:
+    """
+    Append-only CSV logs of every model's scores and batch latencies, for comparing the models on
+    the same applicants once their outcomes are known (compare_models). Each batch goes to a file
+    in a single O_APPEND write, so threads and batch-scoring worker processes can share the files
+    without interleaving rows.
+    """
+
+    def __init__(self, log_dir="../logs"):
+        os.makedirs(log_dir, exist_ok=True)
+        self.scores_path = os.path.join(log_dir, SCORES_FILE)
+        self.latency_path = os.path.join(log_dir, LATENCY_FILE)
+        for path, columns in ((self.scores_path, SCORE_COLUMNS), (self.latency_path, LATENCY_COLUMNS)):
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                self._append(path, ','.join(columns) + '\n')
+
+    @staticmethod
+    def _format(rows):
+        # Quoted by the csv module: IDs come from clients and may hold commas, quotes or newlines
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(rows)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _append(path, text):
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, text.encode())
+        finally:
+            os.close(fd)
+
+    def log(self, batch, ids, results):
+        """Appends one batch: `results` holds (version, role, probabilities, features_ms, latency_ms) per model."""
+        ids = ids if ids is not None else [''] * len(results[0][2])
+        timestamp = time.time()
+        # csv.writer rather than a DataFrame: for the service's small batches a DataFrame round trip costs more than scoring
+        self._append(self.scores_path, self._format((batch, row_id, version, role, f"{p:.6f}")
+                                                    for version, role, probabilities, _, _ in results
+                                                    for row_id, p in zip(ids, probabilities.tolist())))
+        self._append(self.latency_path, self._format((batch, f"{timestamp:.3f}", version, role, len(probabilities),
+                                                      f"{features_ms:.3f}", f"{latency_ms:.3f}")
+                                                     for version, role, probabilities, features_ms, latency_ms in results))
+
+class Challenger:
+    """A shadow-scored version: its model, and either its columns of the shared matrix or its own transform."""
+
+    def __init__(self, version, model, columns=None, transform=None):
+        self.version = version
+        self.model = model
+        self.columns = columns
+        self.transform = transform
+
+class MultiModelScorer:
+    """
+    Scores every batch with the champion (the served model) and shadow-scores it with challenger
+    versions, building the feature matrix once for all of them.
+
+    The shared transform produces the union of the models' features, champion features first, so
+    the champion reads a leading slice of the matrix and each challenger its own columns. A
+    challenger fitted with a different transform (another preprocessing run) maps the raw rows
+    itself. With background=True score() returns as soon as the champion has scored, and the
+    challengers (and all log writes) run in a thread pool off the request path; when that pool is
+    MAX_PENDING_BATCHES behind, batches skip shadow scoring entirely, so the logs only hold batches
+    every model scored. background=False scores the challengers before returning (batch jobs).
+    """
+
+    def __init__(self, champion_version, champion, transform, challengers, n_champion=None, log=None, background=True,
+                 workers=CHALLENGER_WORKERS, max_pending=MAX_PENDING_BATCHES):
+        self.champion_version = champion_version
+        self.champion = champion
+        self.transform = transform
+        # Leading columns of the shared matrix the champion reads (None: all of them)
+        self.n_champion = n_champion
+        self.challengers = challengers
+        self.log = log
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='challenger') if background else None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._batches = itertools.count()
+        self._lock = threading.Lock()
+        self.latencies_ms = {version: deque(maxlen=LATENCY_WINDOW)
+                             for version in [champion_version] + [c.version for c in challengers]}
+        self.errors = {}
+        self.dropped_batches = 0
+
+    def _record(self, version, latency_ms=None, error=None):
+        with self._lock:
+            if error is None:
+                self.latencies_ms[version].append(latency_ms)
+            else:
+                if version not in self.errors:
+                    print(f"Challenger {version} failed: {error}")
+                self.errors[version] = self.errors.get(version, 0) + 1
+
+    def score(self, raw, ids=None, monitor=None, return_features=False):
+        """
+        Champion P(default) for raw applicant rows (anything FeatureTransform.transform accepts);
+        `ids` identify the rows in the shadow log. A DriftMonitor passed as `monitor` counts the
+        rows and the champion's scores, and return_features=True also returns the champion's
+        feature matrix, like predict_default_probability.
+        """
+        batch = f"{os.getpid()}-{next(self._batches)}"
+        start = time.perf_counter()
+        with span('score.features', rows=len(raw)):
+            X = self.transform.transform(raw)
+        features_ms = (time.perf_counter() - start) * 1000
+        X_champion = X[:, :self.n_champion]
+        start = time.perf_counter()
+        with span('score.champion', rows=len(X), model=self.champion_version):
+            probabilities = self.champion.predict_proba(X_champion)[:, 1]
+        champion_ms = (time.perf_counter() - start) * 1000
+        self._record(self.champion_version, champion_ms)
+        if monitor is not None:
+            monitor.update(X_champion, probabilities)
+
+        job = (batch, raw, X, ids, features_ms, probabilities, champion_ms)
+        if self.pool is None:
+            self._shadow(*job)
+        elif self._slots.acquire(blocking=False):
+            self.pool.submit(self._shadow, *job).add_done_callback(lambda _: self._slots.release())
+        else:
+            with self._lock:
+                self.dropped_batches += 1
+        return (probabilities, X_champion) if return_features else probabilities
+
+    def _shadow(self, batch, raw, X, ids, features_ms, champion_probabilities, champion_ms):
+        results = [(self.champion_version, 'champion', champion_probabilities, features_ms, champion_ms)]
+        for challenger in self.challengers:
+            start = time.perf_counter()
+            try:
+                with span('score.challenger', rows=len(X), model=challenger.version):
+                    # A challenger with its own transform pays for it in its latency
+                    X_model = X[:, challenger.columns] if challenger.transform is None \
+                        else challenger.transform.transform(raw)
+                    probabilities = challenger.model.predict_proba(X_model)[:, 1]
+            except Exception as e:
+                self._record(challenger.version, error=e)
+                continue
+            latency_ms = (time.perf_counter() - start) * 1000
+            self._record(challenger.version, latency_ms)
+            results.append((challenger.version, 'challenger', probabilities,
+                            features_ms if challenger.transform is None else 0.0, latency_ms))
+        if self.log is not None:
+            self.log.log(batch, ids, results)
+
+    def summary(self):
+        """Per-model batch latency percentiles over the last LATENCY_WINDOW batches (batches: how many), plus drops and errors."""
+        with self._lock:
+            latencies = {version: np.array(values) for version, values in self.latencies_ms.items()}
+            summary = {'dropped_batches': self.dropped_batches, 'models': []}
+            errors = dict(self.errors)
+        for version, values in latencies.items():
+            summary['models'].append({'version': version,
+                                      'role': 'champion' if version == self.champion_version else 'challenger',
+                                      'batches': len(values),
+                                      'p50_ms': round(float(np.percentile(values, 50)), 3) if len(values) else None,
+                                      'p99_ms': round(float(np.percentile(values, 99)), 3) if len(values) else None,
+                                      'errors': errors.get(version, 0)})
+        return summary
+
+    def close(self):
+        """Waits for the queued challenger batches, so their scores reach the log."""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+
+def load_multi_model_scorer(models_dir="../models", challengers=None, engine="compiled", single_threaded=False,
+                            log_dir="../logs", background=True):
+    """
+    A MultiModelScorer for the current registry version and `challengers` (default: the registry's
+    CHALLENGERS list). log_dir=None keeps scores out of the shadow log (latencies are still summarised).
+    """
+    registry = ModelRegistry(models_dir)
+    champion_version = registry.current_version()
+    if champion_version is None:
+        raise FileNotFoundError(f"No registered model in {models_dir}. Run train_model.py first.")
+    versions = [version for version in (registry.challengers() if challengers is None else challengers)
+                if version != champion_version]
+    champion, transform = load_scoring_artifacts(models_dir, single_threaded, engine, champion_version)
+    hasher = FileHasher()
+    transform_digest = hasher.digest(os.path.join(registry.path(champion_version), TRANSFORM_FILE))
+
+    features = list(transform.feature_names)
+    loaded = []
+    for version in versions:
+        model, own_transform = load_scoring_artifacts(models_dir, single_threaded, engine, version)
+        shared = hasher.digest(os.path.join(registry.path(version), TRANSFORM_FILE)) == transform_digest
+        if shared:
+            features += [name for name in own_transform.feature_names if name not in features]
+        loaded.append((version, model, own_transform, shared))
+    n_champion = len(transform.feature_names)
+    transform.select_features(features)
+    position = {name: i for i, name in enumerate(features)}
+    challenger_models = [Challenger(version, model, columns=np.array([position[name] for name in own_transform.feature_names]))
+                         if shared else Challenger(version, model, transform=own_transform)
+                         for version, model, own_transform, shared in loaded]
+
+    return MultiModelScorer(champion_version, champion, transform, challenger_models, n_champion,
+                            log=ShadowLog(log_dir) if log_dir else None, background=background)
+
+def compare_models(labels_path, log_dir="../logs", models_dir="../models"):
+    """
+    Joins the shadow log with a file of known outcomes (ID and the target column) and evaluates
+    every logged version with evaluate_predictions on the applicants all of them scored (the last
+    score per applicant and version). Returns (metrics, latency) DataFrames.
+    """
+    if not os.path.exists(os.path.join(log_dir, SCORES_FILE)):
+        raise FileNotFoundError(f"No shadow log in {log_dir}. Score with challengers set first (model_registry.py challengers).")
+    scores = pd.read_csv(os.path.join(log_dir, SCORES_FILE), usecols=['ID', 'VERSION', 'DEFAULT_PROBABILITY'],
+                         dtype={'ID': str, 'VERSION': str}).dropna(subset=['ID'])
+    labels = pd.read_csv(labels_path, usecols=['ID', TARGET_COL], dtype={'ID': str}).drop_duplicates('ID', keep='last')
+    wide = scores.drop_duplicates(['ID', 'VERSION'], keep='last').pivot(index='ID', columns='VERSION',
+                                                                        values='DEFAULT_PROBABILITY')
+    wide = wide.dropna().join(labels.set_index('ID'), how='inner')
+    if wide.empty:
+        raise ValueError(f"None of the applicants in {labels_path} were scored by every logged model.")
+
+    registry = ModelRegistry(models_dir)
+    known = set(registry.versions())
+    names = {version: registry.metadata(version)['model_name'] if version in known else version
+             for version in wide.columns.drop(TARGET_COL)}
+    y = wide[TARGET_COL].to_numpy()
+    metrics = []
+    for version, name in names.items():
+        probabilities = wide[version].to_numpy()
+        row = evaluate_predictions(y, (probabilities > 0.5).astype(int), probabilities, f"{name} ({version})")
+        metrics.append({**row, 'Applicants': len(y)})
+
+    latency = pd.read_csv(os.path.join(log_dir, LATENCY_FILE), dtype={'VERSION': str})
+    latency = latency.groupby(['VERSION', 'ROLE']).agg(
+        batches=('LATENCY_MS', 'size'), rows=('ROWS', 'sum'), p50_ms=('LATENCY_MS', 'median'),
+        p99_ms=('LATENCY_MS', lambda values: values.quantile(0.99)), total_ms=('LATENCY_MS', 'sum'),
+        features_ms=('FEATURES_MS', 'sum')).reset_index()
+    latency['us_per_row'] = latency['total_ms'] * 1000 / latency['rows']
+    return pd.DataFrame(metrics), latency.drop(columns=['total_ms'])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the champion and challengers on their shadow-logged scores.")
+    parser.add_argument("--labels", required=True, help="CSV with the ID and target column of applicants whose outcome is known")
+    parser.add_argument("--log-dir", default="../logs")
+    parser.add_argument("--models-dir", default="../models")
+    args = parser.parse_args()
+
+    metrics, latency = compare_models(args.labels, args.log_dir, args.models_dir)
+    print(f"Models on the {metrics['Applicants'].iloc[0]:,} labelled applicants every one of them scored:")
+    print(metrics.drop(columns=['Applicants']).to_string(index=False))
+    print("\nBatch latency per model (features_ms: the shared feature matrix, built once per batch):")
+    print(latency.round(3).to_string(index=False))
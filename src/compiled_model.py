@@ -0,0 +1,258 @@
+import json
+import os
+import shutil
+import numpy as np
+
+# Trees are stored as flat node arrays shared by the whole ensemble. A leaf has left == -1.
+TREE_ARRAYS = ['feature', 'threshold', 'left', 'right', 'missing_left', 'value', 'roots']
+# Rows evaluated together by the tree walker
+ROW_BLOCK = 4096
+# Metadata file of the directory layout (one .npy file per array next to it)
+META_FILE = 'meta.json'
+
+def _sigmoid(margin):
+    # exp overflows to inf for margins below about -709, which correctly gives 0
+    with np.errstate(over='ignore'):
+        return 1.0 / (1.0 + np.exp(-margin))
+
+def _float32_floor(threshold):
+    """
+    Largest float32 t32 with t32 <= threshold, so `x32 <= t32` decides exactly like `x32 <= threshold`
+    for every float32 input. Thresholds can then be stored (and compared) in float32.
+    """
+    threshold = np.asarray(threshold, dtype=np.float64)
+    t32 = threshold.astype(np.float32)
+    too_high = t32.astype(np.float64) > threshold
+    t32[too_high] = np.nextafter(t32[too_high], np.float32(-np.inf))
+    return t32
+
+class CompiledModel:
+    """
+    Dependency-free evaluator for the saved model, built by export_compiled_model().
+
+    kind='forest' averages leaf probabilities (RandomForest), kind='boosted' sums leaf margins on
+    top of `bias` and applies a sigmoid (XGBoost), kind='linear' is sigmoid(X @ coef + bias)
+    (LogisticRegression). Only NumPy is needed to load and evaluate it, and predict_proba
+    matches the sklearn interface so it can stand in for the original estimator.
+    """
+
+    def __init__(self, kind, feature_names, bias=0.0, coef=None, **trees):
+        self.kind = kind
+        self.feature_names = list(feature_names)
+        self.bias = float(bias)
+        self.coef = None if coef is None else np.asarray(coef, dtype=np.float64)
+        for name in TREE_ARRAYS:
+            setattr(self, name, trees.get(name))
+
+    def _leaf_sum(self, X):
+        """
+        Sends every (row, tree) pair down its tree at once. Pairs that reach a leaf are accumulated
+        and dropped, so each level only touches the paths that are still descending.
+        """
+        n_rows, n_cols = X.shape
+        n_trees = len(self.roots)
+        flat_X = X.ravel()
+        row_offsets = np.repeat(np.arange(n_rows, dtype=np.int64) * n_cols, n_trees)
+        rows = np.repeat(np.arange(n_rows), n_trees)
+        nodes = np.tile(self.roots, n_rows)
+        total = np.zeros(n_rows)
+        while len(nodes):
+            left = self.left[nodes]
+            is_leaf = left < 0
+            if is_leaf.any():
+                total += np.bincount(rows[is_leaf], weights=self.value[nodes[is_leaf]], minlength=n_rows)
+                keep = ~is_leaf
+                row_offsets, rows, nodes, left = row_offsets[keep], rows[keep], nodes[keep], left[keep]
+            x = flat_X[row_offsets + self.feature[nodes]]
+            go_left = x <= self.threshold[nodes]
+            missing = np.isnan(x)
+            if missing.any():
+                go_left[missing] = self.missing_left[nodes[missing]]
+            nodes = np.where(go_left, left, self.right[nodes])
+        return total
+
+    def walk(self, X):
+        """
+        Sends every (row, tree) pair of a float32 matrix down its tree like _leaf_sum and yields,
+        once per tree level, (rows, nodes, children): the internal nodes the still-descending pairs
+        are at and the children they move to.
+        """
+        n_rows, n_cols = X.shape
+        flat_X = X.ravel()
+        rows = np.repeat(np.arange(n_rows, dtype=np.int64), len(self.roots))
+        nodes = np.tile(self.roots, n_rows)
+        while len(nodes):
+            internal = self.left[nodes] >= 0
+            rows, nodes = rows[internal], nodes[internal]
+            if not len(nodes):
+                break
+            x = flat_X[rows * n_cols + self.feature[nodes]]
+            go_left = x <= self.threshold[nodes]
+            missing = np.isnan(x)
+            if missing.any():
+                go_left[missing] = self.missing_left[nodes[missing]]
+            children = np.where(go_left, self.left[nodes], self.right[nodes])
+            yield rows, nodes, children
+            nodes = children
+
+    def predict_default_probability(self, X):
+        """P(default) for each row of the model's feature matrix."""
+        if self.kind == 'linear':
+            return _sigmoid(np.asarray(X, dtype=np.float64) @ self.coef + self.bias)
+        # Both sklearn and XGBoost evaluate trees on float32 inputs
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        X = X.reshape(1, -1) if X.ndim == 1 else X
+        # Row blocks keep the per-level working set in cache for large batches
+        leaf_sum = np.concatenate([self._leaf_sum(X[start:start + ROW_BLOCK])
+                                   for start in range(0, len(X), ROW_BLOCK)]) if len(X) else np.zeros(0)
+        if self.kind == 'forest':
+            return leaf_sum / len(self.roots)
+        return _sigmoid(leaf_sum + self.bias)
+
+    def predict_proba(self, X):
+        p = self.predict_default_probability(X)
+        return np.column_stack([1 - p, p])
+
+    def predict(self, X):
+        return (self.predict_default_probability(X) > 0.5).astype(int)
+
+    def save(self, path):
+        """
+        Saves to a single .npz file, or, for any other path, to a directory with one .npy file per
+        array plus meta.json. Only the directory layout can be memory-mapped by load_compiled_model.
+        """
+        arrays = {name: getattr(self, name) for name in TREE_ARRAYS if getattr(self, name) is not None}
+        if self.coef is not None:
+            arrays['coef'] = self.coef
+        meta = {'kind': self.kind, 'feature_names': self.feature_names, 'bias': self.bias}
+        if path.endswith('.npz'):
+            np.savez(path, meta=np.array(json.dumps(meta)), **arrays)
+        else:
+            tmp_path = path + '.tmp'
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            for name, values in arrays.items():
+                np.save(os.path.join(tmp_path, name + '.npy'), values)
+            with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+                json.dump(meta, f)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+        print(f"Saved compiled model to {path}")
+
+def load_compiled_model(path, mmap_mode=None):
+    """
+    Loads a CompiledModel saved with CompiledModel.save (NumPy only). For the directory layout,
+    mmap_mode='r' maps the arrays instead of reading them: loading is then independent of the
+    model size, and processes serving the same files share one copy in the page cache.
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        # asarray drops the np.memmap subclass (cheaper indexing) but keeps the mapped buffer
+        arrays = {name[:-4]: np.asarray(np.load(os.path.join(path, name), mmap_mode=mmap_mode))
+                  for name in os.listdir(path) if name.endswith('.npy')}
+    else:
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            arrays = {name: data[name] for name in data.files if name != 'meta'}
+    return CompiledModel(meta['kind'], meta['feature_names'], meta['bias'], **arrays)
+
+def _stack_trees(trees):
+    """Concatenates per-tree node arrays into one flat ensemble, offsetting child indices."""
+    stacked = {name: [] for name in TREE_ARRAYS}
+    offset = 0
+    for tree in trees:
+        n_nodes = len(tree['left'])
+        is_leaf = tree['left'] < 0
+        stacked['roots'].append(offset)
+        stacked['feature'].append(np.where(is_leaf, 0, tree['feature']).astype(np.int32))
+        stacked['threshold'].append(_float32_floor(np.where(is_leaf, 0.0, tree['threshold'])))
+        stacked['left'].append(np.where(is_leaf, -1, tree['left'] + offset).astype(np.int32))
+        stacked['right'].append(np.where(is_leaf, -1, tree['right'] + offset).astype(np.int32))
+        stacked['missing_left'].append(np.asarray(tree['missing_left'], dtype=bool))
+        stacked['value'].append(np.where(is_leaf, tree['value'], 0.0))
+        offset += n_nodes
+    arrays = {name: np.concatenate(parts) for name, parts in stacked.items() if name != 'roots'}
+    arrays['roots'] = np.array(stacked['roots'], dtype=np.int32)
+    return arrays
+
+def _export_random_forest(model):
+    trees = []
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        # Leaf class weights -> P(class 1), exactly what predict_proba averages over trees
+        value = tree.value[:, 0, :]
+        proba = value[:, 1] / np.maximum(value.sum(axis=1), 1e-300)
+        trees.append({'feature': tree.feature, 'threshold': tree.threshold,
+                      'left': tree.children_left, 'right': tree.children_right,
+                      # sklearn routes missing values to the side chosen during training
+                      'missing_left': tree.missing_go_to_left.astype(bool) if hasattr(tree, 'missing_go_to_left')
+                      else np.ones(tree.node_count, dtype=bool),
+                      'value': proba})
+    return CompiledModel('forest', [], **_stack_trees(trees))
+
+def _export_xgboost(model):
+    learner = json.loads(model.get_booster().save_raw('json'))['learner']
+    if learner['objective']['name'] != 'binary:logistic':
+        raise ValueError(f"Unsupported XGBoost objective: {learner['objective']['name']}")
+    raw_trees = learner['gradient_booster']['model']['trees']
+    # predict_proba stops at the best round when early stopping was used
+    best_iteration = getattr(model, 'best_iteration', None)
+    if best_iteration is not None:
+        raw_trees = raw_trees[:best_iteration + 1]
+
+    trees = []
+    for tree in raw_trees:
+        left = np.array(tree['left_children'])
+        conditions = np.array(tree['split_conditions'], dtype=np.float64)
+        # XGBoost goes left when x < condition; for float32 x that is x <= the next float32 below it
+        threshold = np.nextafter(conditions.astype(np.float32), np.float32(-np.inf)).astype(np.float64)
+        trees.append({'feature': np.array(tree['split_indices']), 'threshold': threshold,
+                      'left': left, 'right': np.array(tree['right_children']),
+                      'missing_left': np.array(tree['default_left'], dtype=bool),
+                      # leaf weights are stored in split_conditions
+                      'value': conditions})
+
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    bias = np.log(base_score / (1 - base_score))
+    return CompiledModel('boosted', [], bias=bias, **_stack_trees(trees))
+
+def _export_logistic_regression(model):
+    # Also covers SGDClassifier(loss='log_loss'), the partial_fit form warm_start_training.py updates
+    if getattr(model, 'loss', 'log_loss') != 'log_loss':
+        raise ValueError(f"Only log-loss linear models give probabilities, not loss='{model.loss}'")
+    return CompiledModel('linear', [], bias=model.intercept_[0], coef=model.coef_[0])
+
+def export_compiled_model(model, feature_names):
+    """Flattens a fitted RandomForest, XGBoost or LogisticRegression / SGDClassifier into a CompiledModel."""
+    name = type(model).__name__
+    if name == 'RandomForestClassifier':
+        compiled = _export_random_forest(model)
+    elif name == 'XGBClassifier':
+        compiled = _export_xgboost(model)
+    elif name in ('LogisticRegression', 'SGDClassifier'):
+        compiled = _export_logistic_regression(model)
+    else:
+        raise ValueError(f"Don't know how to compile a {name}")
+    compiled.feature_names = list(feature_names)
+    return compiled
+
+def check_parity(compiled, model, X, atol=1e-5):
+    """Compares compiled and original probabilities on X; raises if they differ by more than atol."""
+    expected = model.predict_proba(X)[:, 1]
+    actual = compiled.predict_default_probability(np.asarray(X, dtype=np.float64))
+    max_diff = float(np.abs(expected - actual).max())
+    print(f"Compiled model parity on {len(X):,} rows: max |diff| = {max_diff:.2e}")
+    if max_diff > atol:
+        raise AssertionError(f"Compiled model deviates from {type(model).__name__} by {max_diff:.2e} (> {atol})")
+    return max_diff
+
+if __name__ == "__main__":
+    import joblib
+    from data_store import intermediate_path, load_dataset
+
+    model = joblib.load("../models/best_model.pkl")
+    feature_names = joblib.load("../models/feature_names.pkl")
+    compiled = export_compiled_model(model, feature_names)
+    check_parity(compiled, model, load_dataset(intermediate_path("engineered_loan_data"), feature_names))
+    compiled.save("../models/compiled_model.npz")
@@ -1,9 +1,63 @@
+import numpy as np
 import pandas as pd
-from sklearn.preprocessing import StandardScaler
+from data_store import intermediate_path, save_dataset, memory_report
+from instrumentation import instrumented
 
+TARGET_COL = 'default.payment.next.month'
+# These columns are categorical but represented as integers
+CATEGORICAL_COLS = ['SEX', 'EDUCATION', 'MARRIAGE']
+# PAY_X are repayment statuses (categorical-ish), they are never scaled
+PAY_STATUS_COLS = ['PAY_0', 'PAY_2', 'PAY_3', 'PAY_4', 'PAY_5', 'PAY_6']
+
+# Explicit dtypes of the UCI layout instead of pandas' int64/float64 inference. Statuses, the
+# small categorical codes, AGE and the target fit in int8; the amounts are whole numbers far
+# inside float32's exact integer range (2**24).
+RAW_SCHEMA = {
+    'ID': np.int32,
+    'LIMIT_BAL': np.float32,
+    **{col: np.int8 for col in CATEGORICAL_COLS},
+    'AGE': np.int8,
+    **{col: np.int8 for col in PAY_STATUS_COLS},
+    **{f'BILL_AMT{month}': np.float32 for month in range(1, 7)},
+    **{f'PAY_AMT{month}': np.float32 for month in range(1, 7)},
+    TARGET_COL: np.int8,
+}
+# What read_csv parses each column as; integer columns may hold NaN until they are imputed
+RAW_READ_DTYPES = {col: np.float32 for col in RAW_SCHEMA if col != 'ID'}
+
+def apply_schema(df):
+    """
+    Casts the RAW_SCHEMA columns of df to their compact dtype. Integer columns that still hold
+    NaN (or non-integral values) stay floating point; values outside the schema's range are an error
+    rather than being wrapped around.
+    """
+    for col, dtype in RAW_SCHEMA.items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+        target = np.dtype(dtype)
+        if target.kind == 'i':
+            values = df[col].to_numpy(dtype=np.float64)
+            if np.isnan(values).any() or not np.array_equal(values, np.round(values)):
+                target = np.result_type(df[col].dtype, np.float32)
+            elif len(values) and (values.min() < np.iinfo(target).min or values.max() > np.iinfo(target).max):
+                raise ValueError(f"Column '{col}' has values outside the {target} range of RAW_SCHEMA.")
+        df[col] = df[col].astype(target)
+    return df
+
+def read_raw_csv(filepath, **kwargs):
+    """
+    pd.read_csv of a file in the UCI layout with the RAW_SCHEMA dtypes. Extra arguments go to
+    read_csv; with chunksize= the chunks are cast one at a time.
+    """
+    reader = pd.read_csv(filepath, dtype=RAW_READ_DTYPES, **kwargs)
+    if kwargs.get('chunksize') is None:
+        return apply_schema(reader)
+    return (apply_schema(chunk) for chunk in reader)
+
+@instrumented('preprocess.load_data')
 def load_data(filepath):
     """Loads the dataset and prints basic info."""
-    df = pd.read_csv(filepath)
+    df = read_raw_csv(filepath)
     print("--- DATASET SHAPE ---")
     print(df.shape)
     print("\n--- DATASET INFO ---")
@@ -12,6 +66,7 @@ def load_data(filepath):
     print(df.isnull().sum())
     return df
 
+@instrumented('preprocess.handle_missing_values')
 def handle_missing_values(df):
     """Handles any missing values in the dataset."""
     # The UCI Credit Card dataset usually doesn't have missing values.
@@ -24,8 +79,10 @@ def handle_missing_values(df):
         print("Missing values handled.")
     else:
         print("\nNo missing values found.")
-    return df
+    # Integer columns that held NaN can take their compact dtype now
+    return apply_schema(df)
 
+@instrumented('preprocess.encode_categorical')
 def encode_categorical(df):
     """Encodes categorical features. 
     In the UCI dataset, SEX, EDUCATION, MARRIAGE are already integers 
@@ -34,27 +91,33 @@ def encode_categorical(df):
     We will use One-Hot Encoding to be rigorous.
     """
     print("\nEncoding categorical features...")
-    # These columns are categorical but represented as integers
-    categorical_cols = ['SEX', 'EDUCATION', 'MARRIAGE']
     # One-Hot Encoding using pd.get_dummies
-    df = pd.get_dummies(df, columns=categorical_cols, drop_first=True)
+    df = pd.get_dummies(df, columns=CATEGORICAL_COLS, drop_first=True)
     print(f"Dataset shape after encoding: {df.shape}")
     return df
 
-def normalize_numerical(df, target_col='default.payment.next.month'):
+def get_numerical_columns(columns, target_col=TARGET_COL):
+    """Returns the encoded columns that normalize_numerical scales, in order."""
+    # Columns to normalize: LIMIT_BAL, AGE, BILL_AMT1-6, PAY_AMT1-6
+    # We will exclude ID, Target, and encoded categorical columns
+    encoded_prefixes = tuple(f'{col}_' for col in CATEGORICAL_COLS) + tuple(PAY_STATUS_COLS)
+    cols_to_exclude = ['ID', target_col] + [col for col in columns if col.startswith(encoded_prefixes)]
+    return [col for col in columns if col not in cols_to_exclude]
+
+@instrumented('preprocess.normalize_numerical')
+def normalize_numerical(df, target_col=TARGET_COL):
     """Normalizes numerical columns using StandardScaler."""
+    # Imported here so inference code that only needs the column definitions doesn't load scikit-learn
+    from sklearn.preprocessing import StandardScaler
     print("\nNormalizing numerical features...")
     scaler = StandardScaler()
-    
-    # Columns to normalize: LIMIT_BAL, AGE, BILL_AMT1-6, PAY_AMT1-6
-    # We will exclude ID, Target, and encoded categorical columns
-    cols_to_exclude = ['ID', target_col] + [col for col in df.columns if col.startswith(('SEX_', 'EDUCATION_', 'MARRIAGE_', 'PAY_0', 'PAY_2', 'PAY_3', 'PAY_4', 'PAY_5', 'PAY_6'))]
-    
-    # Actually, PAY_X are repayment statuses (categorical-ish). We'll leave them as is.
-    numerical_cols = [col for col in df.columns if col not in cols_to_exclude]
+    numerical_cols = get_numerical_columns(df.columns, target_col)
     
     if len(numerical_cols) > 0:
-        df[numerical_cols] = scaler.fit_transform(df[numerical_cols])
+        values = df[numerical_cols].to_numpy(dtype=np.float64)
+        scaler.fit(values)
+        # Scaled in float64 and stored as float32, the same rounding FeatureTransform applies at serving time
+        df[numerical_cols] = ((values - scaler.mean_) / scaler.scale_).astype(np.float32)
         
     print("Normalization complete.")
     return df
@@ -63,11 +126,18 @@ if __name__ == "__main__":
     filepath = "../data/raw/loan_default_data.csv"
     print("Executing Data Preprocessing Pipeline...\n")
     df = load_data(filepath)
+    memory_report(df, "raw")
     df = handle_missing_values(df)
+    
+    # Fit the serving-side transform on the same frame so inference reuses these exact statistics
+    from feature_pipeline import FeatureTransform
+    FeatureTransform().fit(df).save("../models/feature_transform.pkl")
+    
     df = encode_categorical(df)
     df = normalize_numerical(df)
+    memory_report(df, "processed")
     
     # Save the processed data
-    processed_path = "../data/processed/processed_loan_data.csv"
-    df.to_csv(processed_path, index=False)
+    processed_path = intermediate_path("processed_loan_data")
+    save_dataset(df, processed_path)
     print(f"\nProcessed data saved to {processed_path}")
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+
+# Intermediate datasets (processed/engineered) are stored as a directory of raw .npy column
+# blocks plus a schema.json sidecar. Set LOAN_DATA_FORMAT=csv to fall back to CSV files.
+INTERMEDIATE_FORMAT = os.environ.get('LOAN_DATA_FORMAT', 'columnar')
+COLUMNAR_SUFFIX = '.cols'
+SCHEMA_FILE = 'schema.json'
+# CSV intermediates get a {column: dtype} sidecar so they reload with the dtypes they were saved with
+CSV_DTYPES_SUFFIX = '.dtypes.json'
+# Bytes read at a time when hashing files
+HASH_BLOCK_SIZE = 1 << 20
+
+def intermediate_path(name, data_dir="../data/processed"):
+    """Returns the path of a pipeline intermediate in the configured on-disk format."""
+    suffix = '.csv' if INTERMEDIATE_FORMAT == 'csv' else COLUMNAR_SUFFIX
+    return os.path.join(data_dir, name + suffix)
+
+def save_columnar(df, path):
+    """
+    Writes each column of df as a contiguous .npy block and records names, dtypes and row count
+    in schema.json. The directory is replaced atomically so readers never see a partial write.
+    """
+    for col in df.columns:
+        if df[col].dtype == object:
+            raise TypeError(f"Column '{col}' has object dtype and cannot be stored in columnar format.")
+    writer = ColumnarWriter(path, {col: df[col].dtype for col in df.columns}, len(df))
+    writer.write(0, {col: df[col].to_numpy() for col in df.columns})
+    writer.close()
+
+def read_schema(path):
+    """Returns the schema.json of a columnar dataset."""
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        return json.load(f)
+
+def load_columnar(path, columns=None, mmap=True):
+    """
+    Opens a columnar dataset. Only the requested columns are touched, and with mmap=True each
+    column is a read-only memory map of its .npy file, so nothing is parsed or copied up front.
+    """
+    schema = read_schema(path)
+    entries = {entry['name']: entry for entry in schema['columns']}
+    if columns is None:
+        columns = [entry['name'] for entry in schema['columns']]
+
+    missing = [col for col in columns if col not in entries]
+    if missing:
+        raise KeyError(f"Columns not found in {path}: {missing}")
+
+    mmap_mode = 'r' if mmap else None
+    data = {col: np.load(os.path.join(path, entries[col]['file']), mmap_mode=mmap_mode) for col in columns}
+    return pd.DataFrame(data, copy=False)
+
+def dataset_columns(path):
+    """Lists the column names of a CSV or columnar dataset without loading its rows."""
+    if path.endswith(COLUMNAR_SUFFIX):
+        return [entry['name'] for entry in read_schema(path)['columns']]
+    return list(pd.read_csv(path, nrows=0).columns)
+
+def save_csv_dtypes(dtypes, path):
+    """Records the column dtypes of a CSV intermediate next to it."""
+    with open(path + CSV_DTYPES_SUFFIX, 'w') as f:
+        json.dump({col: np.dtype(dtype).str for col, dtype in dtypes.items()}, f, indent=2)
+
+def read_csv_dtypes(path):
+    """The dtypes recorded by save_csv_dtypes, or None for CSV files written without them."""
+    if not os.path.exists(path + CSV_DTYPES_SUFFIX):
+        return None
+    with open(path + CSV_DTYPES_SUFFIX) as f:
+        return {col: np.dtype(dtype) for col, dtype in json.load(f).items()}
+
+def save_dataset(df, path):
+    """Saves a pipeline intermediate, choosing CSV or columnar storage from the path suffix."""
+    if path.endswith(COLUMNAR_SUFFIX):
+        save_columnar(df, path)
+    else:
+        df.to_csv(path, index=False)
+        save_csv_dtypes(df.dtypes.to_dict(), path)
+
+def load_dataset(path, columns=None):
+    """Loads a pipeline intermediate, reading only `columns` when given."""
+    if path.endswith(COLUMNAR_SUFFIX):
+        return load_columnar(path, columns)
+    return pd.read_csv(path, usecols=columns, dtype=read_csv_dtypes(path))
+
+def memory_report(df, stage):
+    """
+    Prints how much memory a pipeline stage's frame takes, next to what the same frame would take
+    with pandas' default 64-bit inference (booleans stay one byte). Returns the size in bytes.
+    For memory-mapped frames this is the size of the mapped columns, not what is resident.
+    """
+    n_bytes = int(df.memory_usage(index=False, deep=True).sum())
+    wide_bytes = sum(len(df) * (1 if dtype == bool else 8) for dtype in df.dtypes)
+    dtype_counts = ", ".join(f"{count} {dtype}" for dtype, count in df.dtypes.astype(str).value_counts().items())
+    print(f"[memory] {stage}: {len(df):,} rows x {df.shape[1]} cols, {n_bytes / 2**20:,.1f} MB "
+          f"({wide_bytes / max(n_bytes, 1):.1f}x smaller than 64-bit; {dtype_counts})")
+    return n_bytes
+
+def update_rows(path, rows, block):
+    """
+    Overwrites rows `rows` (positions) of the columns in `block` ({column: values}) of a dataset.
+    Columnar datasets are patched in place through writable memory maps, so only the pages
+    holding those rows are rewritten; CSV datasets have to be rewritten whole.
+    """
+    if not path.endswith(COLUMNAR_SUFFIX):
+        df = pd.read_csv(path, dtype=read_csv_dtypes(path))
+        for col, values in block.items():
+            column = df[col].to_numpy().copy()
+            column[rows] = values
+            df[col] = column
+        df.to_csv(path, index=False)
+        return
+
+    entries = {entry['name']: entry for entry in read_schema(path)['columns']}
+    for col, values in block.items():
+        array = np.load(os.path.join(path, entries[col]['file']), mmap_mode='r+')
+        array[rows] = np.asarray(values).astype(array.dtype, copy=False)
+        array.flush()
+        del array
+
+class ColumnarWriter:
+    """Fills a preallocated columnar dataset one row range at a time, for outputs written in chunks."""
+
+    def __init__(self, path, dtypes, n_rows):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.columns = []
+        self.arrays = {}
+        for i, (col, dtype) in enumerate(dtypes.items()):
+            filename = f'col_{i:04d}.npy'
+            self.arrays[col] = np.lib.format.open_memmap(os.path.join(self.tmp_path, filename), mode='w+',
+                                                         dtype=dtype, shape=(n_rows,))
+            self.columns.append({'name': col, 'file': filename, 'dtype': np.dtype(dtype).str})
+        self.n_rows = n_rows
+
+    def write(self, start, block):
+        for col, values in block.items():
+            self.arrays[col][start:start + len(values)] = values
+
+    def close(self):
+        for array in self.arrays.values():
+            array.flush()
+        self.arrays = {}
+        with open(os.path.join(self.tmp_path, SCHEMA_FILE), 'w') as f:
+            json.dump({'n_rows': self.n_rows, 'columns': self.columns}, f, indent=2)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+
+class CsvWriter:
+    """Appends row blocks to a CSV file, writing the header with the first block (and the dtypes sidecar)."""
+
+    def __init__(self, path, dtypes=None):
+        self.path = path
+        self.header = True
+        for stale in (path, path + CSV_DTYPES_SUFFIX):
+            if os.path.exists(stale):
+                os.remove(stale)
+        if dtypes is not None:
+            save_csv_dtypes(dtypes, path)
+
+    def write(self, start, block):
+        pd.DataFrame(block).to_csv(self.path, mode='a', header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        pass
+
+class FileHasher:
+    """
+    SHA-256 of files and directories (all files below them, by relative path). Digests are cached
+    by (size, mtime) so a large input that hasn't changed is not read again on the next run.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache if cache is not None else {}
+        self.lock = threading.Lock()
+
+    def _file_digest(self, path):
+        stat = os.stat(path)
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+        with self.lock:
+            cached = self.cache.get(os.path.abspath(path))
+        if cached and cached[:2] == fingerprint:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        with self.lock:
+            self.cache[os.path.abspath(path)] = fingerprint + [digest.hexdigest()]
+        return digest.hexdigest()
+
+    def digest(self, path):
+        """Hash of a file or directory, or None when it doesn't exist."""
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    digest.update(f'{os.path.relpath(file_path, path)}\0{self._file_digest(file_path)}\0'.encode())
+            return digest.hexdigest()
+        if os.path.exists(path):
+            return self._file_digest(path)
+        return None
@@ -0,0 +1,212 @@
+import argparse
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+from model_registry import ModelRegistry, DRIFT_REFERENCE_FILE
+
+# Bins per feature: quantiles of the training data, or one bin per value for features with few values
+FEATURE_BINS = 10
+# Quantile bins of the training-time default probabilities
+PREDICTION_BINS = 20
+# Bin share assumed for empty bins, so PSI stays finite
+SMOOTHING = 1e-4
+# Usual PSI reading: below 0.1 stable, 0.1-0.25 worth a look, above 0.25 the population has shifted
+PSI_WARN = 0.1
+PSI_ALERT = 0.25
+# Rows compared against the bin edges at once (bounds the temporary memory of large batches)
+UPDATE_BLOCK = 8192
+METRIC_PREFIX = 'loan_drift'
+PREDICTION_NAME = 'default_probability'
+
+def bin_edges(values, n_bins):
+    """
+    Interior bin edges of one feature: midpoints between the distinct values when there are at most
+    n_bins of them (flags, one-hot columns, repayment statuses), otherwise unique quantiles.
+    """
+    values = values[~np.isnan(values)]
+    distinct = np.unique(values)
+    if len(distinct) <= n_bins:
+        return (distinct[1:] + distinct[:-1]) / 2
+    return np.unique(np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1]))
+
+class ReferenceProfile:
+    """
+    Bin edges and training-time bin counts of every model feature and of the predicted default
+    probability. Built by train_model.py and stored with the model version it describes.
+    Edges are padded with +inf to a (n_features, max_bins - 1) matrix so binning is one comparison.
+    """
+
+    def __init__(self, feature_names, feature_edges, feature_counts, prediction_edges, prediction_counts):
+        self.feature_names = list(feature_names)
+        self.feature_edges = np.asarray(feature_edges, dtype=np.float64)
+        self.feature_counts = np.asarray(feature_counts, dtype=np.int64)
+        self.prediction_edges = np.asarray(prediction_edges, dtype=np.float64)
+        self.prediction_counts = np.asarray(prediction_counts, dtype=np.int64)
+        # Bins actually used per feature (the rest of the row is padding)
+        self.n_bins = (self.feature_edges < np.inf).sum(axis=1) + 1
+
+    @classmethod
+    def from_data(cls, X, probabilities, feature_names, n_bins=FEATURE_BINS, prediction_bins=PREDICTION_BINS):
+        """Profiles a training matrix (model feature order) and the model's probabilities on it."""
+        X = np.asarray(X, dtype=np.float64)
+        edges = [bin_edges(X[:, j], n_bins) for j in range(X.shape[1])]
+        padded = np.full((len(edges), max(len(e) for e in edges)), np.inf)
+        for j, e in enumerate(edges):
+            padded[j, :len(e)] = e
+        prediction_edges = bin_edges(np.asarray(probabilities, dtype=np.float64), prediction_bins)
+        profile = cls(feature_names, padded, np.zeros((len(edges), padded.shape[1] + 1)),
+                      prediction_edges, np.zeros(len(prediction_edges) + 1))
+        # Counted by the same code as live traffic, so both sides are binned identically
+        monitor = DriftMonitor(profile)
+        monitor.update(X, probabilities)
+        profile.feature_counts = monitor.feature_counts
+        profile.prediction_counts = monitor.prediction_counts
+        return profile
+
+    def save(self, path):
+        np.savez(path, feature_names=np.array(self.feature_names), feature_edges=self.feature_edges,
+                 feature_counts=self.feature_counts, prediction_edges=self.prediction_edges,
+                 prediction_counts=self.prediction_counts)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['feature_names'].tolist(), data['feature_edges'], data['feature_counts'],
+                       data['prediction_edges'], data['prediction_counts'])
+
+def load_drift_reference(models_dir="../models", version=None):
+    """The reference profile of a registry version (default: the current one), or None if it has none."""
+    registry = ModelRegistry(models_dir)
+    if version is None and registry.current_version() is None:
+        return None
+    path = os.path.join(registry.path(version), DRIFT_REFERENCE_FILE)
+    return ReferenceProfile.load(path) if os.path.exists(path) else None
+
+def psi(expected, actual):
+    """Population stability index between two count vectors over the same bins."""
+    expected = np.maximum(expected / max(expected.sum(), 1), SMOOTHING)
+    actual = np.maximum(actual / max(actual.sum(), 1), SMOOTHING)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+def binned_ks(expected, actual):
+    """Largest gap between the two cumulative distributions, read at the bin edges."""
+    return float(np.abs(np.cumsum(expected / max(expected.sum(), 1))
+                        - np.cumsum(actual / max(actual.sum(), 1))).max())
+
+class DriftMonitor:
+    """
+    Incremental histograms of scored traffic over the reference profile's fixed bins.
+
+    update() bins every feature of a batch with one broadcast comparison against the padded edge
+    matrix and adds the counts, so a row costs O(features x bins) with bins fixed, and the state is
+    a few hundred integers however many rows pass through. Safe to share between threads.
+    With export_path set, the Prometheus text snapshot is rewritten at most every
+    export_interval seconds, from inside update().
+    """
+
+    def __init__(self, reference, export_path=None, export_interval=60):
+        self.reference = reference
+        n_features, n_edges = reference.feature_edges.shape
+        self.feature_counts = np.zeros((n_features, n_edges + 1), dtype=np.int64)
+        self.prediction_counts = np.zeros(len(reference.prediction_edges) + 1, dtype=np.int64)
+        self.rows = 0
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self._last_export = time.monotonic()
+        self._offsets = np.arange(n_features) * (n_edges + 1)
+        self._lock = threading.Lock()
+
+    def update(self, X, probabilities):
+        """Adds a scored batch: X in model feature order, probabilities its P(default)."""
+        X = np.asarray(X)
+        n_features, n_bins = self.feature_counts.shape
+        counts = np.zeros(n_features * n_bins, dtype=np.int64)
+        for start in range(0, len(X), UPDATE_BLOCK):
+            block = X[start:start + UPDATE_BLOCK]
+            # Number of edges <= value; NaN compares False everywhere and lands in the first bin
+            bins = (block[:, :, None] >= self.reference.feature_edges).sum(axis=2) + self._offsets
+            counts += np.bincount(bins.ravel(), minlength=len(counts))
+        predictions = np.bincount(np.searchsorted(self.reference.prediction_edges, probabilities, side='right'),
+                                  minlength=len(self.prediction_counts))
+        self.merge(counts.reshape(n_features, n_bins), predictions, len(X))
+
+    def merge(self, feature_counts, prediction_counts, rows):
+        """Adds counts gathered elsewhere (another process's monitor, a resumed job)."""
+        with self._lock:
+            self.feature_counts += feature_counts
+            self.prediction_counts += prediction_counts
+            self.rows += rows
+            export = self.export_path and time.monotonic() - self._last_export >= self.export_interval
+            if export:
+                self._last_export = time.monotonic()
+        if export:
+            self.write_prometheus(self.export_path)
+
+    def report(self):
+        """PSI and binned KS of every feature and of the prediction, worst PSI first."""
+        with self._lock:
+            feature_counts = self.feature_counts.copy()
+            prediction_counts = self.prediction_counts.copy()
+        reference = self.reference
+        rows = []
+        for j, name in enumerate(reference.feature_names):
+            used = slice(0, reference.n_bins[j])
+            rows.append((name, psi(reference.feature_counts[j, used], feature_counts[j, used]),
+                         binned_ks(reference.feature_counts[j, used], feature_counts[j, used])))
+        rows.append((PREDICTION_NAME, psi(reference.prediction_counts, prediction_counts),
+                     binned_ks(reference.prediction_counts, prediction_counts)))
+        df = pd.DataFrame(rows, columns=['feature', 'psi', 'ks'])
+        df['status'] = np.select([df['psi'] >= PSI_ALERT, df['psi'] >= PSI_WARN], ['shifted', 'watch'], default='stable')
+        return df.sort_values('psi', ascending=False, ignore_index=True)
+
+    def prometheus_snapshot(self):
+        """The report in the Prometheus text exposition format (like instrumentation.prometheus_snapshot)."""
+        report = self.report()
+        lines = [f'# HELP {METRIC_PREFIX}_rows_total Scored rows compared with the training profile',
+                 f'# TYPE {METRIC_PREFIX}_rows_total counter', f'{METRIC_PREFIX}_rows_total {self.rows}']
+        for metric, help_text in (('psi', 'Population stability index against the training profile'),
+                                  ('ks', 'Largest gap between live and training CDFs at the bin edges')):
+            lines += [f'# HELP {METRIC_PREFIX}_{metric} {help_text}', f'# TYPE {METRIC_PREFIX}_{metric} gauge']
+            lines += [f'{METRIC_PREFIX}_{metric}{{feature="{row.feature}"}} {getattr(row, metric):.9g}'
+                      for row in report.itertuples()]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Writes the snapshot atomically (for a node_exporter textfile collector, say)."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_snapshot())
+        os.replace(tmp_path, path)
+
+def print_report(monitor, limit=None):
+    report = monitor.report()
+    print(f"Drift against the training profile over {monitor.rows:,} scored rows "
+          f"(PSI >= {PSI_WARN}: watch, >= {PSI_ALERT}: shifted):")
+    print(report.head(limit).to_string(index=False, float_format=lambda value: f'{value:.4f}'))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a raw applicant file with the current model's training profile.")
+    parser.add_argument("--input", default="../data/raw/loan_default_data.csv")
+    parser.add_argument("--models-dir", default="../models")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    parser.add_argument("--prometheus", default=None, help="Also write the result as a Prometheus text file")
+    args = parser.parse_args()
+
+    from scoring import load_scoring_artifacts, predict_default_probability
+    reference = load_drift_reference(args.models_dir)
+    if reference is None:
+        raise SystemExit("The current model has no drift reference profile. Re-run train_model.py.")
+    model, transform = load_scoring_artifacts(args.models_dir, engine="compiled")
+    monitor = DriftMonitor(reference)
+    start = time.perf_counter()
+    for chunk in pd.read_csv(args.input, chunksize=args.chunksize):
+        predict_default_probability(model, transform, chunk, monitor=monitor)
+    print(f"Scored and profiled {monitor.rows:,} rows in {time.perf_counter() - start:.1f}s\n")
+    print_report(monitor)
+    if args.prometheus:
+        monitor.write_prometheus(args.prometheus)
+        print(f"\nWrote drift metrics to {args.prometheus}")
@@ -1,15 +1,27 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import os
+from data_preprocessing import TARGET_COL, read_raw_csv
 
 # Create visualizations directory if it doesn't exist
 os.makedirs('../visualizations', exist_ok=True)
 
+# Rows per chunk of the streaming pass
+EDA_CHUNKSIZE = 200_000
+# Columns shown as boxplots by default status
+BOXPLOT_FEATURES = ['LIMIT_BAL', 'AGE']
+# LIMIT_BAL is split into this many equal-frequency bins for the default-rate plot
+LIMIT_BAL_BINS = 5
+
 def load_data():
-    return pd.read_csv('../data/raw/loan_default_data.csv')
+    return read_raw_csv('../data/raw/loan_default_data.csv')
 
-def plot_class_distribution(df):
+def plot_class_distribution(df, output_dir='../visualizations'):
     """
     Insight: Checks for class imbalance. If there are way more '0's (No Default) 
     than '1's (Default), the model might become biased.
@@ -26,11 +38,11 @@ def plot_class_distribution(df):
                     ha='center', va='bottom', fontsize=12)
         
     plt.tight_layout()
-    plt.savefig('../visualizations/class_distribution.png')
+    plt.savefig(os.path.join(output_dir, 'class_distribution.png'))
     plt.close()
     print("Saved class_distribution.png")
 
-def plot_correlation_heatmap(df):
+def plot_correlation_heatmap(df, output_dir='../visualizations'):
     """
     Insight: Shows which features are highly correlated. 
     High correlation with target is good. High correlation between two features (e.g., PAY_AMT1 and PAY_AMT2) 
@@ -43,11 +55,11 @@ def plot_correlation_heatmap(df):
     sns.heatmap(corr, annot=False, cmap='coolwarm', linewidths=0.5)
     plt.title('Feature Correlation Heatmap')
     plt.tight_layout()
-    plt.savefig('../visualizations/correlation_heatmap.png')
+    plt.savefig(os.path.join(output_dir, 'correlation_heatmap.png'))
     plt.close()
     print("Saved correlation_heatmap.png")
 
-def plot_boxplots(df):
+def plot_boxplots(df, output_dir='../visualizations'):
     """
     Insight: Boxplots show the median, quartiles, and outliers. 
     Useful for identifying if defaulters have significantly different distributions 
@@ -63,11 +75,11 @@ def plot_boxplots(df):
         plt.xlabel('Default (0=No, 1=Yes)')
     
     plt.tight_layout()
-    plt.savefig('../visualizations/boxplots.png')
+    plt.savefig(os.path.join(output_dir, 'boxplots.png'))
     plt.close()
     print("Saved boxplots.png")
 
-def plot_default_rate_by_limit_bal(df):
+def plot_default_rate_by_limit_bal(df, output_dir='../visualizations'):
     """
     Insight: LIMIT_BAL is a proxy for loan amount/income limit. 
     We bin the balances to see if people with lower or higher limits default more.
@@ -84,17 +96,227 @@ def plot_default_rate_by_limit_bal(df):
     plt.ylabel('Default Rate')
     plt.xticks(rotation=45)
     plt.tight_layout()
-    plt.savefig('../visualizations/default_rate_by_limit_bal.png')
+    plt.savefig(os.path.join(output_dir, 'default_rate_by_limit_bal.png'))
     plt.close()
     print("Saved default_rate_by_limit_bal.png")
     # Clean up the temp column
     df.drop('LIMIT_BAL_BINS', axis=1, inplace=True)
 
+class ValueCounts:
+    """
+    Exact, mergeable distribution of a column per class: the count of every distinct value.
+    The boxplot and binning columns are whole dollars / years, so the number of distinct
+    values stays small however many rows are seen, and quantiles come out exact.
+    """
+
+    def __init__(self):
+        # label -> (sorted distinct values, counts)
+        self.by_label = {}
+
+    @staticmethod
+    def _merge(*distributions):
+        values, inverse = np.unique(np.concatenate([values for values, _ in distributions]), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([counts for _, counts in distributions]))
+        return values, counts.astype(np.int64)
+
+    def update(self, values, labels):
+        keep = ~np.isnan(values)
+        values, labels = values[keep], labels[keep]
+        for label in np.unique(labels).tolist():
+            new = np.unique(values[labels == label], return_counts=True)
+            self.by_label[label] = self._merge(self.by_label[label], new) if label in self.by_label else new
+
+    def distribution(self, label=None):
+        """(sorted distinct values, counts) for one class, or all rows with label=None."""
+        if label is None:
+            return self._merge(*self.by_label.values())
+        return self.by_label[label]
+
+def _weighted_quantile(values, counts, q):
+    """np.quantile (linear interpolation) of the data that repeats values[i] counts[i] times."""
+    ends = np.cumsum(counts)
+    position = np.asarray(q, dtype=np.float64) * (ends[-1] - 1)
+    low = values[np.searchsorted(ends, np.floor(position), side='right')]
+    high = values[np.searchsorted(ends, np.ceil(position), side='right')]
+    return low + (high - low) * (position - np.floor(position))
+
+def _box_stats(values, counts, label):
+    """Matplotlib bxp() statistics (1.5 IQR whiskers) computed from a value distribution."""
+    q1, median, q3 = _weighted_quantile(values, counts, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    return {'label': str(label), 'q1': q1, 'med': median, 'q3': q3, 'whislo': inside.min(), 'whishi': inside.max(),
+            'fliers': values[(values < inside.min()) | (values > inside.max())]}
+
+class EdaAggregates:
+    """
+    Everything the EDA plots need, accumulated in one pass over the raw file chunk by chunk:
+    class counts, per-class value counts of the boxplot / binning columns, and shifted sums of
+    products for a pairwise-complete correlation matrix (what DataFrame.corr() computes).
+    Memory depends on the number of columns and distinct values, not on the number of rows.
+    """
+
+    def __init__(self, target_col=TARGET_COL):
+        self.target_col = target_col
+        self.columns = None
+        self.rows = 0
+        self.class_counts = pd.Series(dtype=np.int64)
+
+    def update(self, chunk):
+        x = chunk.to_numpy(dtype=np.float64)
+        present = ~np.isnan(x)
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+            # Sums are taken around the first chunk's means, so the products of large amounts don't cancel out
+            self.shift = np.nan_to_num(np.nanmean(x, axis=0))
+            size = len(self.columns)
+            self.n = np.zeros((size, size))
+            self.sum = np.zeros((size, size))
+            self.sum_sq = np.zeros((size, size))
+            self.sum_products = np.zeros((size, size))
+            self.distributions = {col: ValueCounts() for col in set(BOXPLOT_FEATURES) | {'LIMIT_BAL'}}
+        x = np.where(present, x - self.shift, 0.0)
+        mask = present.astype(np.float64)
+        # Entry (i, j) only counts rows where both column i and column j are present
+        self.n += mask.T @ mask
+        self.sum += x.T @ mask
+        self.sum_sq += (x * x).T @ mask
+        self.sum_products += x.T @ x
+
+        labels = chunk[self.target_col].to_numpy()
+        for col, counts in self.distributions.items():
+            counts.update(chunk[col].to_numpy(dtype=np.float64), labels)
+        self.class_counts = self.class_counts.add(chunk[self.target_col].value_counts(), fill_value=0).astype(np.int64)
+        self.rows += len(chunk)
+
+    def correlation(self):
+        n, sx, sxx, sxy = self.n, self.sum, self.sum_sq, self.sum_products
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = n * sxy - sx * sx.T
+            corr = cov / np.sqrt((n * sxx - sx ** 2) * (n * sxx.T - sx.T ** 2))
+        return pd.DataFrame(corr, index=self.columns, columns=self.columns)
+
+    def summary(self):
+        """The small, picklable inputs of the render_* functions."""
+        class_counts = self.class_counts.sort_index()
+
+        # Equal-frequency LIMIT_BAL bins like pd.qcut, then each distinct value's defaults go to its bin
+        limit_bal = self.distributions['LIMIT_BAL']
+        edges = np.unique(_weighted_quantile(*limit_bal.distribution(), np.linspace(0, 1, LIMIT_BAL_BINS + 1)))
+        totals = np.zeros(len(edges) - 1)
+        defaults = np.zeros(len(edges) - 1)
+        for label, (values, counts) in limit_bal.by_label.items():
+            bins = np.clip(np.searchsorted(edges, values, side='left') - 1, 0, len(edges) - 2)
+            binned = np.bincount(bins, weights=counts, minlength=len(edges) - 1)
+            totals += binned
+            if label == 1:
+                defaults += binned
+        # Labelled like pd.qcut's intervals (the lowest edge is nudged down so it is included)
+        intervals = pd.IntervalIndex.from_breaks(np.r_[edges[0] - 1e-3, edges[1:]])
+
+        boxes = {col: [_box_stats(*self.distributions[col].distribution(label), label) for label in class_counts.index]
+                 for col in BOXPLOT_FEATURES}
+        return {'rows': self.rows, 'class_counts': class_counts, 'correlation': self.correlation(), 'boxes': boxes,
+                'limit_bal_rates': pd.Series(defaults / totals, index=intervals.astype(str))}
+
+def compute_aggregates(filepath, chunksize=EDA_CHUNKSIZE):
+    """One streaming pass over the raw CSV; returns EdaAggregates.summary()."""
+    aggregates = EdaAggregates()
+    for chunk in read_raw_csv(filepath, chunksize=chunksize):
+        aggregates.update(chunk)
+    return aggregates.summary()
+
+def render_class_distribution(summary, output_path):
+    counts = summary['class_counts']
+    plt.figure(figsize=(8, 6))
+    ax = plt.gca()
+    bars = ax.bar([str(label) for label in counts.index], counts.to_numpy(), color=sns.color_palette('Set2', len(counts)))
+    for bar in bars:
+        ax.annotate(f'{bar.get_height():,.0f}', (bar.get_x() + bar.get_width() / 2., bar.get_height()),
+                    ha='center', va='bottom', fontsize=12)
+    plt.title('Class Distribution (0: No Default, 1: Default)')
+    plt.xlabel('Default Payment Next Month')
+    plt.ylabel('Count')
+    plt.tight_layout()
+    plt.savefig(output_path)
+    plt.close()
+    return output_path
+
+def render_correlation_heatmap(summary, output_path):
+    plt.figure(figsize=(20, 16))
+    sns.heatmap(summary['correlation'], annot=False, cmap='coolwarm', linewidths=0.5)
+    plt.title('Feature Correlation Heatmap')
+    plt.tight_layout()
+    plt.savefig(output_path)
+    plt.close()
+    return output_path
+
+def render_boxplots(summary, output_path):
+    plt.figure(figsize=(14, 6))
+    for i, (feature, stats) in enumerate(summary['boxes'].items(), 1):
+        ax = plt.subplot(1, len(summary['boxes']), i)
+        boxes = ax.bxp(stats, patch_artist=True, widths=0.8)['boxes']
+        for box, color in zip(boxes, sns.color_palette('Set3', len(boxes))):
+            box.set_facecolor(color)
+        plt.title(f'Boxplot of {feature} by Default Status')
+        plt.xlabel('Default (0=No, 1=Yes)')
+        plt.ylabel(feature)
+    plt.tight_layout()
+    plt.savefig(output_path)
+    plt.close()
+    return output_path
+
+def render_default_rate_by_limit_bal(summary, output_path):
+    rates = summary['limit_bal_rates']
+    plt.figure(figsize=(10, 6))
+    plt.bar(rates.index, rates.to_numpy(), color=sns.color_palette('viridis', len(rates)))
+    plt.title('Default Rate by Limit Balance (Loan Amount)')
+    plt.xlabel('Limit Balance Bins')
+    plt.ylabel('Default Rate')
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+    plt.savefig(output_path)
+    plt.close()
+    return output_path
+
+# (renderer, file name) of every report plot
+REPORT_PLOTS = [(render_class_distribution, 'class_distribution.png'),
+                (render_correlation_heatmap, 'correlation_heatmap.png'),
+                (render_boxplots, 'boxplots.png'),
+                (render_default_rate_by_limit_bal, 'default_rate_by_limit_bal.png')]
+
+def render_report(summary, output_dir='../visualizations', workers=None):
+    """Renders every plot from the aggregates, one worker process per plot."""
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or min(len(REPORT_PLOTS), os.cpu_count())
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(render, summary, os.path.join(output_dir, name)) for render, name in REPORT_PLOTS]
+        for future in futures:
+            print(f"Saved {os.path.basename(future.result())}")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the EDA plots of the raw credit data.")
+    parser.add_argument("--input", default="../data/raw/loan_default_data.csv")
+    parser.add_argument("--output-dir", default="../visualizations")
+    parser.add_argument("--chunksize", type=int, default=EDA_CHUNKSIZE)
+    parser.add_argument("--workers", type=int, default=None, help="Plot rendering processes (default: one per plot, up to the core count)")
+    parser.add_argument("--in-memory", action="store_true",
+                        help="Load the whole file and plot it with seaborn directly (the original mode)")
+    args = parser.parse_args()
+
     print("Running EDA Script...\n")
-    df = load_data()
-    plot_class_distribution(df)
-    plot_correlation_heatmap(df)
-    plot_boxplots(df)
-    plot_default_rate_by_limit_bal(df)
-    print("\nEDA Visualizations successfully generated in 'visualizations/' folder.")
+    if args.in_memory:
+        df = read_raw_csv(args.input)
+        os.makedirs(args.output_dir, exist_ok=True)
+        plot_class_distribution(df, args.output_dir)
+        plot_correlation_heatmap(df, args.output_dir)
+        plot_boxplots(df, args.output_dir)
+        plot_default_rate_by_limit_bal(df, args.output_dir)
+    else:
+        start = time.perf_counter()
+        summary = compute_aggregates(args.input, args.chunksize)
+        aggregated = time.perf_counter()
+        print(f"Aggregated {summary['rows']:,} rows in one pass in {aggregated - start:.2f}s")
+        render_report(summary, args.output_dir, args.workers)
+        print(f"Rendered the plots in {time.perf_counter() - aggregated:.2f}s")
+    print(f"\nEDA Visualizations successfully generated in '{args.output_dir}'.")
@@ -1,46 +1,228 @@
 import pandas as pd
 import numpy as np
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
 import matplotlib.pyplot as plt
-from sklearn.metrics import roc_curve
 import os
 
+from instrumentation import instrumented
+
+# A missed default (false negative) is assumed to cost this many times a wrongly flagged applicant
+DEFAULT_COST_RATIO = 5.0
+# Share of HIGH-tier applicants that should actually default
+HIGH_TIER_PRECISION = 0.7
+# bootstrap_ci merges adjacent scores into at most this many equal-sized groups (continuous scores
+# on millions of rows would otherwise mean millions of draws per replicate)
+BOOTSTRAP_MAX_GROUPS = 10_000
+# Replicates generated at once by bootstrap_ci, capped so replicates x groups stays ~4M cells
+BOOTSTRAP_BLOCK_CELLS = 1 << 22
+
+def _safe_divide(numerator, denominator):
+    """numerator / denominator with 0 where the denominator is 0 (sklearn's zero_division=0)."""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape),
+                     where=denominator != 0)
+
+def _trapezoid(y, x, axis=-1):
+    """Trapezoidal area under y(x) along `axis` (np.trapz was renamed between NumPy versions)."""
+    dx = np.diff(x, axis=axis)
+    y_mid = (np.take(y, range(1, y.shape[axis]), axis=axis) + np.take(y, range(y.shape[axis] - 1), axis=axis)) / 2
+    return (dx * y_mid).sum(axis=axis)
+
+class ThresholdSweep:
+    """
+    Confusion counts of a scored holdout set at every distinct probability cutoff.
+
+    The probabilities are sorted once (O(n log n)); a cumulative sum of the sorted labels then
+    gives the true and false positives for every cutoff at the same time, and every metric, curve,
+    optimal cutoff and bootstrap interval below is derived from these count arrays without
+    touching the rows again. Cutoff i predicts default when probability >= thresholds[i];
+    thresholds are in descending order.
+    """
+
+    def __init__(self, y_true, y_prob):
+        y_true = np.asarray(y_true).astype(bool)
+        y_prob = np.asarray(y_prob, dtype=np.float64)
+        order = np.argsort(-y_prob, kind='stable')
+        scores = y_prob[order]
+        labels = y_true[order]
+        # Last row of every run of equal scores: tied rows always switch sides together
+        ends = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1] if len(scores) else np.zeros(0, dtype=int)
+        self.thresholds = scores[ends]
+        self.tp = np.cumsum(labels)[ends]
+        self.fp = ends + 1 - self.tp
+        self.positives = int(labels.sum())
+        self.negatives = len(labels) - self.positives
+        self.fn = self.positives - self.tp
+        self.tn = self.negatives - self.fp
+
+    @property
+    def n_rows(self):
+        return self.positives + self.negatives
+
+    def _cutoff_index(self, threshold, inclusive=True):
+        """Number of distinct scores predicted positive by `threshold` (>= if inclusive, else >)."""
+        # thresholds are descending, so search the negated (ascending) array
+        return np.searchsorted(-self.thresholds, -np.asarray(threshold, dtype=np.float64),
+                               side='right' if inclusive else 'left')
+
+    def counts_at(self, threshold, inclusive=True):
+        """(tp, fp, fn, tn) when predicting default for probability >= threshold (> if not inclusive)."""
+        k = self._cutoff_index(threshold, inclusive)
+        tp = np.r_[0, self.tp][k]
+        fp = np.r_[0, self.fp][k]
+        return tp, fp, self.positives - tp, self.negatives - fp
+
+    @staticmethod
+    def _metrics(tp, fp, fn, tn):
+        n = tp + fp + fn + tn
+        return {'accuracy': _safe_divide(tp + tn, n),
+                'precision': _safe_divide(tp, tp + fp),
+                'recall': _safe_divide(tp, tp + fn),
+                'f1': _safe_divide(2 * tp, 2 * tp + fp + fn),
+                'fpr': _safe_divide(fp, fp + tn),
+                'flagged_rate': _safe_divide(tp + fp, n)}
+
+    def metrics(self):
+        """Every metric as an array aligned with self.thresholds."""
+        return {'threshold': self.thresholds, **self._metrics(self.tp, self.fp, self.fn, self.tn)}
+
+    def metrics_at(self, threshold, inclusive=True):
+        """Metrics for one cutoff (or an array of cutoffs)."""
+        return self._metrics(*self.counts_at(threshold, inclusive))
+
+    def roc_curve(self):
+        """(fpr, tpr, thresholds), starting at the (0, 0) corner like sklearn.metrics.roc_curve."""
+        fpr = _safe_divide(np.r_[0, self.fp], self.negatives)
+        tpr = _safe_divide(np.r_[0, self.tp], self.positives)
+        return fpr, tpr, np.r_[np.inf, self.thresholds]
+
+    def roc_auc(self):
+        fpr, tpr, _ = self.roc_curve()
+        return float(_trapezoid(tpr, fpr))
+
+    def pr_curve(self):
+        """(precision, recall, thresholds) for every cutoff, highest cutoff first."""
+        return _safe_divide(self.tp, self.tp + self.fp), _safe_divide(self.tp, self.positives), self.thresholds
+
+    def average_precision(self):
+        """Step-wise area under the precision-recall curve (sklearn's average_precision_score)."""
+        precision, recall, _ = self.pr_curve()
+        return float(np.sum(np.diff(np.r_[0, recall]) * precision))
+
+    def expected_cost(self, cost_fp=1.0, cost_fn=DEFAULT_COST_RATIO):
+        """Misclassification cost per applicant at every cutoff."""
+        return (cost_fp * self.fp + cost_fn * self.fn) / max(self.n_rows, 1)
+
+    def optimal_threshold(self, cost_fp=1.0, cost_fn=DEFAULT_COST_RATIO):
+        """Cutoff with the lowest expected cost, with its cost ({'threshold', 'cost'})."""
+        cost = self.expected_cost(cost_fp, cost_fn)
+        # Flagging nobody (threshold above every score) is a valid choice too
+        no_flag_cost = cost_fn * self.positives / max(self.n_rows, 1)
+        best = int(np.argmin(cost)) if len(cost) else 0
+        if not len(cost) or no_flag_cost <= cost[best]:
+            return {'threshold': float(np.nextafter(self.thresholds[0], np.inf)) if len(cost) else 1.0,
+                    'cost': float(no_flag_cost)}
+        return {'threshold': float(self.thresholds[best]), 'cost': float(cost[best])}
+
+    def tier_boundaries(self, cost_ratio=DEFAULT_COST_RATIO, high_precision=HIGH_TIER_PRECISION):
+        """
+        MEDIUM/HIGH risk-tier cutoffs: MEDIUM starts at the cost-optimal cutoff (a missed default
+        costs `cost_ratio` times a wrongly flagged applicant), HIGH at the lowest cutoff above it
+        whose flagged applicants default at a rate of at least `high_precision`.
+        """
+        medium = self.optimal_threshold(1.0, cost_ratio)['threshold']
+        precision = _safe_divide(self.tp, self.tp + self.fp)
+        candidates = np.flatnonzero((precision >= high_precision) & (self.thresholds >= medium))
+        # Lowest qualifying cutoff = the last one in descending order; fall back to the top score
+        high = float(self.thresholds[candidates[-1]]) if len(candidates) else float(self.thresholds[0])
+        return {'medium': medium, 'high': max(high, medium)}
+
+    def bootstrap_ci(self, threshold=0.5, inclusive=True, n_boot=1000, level=0.95, random_state=42):
+        """
+        Percentile confidence intervals for ROC-AUC and the metrics at `threshold`.
+
+        Uses the Poisson bootstrap: every row is drawn Poisson(1) times, and since a sum of
+        Poisson(1) draws is Poisson(k), each replicate only needs one Poisson draw per
+        (score group, label) instead of one per row. Adjacent scores are merged into at most
+        BOOTSTRAP_MAX_GROUPS groups (the cutoff at `threshold` stays exact; ROC-AUC moves by far
+        less than the interval width), and replicates are drawn in blocks of
+        (replicates x groups) matrices, so the cost does not grow with the row count.
+        """
+        rng = np.random.default_rng(random_state)
+        k = int(self._cutoff_index(threshold, inclusive))
+        # Group ends (indices into the sweep arrays) at evenly spaced row ranks, plus the cutoff
+        flagged = self.tp + self.fp
+        ranks = np.linspace(0, self.n_rows, min(len(flagged), BOOTSTRAP_MAX_GROUPS) + 1)[1:]
+        ends = np.unique(np.r_[np.searchsorted(flagged, ranks), [k - 1] if k else [], len(flagged) - 1]).astype(int)
+        pos_groups = np.diff(np.r_[0, self.tp[ends]])
+        neg_groups = np.diff(np.r_[0, self.fp[ends]])
+        k = int(np.searchsorted(ends, k - 1) + 1) if k else 0
+        block = max(1, min(n_boot, BOOTSTRAP_BLOCK_CELLS // len(ends)))
+
+        samples = {'roc_auc': []}
+        for start in range(0, n_boot, block):
+            size = min(block, n_boot - start)
+            tp = np.cumsum(rng.poisson(pos_groups, size=(size, len(pos_groups))), axis=1)
+            fp = np.cumsum(rng.poisson(neg_groups, size=(size, len(neg_groups))), axis=1)
+            positives, negatives = tp[:, -1:], fp[:, -1:]
+            zeros = np.zeros((size, 1))
+            tpr = _safe_divide(np.hstack([zeros, tp]), positives)
+            fpr = _safe_divide(np.hstack([zeros, fp]), negatives)
+            samples['roc_auc'].append(_trapezoid(tpr, fpr, axis=1))
+
+            tp_k = tp[:, k - 1] if k else np.zeros(size)
+            fp_k = fp[:, k - 1] if k else np.zeros(size)
+            for name, values in self._metrics(tp_k, fp_k, positives[:, 0] - tp_k, negatives[:, 0] - fp_k).items():
+                samples.setdefault(name, []).append(values)
+
+        tail = (1 - level) / 2 * 100
+        return {name: tuple(float(v) for v in np.percentile(np.concatenate(values), [tail, 100 - tail]))
+                for name, values in samples.items()}
+
+@instrumented('evaluate.metrics', rows_from=0)
 def evaluate_predictions(y_true, y_pred, y_prob, model_name="Model"):
     """
     Calculates and returns standard classification metrics.
+    The hard predictions are counted in one pass and ROC-AUC comes from a ThresholdSweep.
     """
-    acc = accuracy_score(y_true, y_pred)
-    prec = precision_score(y_true, y_pred)
-    rec = recall_score(y_true, y_pred)
-    f1 = f1_score(y_true, y_pred)
-    roc_auc = roc_auc_score(y_true, y_prob)
+    y_true = np.asarray(y_true).astype(bool)
+    y_pred = np.asarray(y_pred).astype(bool)
+    # 0 = TN, 1 = FP, 2 = FN, 3 = TP
+    tn, fp, fn, tp = np.bincount(2 * y_true + y_pred, minlength=4)
+    scores = ThresholdSweep._metrics(tp, fp, fn, tn)
+    roc_auc = ThresholdSweep(y_true, y_prob).roc_auc()
     
     metrics = {
         'Model': model_name,
-        'Accuracy': round(acc, 4),
-        'Precision': round(prec, 4),
-        'Recall': round(rec, 4),
-        'F1 Score': round(f1, 4),
+        'Accuracy': round(float(scores['accuracy']), 4),
+        'Precision': round(float(scores['precision']), 4),
+        'Recall': round(float(scores['recall']), 4),
+        'F1 Score': round(float(scores['f1']), 4),
         'ROC-AUC': round(roc_auc, 4)
     }
     return metrics
 
-def plot_roc_curves(models_dict, X_test, y_test, output_path='../visualizations/roc_curves.png'):
+@instrumented('evaluate.roc_curves', rows_from=2)
+def plot_roc_curves(models_dict, X_test, y_test, output_path='../visualizations/roc_curves.png', probabilities=None):
     """
     Takes a dictionary of trained models, calculates their ROC curves, 
     and plots them on a single graph.
+    Pass the already computed test-set `probabilities` ({name: y_prob}) to skip re-predicting.
     """
     plt.figure(figsize=(10, 8))
     
     for name, model in models_dict.items():
-        if hasattr(model, "predict_proba"):
+        if probabilities is not None and name in probabilities:
+            y_prob = probabilities[name]
+        elif hasattr(model, "predict_proba"):
             y_prob = model.predict_proba(X_test)[:, 1]
         else:
             # For linear models like SVM if predict_proba is not available, though Logistic Regression has it.
             y_prob = model.decision_function(X_test)
             
-        fpr, tpr, _ = roc_curve(y_test, y_prob)
-        auc_score = roc_auc_score(y_test, y_prob)
+        sweep = ThresholdSweep(y_test, y_prob)
+        fpr, tpr, _ = sweep.roc_curve()
+        auc_score = sweep.roc_auc()
         plt.plot(fpr, tpr, label=f'{name} (AUC = {auc_score:.3f})')
         
     plt.plot([0, 1], [0, 1], 'k--', label='Random Guessing (AUC = 0.5)')
@@ -75,3 +257,22 @@ def plot_feature_importance(model, feature_names, model_name, output_path):
         print(f"Feature importance saved to {output_path}")
     else:
         print(f"Skipping feature importance for {model_name} (Not applicable)")
+
+def save_prediction_cache(path, y_train, y_test, oof_probabilities, test_probabilities):
+    """
+    Stores the out-of-fold training probabilities and test-set probabilities of every model,
+    so threshold tuning and later evaluation can reuse them without touching the models.
+    """
+    arrays = {'y_train': np.asarray(y_train), 'y_test': np.asarray(y_test)}
+    for name in oof_probabilities:
+        arrays[f'oof::{name}'] = oof_probabilities[name]
+        arrays[f'test::{name}'] = test_probabilities[name]
+    np.savez(path, **arrays)
+    print(f"Saved out-of-fold and test predictions to {path}")
+
+def load_prediction_cache(path):
+    """Returns (y_train, y_test, oof_probabilities, test_probabilities) saved by save_prediction_cache."""
+    with np.load(path) as data:
+        oof = {key.split('::', 1)[1]: data[key] for key in data.files if key.startswith('oof::')}
+        test = {key.split('::', 1)[1]: data[key] for key in data.files if key.startswith('test::')}
+        return data['y_train'], data['y_test'], oof, test
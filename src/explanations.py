@@ -0,0 +1,170 @@
+import os
+import time
+import numpy as np
+
+from compiled_model import CompiledModel, load_compiled_model
+from model_registry import ModelRegistry, COMPILED_DIR, EXPLAINER_FILE
+
+# Training rows routed through the trees to learn each node's expected output
+BACKGROUND_ROWS = 10_000
+# Rows attributed together (bounds the per-level working set, like compiled_model.ROW_BLOCK)
+EXPLAIN_BLOCK = 4096
+# Contributing features reported per applicant
+TOP_FEATURES = 3
+
+def _node_depths(compiled):
+    """Depth of every node of the flattened ensemble (roots are 0)."""
+    depth = np.zeros(len(compiled.left), dtype=np.int64)
+    frontier = compiled.roots.astype(np.int64)
+    level = 0
+    while len(frontier):
+        depth[frontier] = level
+        frontier = frontier[compiled.left[frontier] >= 0]
+        frontier = np.concatenate([compiled.left[frontier], compiled.right[frontier]]).astype(np.int64)
+        level += 1
+    return depth
+
+def node_expectations(compiled, background):
+    """
+    Expected tree output at every node: the leaf value for leaves, and for split nodes the average
+    of the two children weighted by how many background rows took each side (an even split for
+    nodes no background row reached).
+    """
+    visits = np.zeros(len(compiled.left))
+    visits[compiled.roots] = len(background)
+    for _, _, children in compiled.walk(background):
+        visits += np.bincount(children, minlength=len(visits))
+
+    expected = np.where(compiled.left < 0, compiled.value, 0.0)
+    depth = _node_depths(compiled)
+    for level in range(depth.max() - 1, -1, -1):
+        nodes = np.flatnonzero((depth == level) & (compiled.left >= 0))
+        left, right = compiled.left[nodes], compiled.right[nodes]
+        total = visits[left] + visits[right]
+        weight = np.where(total > 0, visits[left] / np.maximum(total, 1), 0.5)
+        expected[nodes] = weight * expected[left] + (1 - weight) * expected[right]
+    return expected
+
+class Explainer:
+    """
+    Per-row feature attributions for the served model, in the units the model adds up: probability
+    for a RandomForest (which averages leaf probabilities), log-odds for XGBoost and
+    LogisticRegression. For every row, base_value + contributions.sum() is the model output.
+
+    Tree models use path attribution on the compiled node arrays: every split a row passes credits
+    its feature with the change in the node's expected output (cached at training time from
+    background rows), so a row costs one walk down each tree. Given the native XGBoost model
+    (native_model), XGBoost's own exact TreeSHAP contributions are used instead; they cost about 40x
+    more per row. LogisticRegression is exact: coef x (x - training mean).
+    """
+
+    def __init__(self, compiled, node_delta=None, base_value=0.0, feature_means=None, native_model=None):
+        self.compiled = compiled
+        self.feature_names = compiled.feature_names
+        self.node_delta = node_delta
+        self.base_value = float(base_value)
+        self.feature_means = feature_means
+        self.native_model = native_model if compiled.kind == 'boosted' and hasattr(native_model, 'get_booster') else None
+        self.units = 'probability' if compiled.kind == 'forest' else 'log-odds'
+
+    @classmethod
+    def from_background(cls, compiled, X):
+        """Caches the statistics attribution needs from (a sample of) the training matrix."""
+        X = np.asarray(X, dtype=np.float64)
+        if len(X) > BACKGROUND_ROWS:
+            X = X[np.random.default_rng(42).choice(len(X), BACKGROUND_ROWS, replace=False)]
+        if compiled.kind == 'linear':
+            means = X.mean(axis=0)
+            return cls(compiled, base_value=compiled.bias + means @ compiled.coef, feature_means=means)
+
+        expected = node_expectations(compiled, np.ascontiguousarray(X, dtype=np.float32))
+        parent = np.full(len(expected), -1)
+        internal = np.flatnonzero(compiled.left >= 0)
+        parent[compiled.left[internal]] = internal
+        parent[compiled.right[internal]] = internal
+        delta = np.where(parent >= 0, expected - expected[parent], 0.0)
+        roots = expected[compiled.roots]
+        base_value = roots.mean() if compiled.kind == 'forest' else compiled.bias + roots.sum()
+        return cls(compiled, node_delta=delta, base_value=base_value)
+
+    def save(self, path):
+        arrays = {'base_value': self.base_value}
+        if self.node_delta is not None:
+            arrays['node_delta'] = self.node_delta
+        if self.feature_means is not None:
+            arrays['feature_means'] = self.feature_means
+        np.savez(path, **arrays)
+
+    def _path_contributions(self, X, deadline):
+        """Walks a block down every tree; returns (contributions, complete) — False if the deadline cut it short."""
+        n_features = len(self.feature_names)
+        contributions = np.zeros(len(X) * n_features)
+        complete = True
+        for rows, nodes, children in self.compiled.walk(X):
+            contributions += np.bincount(rows * n_features + self.compiled.feature[nodes],
+                                         weights=self.node_delta[children], minlength=len(contributions))
+            if deadline is not None and time.perf_counter() > deadline:
+                complete = False
+                break
+        contributions = contributions.reshape(len(X), n_features)
+        if self.compiled.kind == 'forest':
+            contributions /= len(self.compiled.roots)
+        return contributions, complete
+
+    def explain(self, X, budget_ms=None):
+        """
+        (contributions, base_value, complete) for the rows of a model feature matrix.
+        With budget_ms the tree walk stops at the first tree level that ends past the budget; the
+        splits below it are then left out (complete=False) rather than delaying the response.
+        """
+        X = np.asarray(X)
+        X = X.reshape(1, -1) if X.ndim == 1 else X
+        if self.compiled.kind == 'linear':
+            return (X - self.feature_means) * self.compiled.coef, self.base_value, True
+        if self.native_model is not None:
+            import xgboost as xgb
+            booster = self.native_model.get_booster()
+            best_iteration = getattr(self.native_model, 'best_iteration', None)
+            iterations = (0, best_iteration + 1) if best_iteration is not None else (0, 0)
+            contributions = booster.predict(xgb.DMatrix(np.asarray(X, dtype=np.float32), feature_names=booster.feature_names),
+                                            pred_contribs=True, iteration_range=iterations)
+            # The last column is the bias term, the same for every row
+            base_value = float(contributions[0, -1]) if len(X) else self.base_value
+            return contributions[:, :-1], base_value, True
+
+        deadline = time.perf_counter() + budget_ms / 1000 if budget_ms is not None else None
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        blocks = [self._path_contributions(X[start:start + EXPLAIN_BLOCK], deadline)
+                  for start in range(0, len(X), EXPLAIN_BLOCK)]
+        if not blocks:
+            return np.zeros((0, len(self.feature_names))), self.base_value, True
+        return np.concatenate([block for block, _ in blocks]), self.base_value, all(done for _, done in blocks)
+
+def top_contributions(contributions, feature_names, k=TOP_FEATURES):
+    """(names, values): the k features with the largest absolute contribution per row, largest first."""
+    k = min(k, contributions.shape[1])
+    top = np.argpartition(-np.abs(contributions), k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(contributions, top, axis=1)
+    order = np.argsort(-np.abs(values), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return np.asarray(feature_names)[top], np.take_along_axis(values, order, axis=1)
+
+def load_explainer(models_dir="../models", model=None, version=None, exact=False):
+    """
+    The Explainer of a registry version (default: the current one), or None for models registered
+    without one. Pass the loaded model to reuse its compiled arrays; exact=True with a native XGBoost
+    model switches to its exact TreeSHAP contributions.
+    """
+    registry = ModelRegistry(models_dir)
+    if version is None and registry.current_version() is None:
+        return None
+    path = registry.path(version)
+    if not os.path.exists(os.path.join(path, EXPLAINER_FILE)):
+        return None
+    compiled = model if isinstance(model, CompiledModel) else \
+        load_compiled_model(os.path.join(path, COMPILED_DIR), mmap_mode='r')
+    with np.load(os.path.join(path, EXPLAINER_FILE)) as data:
+        return Explainer(compiled, node_delta=data['node_delta'] if 'node_delta' in data.files else None,
+                         base_value=float(data['base_value']),
+                         feature_means=data['feature_means'] if 'feature_means' in data.files else None,
+                         native_model=model if exact else None)
@@ -1,73 +1,198 @@
+import argparse
+import joblib
 import pandas as pd
 import numpy as np
+from data_store import intermediate_path, load_dataset, save_dataset, memory_report
+from data_preprocessing import PAY_STATUS_COLS
+from instrumentation import instrumented
 
-def load_processed_data(filepath):
-    """Loads the preprocessed dataset."""
-    df = pd.read_csv(filepath)
+def load_processed_data(filepath, columns=None):
+    """Loads the preprocessed dataset (CSV or memory-mapped columnar), optionally only some columns."""
+    df = load_dataset(filepath, columns)
     print(f"Data loaded successfully. Initial shape: {df.shape}")
     return df
 
-def feature_engineering(df):
+# Month-by-month column groups of the UCI layout
+BILL_AMT_COLS = [f'BILL_AMT{month}' for month in range(1, 7)]
+PAY_AMT_COLS = [f'PAY_AMT{month}' for month in range(1, 7)]
+# Adding a small epsilon to avoid division by zero
+EPSILON = 1e-6
+
+class Feature:
+    """
+    A derived column: `kernel(*inputs)` computes it for every row at once. Each input is a column
+    or feature name (passed as a 1-D array) or a list of column names (passed as one 2-D block).
+    """
+
+    def __init__(self, name, inputs, kernel, integer=False):
+        self.name = name
+        self.inputs = inputs
+        self.kernel = kernel
+        self.integer = integer
+
+# Every engineered feature, in the column order feature_engineering appends them
+FEATURE_REGISTRY = {}
+
+def register_feature(name, inputs, integer=False):
+    """Decorator adding a kernel to FEATURE_REGISTRY under `name`."""
+    def decorator(kernel):
+        FEATURE_REGISTRY[name] = Feature(name, inputs, kernel, integer)
+        return kernel
+    return decorator
+
+# 1. Credit Utilization Ratio (Average Bill / Limit Balance)
+# High utilization often indicates financial distress.
+# We must be careful about division by zero conceptually, though LIMIT_BAL was scaled.
+# To calculate utilization conceptually correctly, it's better to calculate it BEFORE scaling.
+# However, since the user already requested normalization in Phase 2, we will approximate 
+# interaction features using the scaled data, or create an interaction metric based on recent behavior.
+@register_feature('AVG_BILL_AMT', [BILL_AMT_COLS])
+def average_bill_amount(bills):
+    # Average bill amount across the 6 months
+    return bills.mean(axis=1)
+
+# Let's create an "Average Payment to Bill Ratio"
+@register_feature('AVG_PAY_AMT', [PAY_AMT_COLS])
+def average_payment_amount(payments):
+    return payments.mean(axis=1)
+
+# If a person pays very little compared to their bill, it's a red flag.
+@register_feature('PAY_TO_BILL_RATIO', ['AVG_PAY_AMT', 'AVG_BILL_AMT'])
+def payment_to_bill_ratio(avg_pay, avg_bill):
+    return avg_pay / np.abs(np.where(avg_bill == 0, EPSILON, avg_bill))
+
+# 2. Payment Delay Count
+# PAY_0 to PAY_6 are integer codes representing delay. Positive values mean delayed by X months.
+# Note: PAY_0 is actually named 'PAY_0' in the raw dataset, representing repayment status in September.
+# How many times the user was delayed by 2 or more months
+@register_feature('TOTAL_SEVERE_DELAYS', [PAY_STATUS_COLS], integer=True)
+def total_severe_delays(pay_status):
+    return (pay_status >= 2).sum(axis=1)
+
+# 3. Overall Payment Trend (Is their financial situation getting worse?)
+# If PAY_0 (recent) > PAY_6 (past), their delays are increasing.
+@register_feature('DELAY_TREND_WORSENING', ['PAY_0', 'PAY_6'], integer=True)
+def delay_trend_worsening(recent, past):
+    return recent > past
+
+# 4. Age Groups
+# Since Age was normalized, we will bin the normalized age. 
+# For a StandardScaler, 0 is the mean (around 35 years old).
+# < -1 is roughly < 25. > 1 is roughly > 45.
+@register_feature('IS_YOUNG', ['AGE'], integer=True)
+def is_young(age):
+    return age < -1.0
+
+@register_feature('IS_SENIOR', ['AGE'], integer=True)
+def is_senior(age):
+    return age > 1.0
+
+ENGINEERED_COLS = list(FEATURE_REGISTRY)
+
+def resolve_features(names):
+    """The registered features needed to produce `names` (plus the features they read), in dependency order."""
+    order = []
+    visiting = set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Circular feature dependency through {name}")
+        visiting.add(name)
+        for spec in FEATURE_REGISTRY[name].inputs:
+            for dependency in ([spec] if isinstance(spec, str) else spec):
+                if dependency in FEATURE_REGISTRY:
+                    visit(dependency)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in names:
+        if name in FEATURE_REGISTRY:
+            visit(name)
+    return order
+
+def required_columns(names):
+    """The non-engineered columns the features in `names` read, directly or through other features."""
+    columns = []
+    for name in resolve_features(names):
+        for spec in FEATURE_REGISTRY[name].inputs:
+            for col in ([spec] if isinstance(spec, str) else spec):
+                if col not in FEATURE_REGISTRY and col not in columns:
+                    columns.append(col)
+    return columns
+
+class FeaturePlan:
+    """
+    Evaluation order for a set of registered features, resolved once and reused for every batch.
+    `out_index` maps the features to write out to their column in the output matrix, and
+    `columns` lists the base columns the features read.
+    """
+
+    def __init__(self, names, out_index):
+        self.columns = required_columns(names)
+        # (name, kernel, input keys, output column or None); a key is a name or a tuple of names
+        self.steps = [(feature.name, feature.kernel,
+                       [spec if isinstance(spec, str) else tuple(spec) for spec in feature.inputs],
+                       out_index.get(feature.name))
+                      for feature in (FEATURE_REGISTRY[name] for name in resolve_features(names))]
+
+    def compute(self, column, out):
+        """
+        Evaluates the planned features in dependency order.
+
+        `column(key)` returns a base column (key is a name) as a 1-D array or a group of base
+        columns (key is a tuple of names) as a 2-D block. Results go straight into their column
+        of the preallocated `out` matrix; features that are only read by other features stay
+        intermediates. Every input block and feature value is computed once and shared by all
+        features reading it.
+        """
+        values = {}
+        for name, kernel, keys, dst in self.steps:
+            for key in keys:
+                if key not in values:
+                    values[key] = column(key)
+            values[name] = kernel(*[values[key] for key in keys])
+            if dst is not None:
+                out[:, dst] = values[name]
+        return out
+
+@instrumented('features.feature_engineering')
+def feature_engineering(df, features=None):
     """
     Creates domain-specific features based on the UCI Credit Card Dataset to 
     give machine learning models more predictive signals.
+    Only the registered features in `features` are added (default: all of them). They are
+    computed into one float32 matrix and appended to the frame in a single step.
     """
     print("\nStarting Feature Engineering...")
+    features = ENGINEERED_COLS if features is None else [name for name in features if name in FEATURE_REGISTRY]
     
-    # 1. Credit Utilization Ratio (Average Bill / Limit Balance)
-    # High utilization often indicates financial distress
-    bill_columns = [col for col in df.columns if col.startswith('BILL_AMT')]
-    # Calculate average bill amount across the 6 months
-    df['AVG_BILL_AMT'] = df[bill_columns].mean(axis=1)
-    
-    # We must be careful about division by zero conceptually, though LIMIT_BAL was scaled.
-    # To calculate utilization conceptually correctly, it's better to calculate it BEFORE scaling.
-    # However, since the user already requested normalization in Phase 2, we will approximate 
-    # interaction features using the scaled data, or create an interaction metric based on recent behavior.
-    
-    # Let's create an "Average Payment to Bill Ratio"
-    pay_amt_columns = [col for col in df.columns if col.startswith('PAY_AMT')]
-    df['AVG_PAY_AMT'] = df[pay_amt_columns].mean(axis=1)
-    
-    # If a person pays very little compared to their bill, it's a red flag.
-    # Adding a small epsilon to avoid division by zero
-    epsilon = 1e-6
-    df['PAY_TO_BILL_RATIO'] = df['AVG_PAY_AMT'] / (df['AVG_BILL_AMT'].replace(0, epsilon).abs())
-    
-    # 2. Payment Delay Count
-    # PAY_0 to PAY_6 are integer codes representing delay. Positive values mean delayed by X months.
-    # We will engineer a feature that counts how many times the user was delayed by 2 or more months.
-    # Note: PAY_0 is actually named 'PAY_0' in the raw dataset, representing repayment status in September.
-    pay_status_cols = ['PAY_0', 'PAY_2', 'PAY_3', 'PAY_4', 'PAY_5', 'PAY_6']
-    
-    # Create a feature tracking the total number of severe delays
-    df['TOTAL_SEVERE_DELAYS'] = 0
-    for col in pay_status_cols:
-        if col in df.columns:
-            # Add 1 if the payment was delayed by 2 or more months
-            df['TOTAL_SEVERE_DELAYS'] += (df[col] >= 2).astype(int)
-            
-    # 3. Overall Payment Trend (Is their financial situation getting worse?)
-    # If PAY_0 (recent) > PAY_6 (past), their delays are increasing.
-    if 'PAY_0' in df.columns and 'PAY_6' in df.columns:
-        df['DELAY_TREND_WORSENING'] = (df['PAY_0'] > df['PAY_6']).astype(int)
-
-    # 4. Age Groups
-    # Since Age was normalized, we will bin the normalized age. 
-    # For a StandardScaler, 0 is the mean (around 35 years old).
-    # < -1 is roughly < 25. > 1 is roughly > 45.
-    df['IS_YOUNG'] = (df['AGE'] < -1.0).astype(int)
-    df['IS_SENIOR'] = (df['AGE'] > 1.0).astype(int)
+    out = np.empty((len(df), len(features)), dtype=np.float32)
+    plan = FeaturePlan(features, {name: i for i, name in enumerate(features)})
+    # Kernels run in float64 on the stored (compact) columns
+    plan.compute(lambda key: df[key if isinstance(key, str) else list(key)].to_numpy(dtype=np.float64), out)
+    # Flags and counts are small integers and are stored as int8
+    engineered = pd.DataFrame({name: out[:, i].astype(np.int8) if FEATURE_REGISTRY[name].integer else out[:, i]
+                               for i, name in enumerate(features)}, index=df.index)
+    df = pd.concat([df, engineered], axis=1)
 
     print(f"Feature Engineering Complete. Final shape: {df.shape}")
     return df
 
 if __name__ == "__main__":
-    input_filepath = "../data/processed/processed_loan_data.csv"
-    output_filepath = "../data/processed/engineered_loan_data.csv"
+    parser = argparse.ArgumentParser(description="Append the engineered features to the preprocessed dataset.")
+    parser.add_argument("--feature-names", default=None,
+                        help="feature_names.pkl of a trained model: only compute the engineered features it uses")
+    args = parser.parse_args()
+    
+    input_filepath = intermediate_path("processed_loan_data")
+    output_filepath = intermediate_path("engineered_loan_data")
     
     df = load_processed_data(input_filepath)
-    df = feature_engineering(df)
+    memory_report(df, "processed")
+    df = feature_engineering(df, joblib.load(args.feature_names) if args.feature_names else None)
+    memory_report(df, "engineered")
     
-    df.to_csv(output_filepath, index=False)
+    save_dataset(df, output_filepath)
     print(f"\nEngineered dataset saved to {output_filepath}")
@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+import joblib
+
+from data_preprocessing import TARGET_COL, CATEGORICAL_COLS, get_numerical_columns
+from feature_engineering import ENGINEERED_COLS, FEATURE_REGISTRY, FeaturePlan
+
+def encoded_columns(columns, categorical_levels):
+    """
+    Column order produced by encode_categorical: get_dummies(drop_first=True) keeps every sorted
+    level except the first and appends the indicator columns after the untouched ones.
+    """
+    passthrough_cols = [col for col in columns if col not in CATEGORICAL_COLS]
+    dummy_cols = [f'{col}_{level:g}' for col in CATEGORICAL_COLS for level in sorted(categorical_levels[col])[1:]]
+    return passthrough_cols + dummy_cols
+
+class FeatureTransform:
+    """
+    The fitted encode_categorical -> normalize_numerical -> feature_engineering chain.
+
+    fit() learns the one-hot vocabulary, the scaler statistics and the imputation medians
+    from the raw training frame. transform() then maps raw applicant rows (UCI layout) to the
+    exact feature vector the model was trained on, using only NumPy index arithmetic so the
+    serving path never calls get_dummies or builds intermediate DataFrames. After
+    select_features() it produces only the columns a model uses, computing just the engineered
+    features (and the scaled inputs) those need.
+    """
+
+    def __init__(self, target_col=TARGET_COL):
+        self.target_col = target_col
+
+    def fit(self, df):
+        """Learns all preprocessing state from the raw (unencoded, unscaled) training frame."""
+        raw_columns = [col for col in df.columns if col not in ('ID', self.target_col)]
+        # handle_missing_values fills with the column median, so we keep those for serving
+        fill_values = np.nanmedian(df[raw_columns].to_numpy(dtype=np.float64), axis=0)
+
+        # get_dummies(drop_first=True) keeps every sorted level except the first
+        categorical_levels = {col: np.unique(df[col].dropna().to_numpy()) for col in CATEGORICAL_COLS}
+
+        encoded_cols = encoded_columns(df.columns, categorical_levels)
+        scaled_cols = get_numerical_columns(encoded_cols, self.target_col)
+        # Only needed when fitting; serving loads the fitted statistics without scikit-learn
+        from sklearn.preprocessing import StandardScaler
+        scaler = StandardScaler()
+        scaler.fit(df[scaled_cols].fillna(df[scaled_cols].median()).to_numpy(dtype=np.float64))
+        return self.set_statistics(df.columns, fill_values, categorical_levels, scaler.mean_, scaler.scale_)
+
+    def set_statistics(self, columns, fill_values, categorical_levels, mean, scale):
+        """
+        Installs preprocessing state computed elsewhere (e.g. by a streaming pass).
+        `columns` is the raw column order, `fill_values` the medians of its non ID/target columns,
+        `categorical_levels` every observed level per categorical column and `mean`/`scale` the
+        scaler statistics of the columns normalize_numerical would scale.
+        """
+        self.raw_columns = [col for col in columns if col not in ('ID', self.target_col)]
+        self.fill_values = np.asarray(fill_values, dtype=np.float64)
+        self.categorical_levels = {col: np.asarray(levels, dtype=np.float64)[1:]
+                                   for col, levels in categorical_levels.items()}
+        self.encoded_columns = encoded_columns(columns, categorical_levels)
+        self.scaled_cols = get_numerical_columns(self.encoded_columns, self.target_col)
+        self.mean_ = np.asarray(mean, dtype=np.float64)
+        self.scale_ = np.asarray(scale, dtype=np.float64)
+
+        self.model_columns = [col for col in self.encoded_columns if col not in ('ID', self.target_col)]
+        self.feature_names = self.model_columns + ENGINEERED_COLS
+        self._compile()
+        return self
+
+    def select_features(self, feature_names):
+        """
+        Restricts transform() to `feature_names` (a model's feature_names.pkl), in that order.
+        Raises if the transform can't produce one of them.
+        """
+        unknown = [name for name in feature_names if name not in self.model_columns and name not in FEATURE_REGISTRY]
+        if unknown:
+            raise ValueError(f"Feature transform can't produce {', '.join(unknown)}. "
+                             "Re-run data_preprocessing.py before train_model.py.")
+        self.feature_names = list(feature_names)
+        self._compile()
+        return self
+
+    def _compile(self):
+        """Precomputes the index arrays that drive transform() for the current feature_names."""
+        raw_index = {col: i for i, col in enumerate(self.raw_columns)}
+        out_index = {col: i for i, col in enumerate(self.feature_names)}
+        self._plan = FeaturePlan([col for col in self.feature_names if col in FEATURE_REGISTRY], out_index)
+        needed = set(self.feature_names) | set(self._plan.columns)
+
+        # Only the scaled columns that are output or read by an engineered feature get scaled
+        scaled = [(i, col) for i, col in enumerate(self.scaled_cols) if col in needed]
+        self._scaled_src = np.array([raw_index[col] for _, col in scaled], dtype=int)
+        self._scaled_mean = self.mean_[[i for i, _ in scaled]]
+        self._scaled_scale = self.scale_[[i for i, _ in scaled]]
+        scaled_index = {col: j for j, (_, col) in enumerate(scaled)}
+        kept = [j for j, (_, col) in enumerate(scaled) if col in out_index]
+        self._scaled_keep = np.array(kept, dtype=int)
+        self._scaled_dst = np.array([out_index[scaled[j][1]] for j in kept], dtype=int)
+
+        # Where each engineered-feature input comes from: (from_scaled, column index or index array)
+        self._feature_inputs = {}
+        for _, _, keys, _ in self._plan.steps:
+            for key in keys:
+                cols = [key] if isinstance(key, str) else list(key)
+                if any(col in FEATURE_REGISTRY for col in cols):
+                    continue
+                from_scaled = [col in scaled_index for col in cols]
+                if any(from_scaled) != all(from_scaled):
+                    raise ValueError(f"Feature input {key} mixes scaled and unscaled columns")
+                index = [scaled_index[col] if from_scaled[0] else raw_index[col] for col in cols]
+                self._feature_inputs[key] = (from_scaled[0], index[0] if isinstance(key, str) else np.array(index))
+
+        passthrough = [col for col in self.raw_columns
+                       if col not in CATEGORICAL_COLS and col not in self.scaled_cols and col in out_index]
+        self._pass_src = np.array([raw_index[col] for col in passthrough], dtype=int)
+        self._pass_dst = np.array([out_index[col] for col in passthrough], dtype=int)
+
+        # One-hot blocks: compare each categorical column against its kept levels
+        self._onehot = []
+        for col in CATEGORICAL_COLS:
+            levels = [level for level in self.categorical_levels[col] if f'{col}_{level:g}' in out_index]
+            if levels:
+                dst = np.array([out_index[f'{col}_{level:g}'] for level in levels], dtype=int)
+                self._onehot.append((raw_index[col], np.array(levels), dst))
+
+    def _raw_matrix(self, X):
+        """Returns a float64 (n_rows, n_raw_columns) matrix in raw_columns order, NaN-imputed."""
+        if isinstance(X, pd.DataFrame):
+            raw = X.reindex(columns=self.raw_columns).to_numpy(dtype=np.float64)
+        elif isinstance(X, dict):
+            # Values may be scalars (one applicant) or equal-length arrays (one entry per applicant)
+            values = np.broadcast_arrays(*[np.asarray(X.get(col, np.nan), dtype=np.float64) for col in self.raw_columns])
+            raw = np.stack(values, axis=-1).reshape(-1, len(self.raw_columns))
+        else:
+            raw = np.array(X, dtype=np.float64, ndmin=2)
+
+        missing = np.isnan(raw)
+        if missing.any():
+            raw = np.where(missing, self.fill_values, raw)
+        return raw
+
+    def transform(self, X):
+        """
+        Maps raw applicant rows to the model's float32 feature matrix.
+        Accepts a DataFrame, a {column: value or array} dict, or an array in raw_columns order.
+        Columns absent from the input are imputed with the training medians.
+        """
+        raw = self._raw_matrix(X)
+        out = np.empty((raw.shape[0], len(self.feature_names)), dtype=np.float32)
+
+        # Rounded to float32 like the stored training data, so engineered features see identical inputs
+        scaled = ((raw[:, self._scaled_src] - self._scaled_mean) / self._scaled_scale).astype(np.float32)
+        out[:, self._scaled_dst] = scaled[:, self._scaled_keep]
+        scaled = scaled.astype(np.float64)
+        out[:, self._pass_dst] = raw[:, self._pass_src]
+        for src, levels, dst in self._onehot:
+            out[:, dst] = raw[:, src, None] == levels
+
+        def column(key):
+            # Engineered features read the float32 scaled values upcast to float64, like feature_engineering does
+            from_scaled, index = self._feature_inputs[key]
+            return (scaled if from_scaled else raw)[:, index]
+
+        return self._plan.compute(column, out)
+
+    def save(self, path):
+        joblib.dump(self, path)
+        print(f"Saved feature transform to {path}")
+
+def load_feature_transform(path):
+    """Loads a fitted FeatureTransform saved by data_preprocessing.py."""
+    return joblib.load(path)
@@ -0,0 +1,124 @@
+import json
+import math
+import time
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.model_selection import train_test_split
+
+from training_scheduler import TrainingTask, run_training_graph
+
+# Per estimator type: a list of choices, or ('log' | 'uniform' | 'int', low, high)
+SEARCH_SPACES = {
+    'LogisticRegression': {'C': ('log', 1e-3, 1e2)},
+    'RandomForestClassifier': {'n_estimators': [100, 200, 400], 'max_depth': [None, 8, 12, 16, 24],
+                               'min_samples_leaf': [1, 2, 5, 10, 20], 'max_features': ['sqrt', 0.3, 0.5]},
+    'XGBClassifier': {'learning_rate': ('log', 0.01, 0.3), 'max_depth': ('int', 3, 8),
+                      'min_child_weight': [1, 3, 5, 10], 'subsample': ('uniform', 0.6, 1.0),
+                      'colsample_bytree': ('uniform', 0.5, 1.0), 'reg_lambda': ('log', 0.1, 10.0)},
+}
+# XGBoost round cap on the full-data rung (smaller rungs get a proportional share); early stopping
+# on the validation split decides how many of them are actually used
+MAX_BOOSTING_ROUNDS = 1000
+EARLY_STOPPING_ROUNDS = 30
+
+def sample_params(space, rng):
+    """Draws one hyperparameter setting from a SEARCH_SPACES entry."""
+    params = {}
+    for name, spec in space.items():
+        if isinstance(spec, list):
+            params[name] = spec[rng.integers(len(spec))]
+        elif spec[0] == 'log':
+            params[name] = float(np.exp(rng.uniform(np.log(spec[1]), np.log(spec[2]))))
+        elif spec[0] == 'int':
+            params[name] = int(rng.integers(spec[1], spec[2] + 1))
+        else:
+            params[name] = float(rng.uniform(spec[1], spec[2]))
+    return params
+
+def _is_xgboost(model):
+    return type(model).__name__ == 'XGBClassifier'
+
+def successive_halving_search(models, X, y, n_candidates=27, eta=3, min_fraction=1/9, time_budget=600,
+                              core_budget=None, validation_size=0.2, random_state=42):
+    """
+    Tunes every model in `models` with successive halving and returns (tuned_models, trials).
+
+    Each model gets `n_candidates` random settings from SEARCH_SPACES; trial 0 is always the
+    model's current configuration, so tuning can't end up worse than it on the validation split.
+    All candidates are first trained on `min_fraction` of the training rows and scored (ROC-AUC)
+    on a fixed stratified validation split; the best 1/eta of each model move up to eta times
+    more rows, until the last rung trains on all of them. XGBoost rounds grow with the rung
+    and stop early on the validation split. Every rung runs all models' candidates together on
+    the core-budget-aware scheduler.
+
+    No trial starts after `time_budget` seconds; each model then keeps its best candidate from
+    the highest rung it reached. tuned_models are unfitted clones of the input models with the
+    winning settings; trials is one row per finished trial.
+    """
+    deadline = time.perf_counter() + time_budget
+    rng = np.random.default_rng(random_state)
+    train_pool, valid_idx = train_test_split(np.arange(len(y)), test_size=validation_size,
+                                             random_state=random_state, stratify=y)
+    # Rungs train on growing prefixes of one shuffled order, so each rung sees the previous rung's rows
+    train_pool = rng.permutation(train_pool)
+    n_rungs = int(round(math.log(1 / min_fraction, eta))) + 1
+    fractions = [min(1.0, min_fraction * eta ** rung) for rung in range(n_rungs)]
+
+    candidates = {}
+    for name, model in models.items():
+        space = SEARCH_SPACES.get(type(model).__name__)
+        if space is None:
+            print(f"No search space for {type(model).__name__}, keeping {name} as configured.")
+            continue
+        candidates.update({(name, trial): sample_params(space, rng) if trial else {} for trial in range(n_candidates)})
+
+    alive = list(candidates)
+    trials = []
+    for rung, fraction in enumerate(fractions):
+        n_train = int(len(train_pool) * fraction)
+        tasks = {}
+        for name, trial in alive:
+            model = clone(models[name]).set_params(**candidates[(name, trial)])
+            if _is_xgboost(model):
+                model.set_params(n_estimators=max(50, int(MAX_BOOSTING_ROUNDS * fraction)),
+                                 early_stopping_rounds=EARLY_STOPPING_ROUNDS)
+            task = TrainingTask(f'{name} #{trial}', model, rung, train_pool[:n_train], valid_idx)
+            tasks[task.key] = (task, name, trial)
+
+        results, schedule = run_training_graph([task for task, _, _ in tasks.values()], X, y, core_budget, deadline)
+        for key, (task, name, trial) in tasks.items():
+            if key in results:
+                trials.append({'model': name, 'trial': trial, 'rung': rung, 'train_rows': n_train,
+                               'roc_auc': results[key]['score'], 'best_iteration': results[key].get('best_iteration'),
+                               'seconds': round(results[key]['seconds'], 2), 'params': json.dumps(candidates[(name, trial)])})
+        print(f"Rung {rung}: {len(results)} of {len(tasks)} candidates on {n_train:,} rows "
+              f"in {schedule['wall_seconds']:.1f}s")
+        if schedule['skipped']:
+            print(f"Search budget of {time_budget}s used up, stopping after rung {rung}.")
+            break
+
+        # Promote the best 1/eta of every model's candidates
+        rung_trials = pd.DataFrame([t for t in trials if t['rung'] == rung])
+        alive = []
+        for name, group in rung_trials.groupby('model', sort=False):
+            keep = max(1, len(group) // eta)
+            alive += [(name, trial) for trial in group.nlargest(keep, 'roc_auc')['trial']]
+
+    trials = pd.DataFrame(trials)
+    tuned_models = dict(models)
+    if trials.empty:
+        return tuned_models, trials
+    for name, group in trials.groupby('model', sort=False):
+        # Only compare trials from the highest rung this model reached, they saw the same data
+        best = group[group['rung'] == group['rung'].max()].nlargest(1, 'roc_auc').iloc[0]
+        params = candidates[(name, best['trial'])]
+        tuned = clone(models[name]).set_params(**params)
+        if _is_xgboost(tuned) and pd.notna(best['best_iteration']):
+            # Keep the rounds early stopping chose; the final fits have no validation split to stop on
+            tuned.set_params(n_estimators=int(best['best_iteration']) + 1)
+            params = {**params, 'n_estimators': int(best['best_iteration']) + 1}
+        tuned_models[name] = tuned
+        print(f"{name}: best validation ROC-AUC {best['roc_auc']:.4f} (trial {best['trial']}, rung {best['rung']}) "
+              f"with {params or 'the default settings'}")
+    return tuned_models, trials
@@ -0,0 +1,296 @@
+import argparse
+import atexit
+import functools
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+
+# Spans are only measured when LOAN_INSTRUMENTATION is set (to anything but 0). Disabled, span()
+# hands back a shared no-op object and @instrumented costs one flag check per call.
+ENABLED_ENV = 'LOAN_INSTRUMENTATION'
+# Where span records go as JSON lines (default: stderr)
+LOG_ENV = 'LOAN_INSTRUMENTATION_LOG'
+# Prometheus text snapshot written when the process exits (default: none)
+PROMETHEUS_ENV = 'LOAN_INSTRUMENTATION_PROM'
+METRIC_PREFIX = 'loan_span'
+
+_enabled = os.environ.get(ENABLED_ENV, '') not in ('', '0')
+_lock = threading.Lock()
+_local = threading.local()
+_log_file = None
+# (span name, labels) -> running totals for the Prometheus snapshot
+_totals = {}
+# Spans open in any thread, and how many spans were entered while another thread had one open;
+# the kernel's peak-RSS counter is per process, so those can't have a peak of their own
+_open_spans = 0
+_overlaps = 0
+
+def _proc_status(field):
+    """A memory field of /proc/self/status in bytes, or None off Linux."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss():
+    """
+    Resets the kernel's peak-RSS counter of this process (Linux 4.0+), so the next reading covers
+    only what runs after it. Returns False where that isn't possible; peaks then include everything
+    the process did before.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def current_rss():
+    return _proc_status('VmRSS') or 0
+
+def peak_rss():
+    """Peak resident memory in bytes since the last reset_peak_rss (or process start)."""
+    peak = _proc_status('VmHWM')
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # KB on Linux
+    return peak
+
+def enable(log_path=None, prometheus_path=None):
+    """Turns instrumentation on for this process and, through the environment, for child processes."""
+    global _enabled
+    _enabled = True
+    os.environ[ENABLED_ENV] = '1'
+    if log_path:
+        os.environ[LOG_ENV] = log_path
+    if prometheus_path:
+        os.environ[PROMETHEUS_ENV] = prometheus_path
+
+def is_enabled():
+    return _enabled
+
+class _NullSpan:
+    """Stands in for a Span while instrumentation is disabled."""
+    record = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_rows(self, rows):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+    """
+    Measures one block: wall time, CPU time of the whole process (all threads, so multi-threaded
+    fits show up as CPU > wall), peak resident memory while it ran and the rows it processed.
+    Nested spans each get their own peak: a child resets the kernel's high-water mark only after
+    folding it into its parent's, and hands its own peak back to the parent when it ends. The
+    mark is process-wide, so a span is never reset while other threads have spans open; spans
+    that overlapped another thread's record peak_rss_scope 'process' instead of 'span'.
+    With emit=False the record is only kept in .record (for worker processes that send it back).
+    """
+
+    def __init__(self, name, rows=None, emit=True, **labels):
+        self.name = name
+        self.rows = rows
+        self.emit = emit
+        self.labels = {key: str(value) for key, value in labels.items()}
+        self.record = None
+
+    def set_rows(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        global _open_spans, _overlaps
+        stack = _span_stack()
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, peak_rss())
+        with _lock:
+            self.shared = _open_spans > len(stack)
+            if self.shared:
+                _overlaps += 1
+            else:
+                reset_peak_rss()
+            _open_spans += 1
+            self.overlaps = _overlaps
+        self.peak = current_rss()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _open_spans
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        stack = _span_stack()
+        stack.pop()
+        self.peak = max(self.peak, peak_rss())
+        with _lock:
+            _open_spans -= 1
+            shared = self.shared or _overlaps != self.overlaps
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, self.peak)
+        self.record = {'ts': round(time.time(), 6), 'span': self.name, 'labels': self.labels, 'parent': self.parent,
+                       'wall_seconds': wall, 'cpu_seconds': cpu, 'peak_rss_bytes': self.peak,
+                       'peak_rss_scope': 'process' if shared else 'span', 'rows': self.rows,
+                       'rows_per_sec': self.rows / wall if self.rows and wall > 0 else None,
+                       'pid': os.getpid(), 'error': exc_type.__name__ if exc_type else None}
+        if self.emit:
+            emit(self.record)
+        return False
+
+def _span_stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def span(name, rows=None, emit=True, **labels):
+    """Context manager timing a block as span `name`; a no-op unless instrumentation is enabled."""
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, rows, emit, **labels)
+
+def instrumented(name, rows_from='result'):
+    """
+    Decorator recording every call of a function as span `name`. Rows processed are len() of the
+    return value (rows_from='result'; of its first element for a tuple) or of positional argument
+    `rows_from` (an int).
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with Span(name) as current:
+                result = fn(*args, **kwargs)
+                source = (result[0] if isinstance(result, tuple) else result) if rows_from == 'result' \
+                    else args[rows_from]
+                current.set_rows(len(source) if hasattr(source, '__len__') else None)
+            return result
+        return wrapper
+    return decorator
+
+def _accumulate(totals, record):
+    """Adds one span record to a {(span, labels): totals} dict."""
+    key = (record['span'], tuple(sorted(record['labels'].items())))
+    values = totals.setdefault(key, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows': 0,
+                                     'errors': 0, 'peak_rss_bytes': 0})
+    values['calls'] += 1
+    values['wall_seconds'] += record['wall_seconds']
+    values['cpu_seconds'] += record['cpu_seconds']
+    values['rows'] += record['rows'] or 0
+    values['errors'] += record['error'] is not None
+    values['peak_rss_bytes'] = max(values['peak_rss_bytes'], record['peak_rss_bytes'])
+
+def emit(record):
+    """
+    Writes a span record as one JSON line and adds it to the Prometheus totals. Ignores None.
+    A top-level record sent back by a worker process is filed under the span open here.
+    """
+    global _log_file
+    if record is None:
+        return
+    stack = _span_stack()
+    if record['parent'] is None and record['pid'] != os.getpid() and stack:
+        record['parent'] = stack[-1].name
+    line = json.dumps(record) + '\n'
+    with _lock:
+        _accumulate(_totals, record)
+        if _log_file is None:
+            path = os.environ.get(LOG_ENV)
+            if path:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            # Line-buffered appends: several processes can share one log file
+            _log_file = open(path, 'a', buffering=1) if path else sys.stderr
+        _log_file.write(line)
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# (metric suffix, type, help, totals field)
+_METRICS = [
+    ('calls_total', 'counter', 'Completed spans', 'calls'),
+    ('errors_total', 'counter', 'Spans that ended with an exception', 'errors'),
+    ('wall_seconds_total', 'counter', 'Wall-clock seconds spent in spans', 'wall_seconds'),
+    ('cpu_seconds_total', 'counter', 'Process CPU seconds spent in spans', 'cpu_seconds'),
+    ('rows_total', 'counter', 'Rows processed by spans', 'rows'),
+    ('peak_rss_bytes', 'gauge', 'Highest resident memory seen while a span ran', 'peak_rss_bytes'),
+]
+
+def prometheus_snapshot(totals=None):
+    """The span totals (this process's by default) in the Prometheus text exposition format."""
+    if totals is None:
+        with _lock:
+            totals = {key: dict(value) for key, value in _totals.items()}
+    lines = []
+    for suffix, metric_type, help_text, field in _METRICS:
+        metric = f'{METRIC_PREFIX}_{suffix}'
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {metric_type}']
+        for (name, labels), values in sorted(totals.items()):
+            label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in (('span', name),) + labels)
+            lines.append(f'{metric}{{{label_text}}} {values[field]:.9g}')
+    return '\n'.join(lines) + '\n'
+
+def write_prometheus(path):
+    """Writes the current snapshot atomically (for a node_exporter textfile collector, say)."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(prometheus_snapshot())
+    os.replace(tmp_path, path)
+
+@atexit.register
+def _write_prometheus_at_exit():
+    path = os.environ.get(PROMETHEUS_ENV)
+    # Worker processes only log their spans; the snapshot file belongs to the main process
+    if _enabled and path and _totals and multiprocessing.parent_process() is None:
+        write_prometheus(path)
+
+def load_log(path):
+    """Reads the span records of a JSON-lines log."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarize(records):
+    """
+    Per-span totals of a list of records, sorted by total wall time (where the time goes).
+    share_of_run is relative to the top-level spans, so nested spans aren't counted twice.
+    """
+    import pandas as pd # only the summary CLI needs pandas
+    df = pd.DataFrame(records)
+    run_seconds = df.loc[df['parent'].isna(), 'wall_seconds'].sum()
+    summary = df.groupby('span').agg(calls=('span', 'size'), wall_seconds=('wall_seconds', 'sum'),
+                                     cpu_seconds=('cpu_seconds', 'sum'), rows=('rows', 'sum'),
+                                     peak_rss_mb=('peak_rss_bytes', 'max'))
+    summary['peak_rss_mb'] /= 2**20
+    summary['share_of_run'] = summary['wall_seconds'] / run_seconds
+    return summary.sort_values('wall_seconds', ascending=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a span log written with LOAN_INSTRUMENTATION=1.")
+    parser.add_argument("log", help="JSON-lines span log (LOAN_INSTRUMENTATION_LOG)")
+    parser.add_argument("--prometheus", action="store_true", help="Print the log's totals as Prometheus text instead")
+    args = parser.parse_args()
+
+    records = load_log(args.log)
+    if args.prometheus:
+        totals = {}
+        for record in records:
+            _accumulate(totals, record)
+        print(prometheus_snapshot(totals), end='')
+    else:
+        print(summarize(records).to_string(float_format=lambda value: f'{value:,.3f}'))
@@ -0,0 +1,310 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import joblib
+import numpy as np
+import pandas as pd
+
+from compiled_model import load_compiled_model
+from data_store import FileHasher
+from feature_pipeline import load_feature_transform
+
+# Versions live in models/registry/<version>/; CURRENT names the one that is served, CHALLENGERS
+# the ones shadow-scored next to it (champion_challenger.py), one per line
+REGISTRY_DIR = "registry"
+CURRENT_FILE = "CURRENT"
+CHALLENGERS_FILE = "CHALLENGERS"
+MODEL_FILE = "model.joblib"
+COMPILED_DIR = "compiled"
+TRANSFORM_FILE = "feature_transform.pkl"
+METADATA_FILE = "metadata.json"
+# Training-time feature / prediction histograms the drift monitor compares live traffic with
+DRIFT_REFERENCE_FILE = "drift_reference.npz"
+# Node expectations / feature means the per-row attributions need (explanations.py)
+EXPLAINER_FILE = "explainer.npz"
+# The rows the version was evaluated on; warm_start_training.py scores updates on them
+HOLDOUT_FILE = "holdout.npz"
+VERSION_PATTERN = re.compile(r'^v(\d+)$')
+# Versions `prune` keeps by default (besides the current one and the challengers)
+KEEP_VERSIONS = 10
+
+class ModelRegistry:
+    """
+    Versioned store of trained models under models/registry/.
+
+    Every version is a directory holding the estimator (an uncompressed joblib dump: NumPy arrays
+    are stored raw, so joblib.load can memory-map them), the NumPy-only export as one .npy file
+    per array (memory-mapped on load, so any number of processes share a single copy of the node
+    arrays in the page cache), the fitted feature transform, the training-time drift profile
+    (drift_monitor.py), the attribution statistics (explanations.py), the holdout rows it was
+    evaluated on and metadata.json with the
+    feature list, test metrics, risk-tier cutoffs and hashes of the model, transform and training
+    data. Versions are never modified after they are written; CURRENT selects the one the scoring
+    code loads and CHALLENGERS the ones shadow-scored against it.
+    """
+
+    def __init__(self, models_dir="../models"):
+        self.models_dir = models_dir
+        self.root = os.path.join(models_dir, REGISTRY_DIR)
+
+    def versions(self):
+        """Registered versions, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted((name for name in os.listdir(self.root) if VERSION_PATTERN.match(name)),
+                      key=lambda name: int(name[1:]))
+
+    def current_version(self):
+        """The served version, or None before anything has been registered."""
+        path = os.path.join(self.root, CURRENT_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return f.read().strip()
+
+    def challengers(self):
+        """Versions shadow-scored next to the current one, in the order they were set."""
+        path = os.path.join(self.root, CHALLENGERS_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def path(self, version=None):
+        version = version or self.current_version()
+        if version is None or not os.path.isdir(os.path.join(self.root, version)):
+            raise FileNotFoundError(f"No model version '{version}' in {self.root}. Run train_model.py first.")
+        return os.path.join(self.root, version)
+
+    def metadata(self, version=None):
+        with open(os.path.join(self.path(version), METADATA_FILE)) as f:
+            return json.load(f)
+
+    def register(self, model, model_name, feature_names, transform_path, compiled=None, metrics=None,
+                 risk_tiers=None, data_path=None, drift_reference=None, explainer=None, holdout=None, promote=True):
+        """
+        Stores a trained model as a new version and (with promote=True) makes it the current one.
+        The version is written to a temporary directory and renamed into place, so readers never
+        see a partial version. `holdout` is the (features frame, labels) pair the model was
+        evaluated on. A model whose dump, transform and training data are byte-identical
+        to an existing version's (a retrain that changed nothing) reuses that version instead.
+        Returns the version name.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        existing = self.versions()
+        version = f"v{int(existing[-1][1:]) + 1 if existing else 1:04d}"
+        tmp_path = os.path.join(self.root, f".{version}.tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        start = time.perf_counter()
+        hasher = FileHasher()
+        joblib.dump(model, os.path.join(tmp_path, MODEL_FILE)) # uncompressed, so mmap_mode works on load
+        hashes = {'model_hash': hasher.digest(os.path.join(tmp_path, MODEL_FILE)),
+                  'transform_hash': hasher.digest(transform_path),
+                  'data_hash': hasher.digest(data_path) if data_path else None}
+        same = self.find(model_name=model_name, **hashes) if hashes['data_hash'] else None
+        if same:
+            shutil.rmtree(tmp_path)
+            print(f"{model_name} is unchanged from model version {same}; not registering a new one")
+            if promote and same != self.current_version():
+                self.promote(same)
+            return same
+        if compiled is not None:
+            compiled.save(os.path.join(tmp_path, COMPILED_DIR))
+        shutil.copyfile(transform_path, os.path.join(tmp_path, TRANSFORM_FILE))
+        if drift_reference is not None:
+            drift_reference.save(os.path.join(tmp_path, DRIFT_REFERENCE_FILE))
+        if explainer is not None:
+            explainer.save(os.path.join(tmp_path, EXPLAINER_FILE))
+        if holdout is not None:
+            X_holdout, y_holdout = holdout
+            np.savez(os.path.join(tmp_path, HOLDOUT_FILE), X=np.asarray(X_holdout, dtype=np.float32),
+                     y=np.asarray(y_holdout), feature_names=np.asarray(list(X_holdout.columns)))
+        metadata = {'version': version, 'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    'model_name': model_name, 'model_class': type(model).__name__,
+                    'feature_names': list(feature_names), 'metrics': metrics or {}, 'risk_tiers': risk_tiers,
+                    'data_path': data_path, **hashes}
+        with open(os.path.join(tmp_path, METADATA_FILE), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.root, version))
+        print(f"Registered {model_name} as model version {version} in {time.perf_counter() - start:.2f}s")
+        if promote:
+            self.promote(version)
+        return version
+
+    def holdout(self, version=None):
+        """(X, y) of the holdout saved with a version, or None for versions registered without one."""
+        path = os.path.join(self.path(version), HOLDOUT_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return pd.DataFrame(data['X'], columns=data['feature_names']), data['y']
+
+    def find(self, **fields):
+        """The newest version whose metadata has all these values, or None."""
+        for version in reversed(self.versions()):
+            metadata = self.metadata(version)
+            if all(metadata.get(name) == value for name, value in fields.items()):
+                return version
+        return None
+
+    def promote(self, version):
+        """Makes `version` the one load() and the scoring code use by default."""
+        self.path(version)
+        tmp_path = os.path.join(self.root, CURRENT_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(version + '\n')
+        os.replace(tmp_path, os.path.join(self.root, CURRENT_FILE))
+        print(f"Current model version: {version}")
+
+    def set_challengers(self, versions):
+        """Replaces the challenger list (an empty list stops shadow scoring)."""
+        for version in versions:
+            self.path(version)
+        tmp_path = os.path.join(self.root, CHALLENGERS_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.writelines(version + '\n' for version in versions)
+        os.replace(tmp_path, os.path.join(self.root, CHALLENGERS_FILE))
+        print(f"Challenger versions: {', '.join(versions) or 'none'}")
+
+    def prune(self, keep=KEEP_VERSIONS):
+        """
+        Deletes every version but the newest `keep`, the current one and the challengers. A
+        process that already loaded a deleted version keeps its memory-mapped arrays until it
+        exits. Returns the deleted versions.
+        """
+        if keep < 1:
+            raise ValueError("keep must be at least 1, so version numbers are never reused")
+        protected = {self.current_version(), *self.challengers()}
+        versions = self.versions()
+        deleted = [version for version in versions[:-keep] if version not in protected]
+        for version in deleted:
+            shutil.rmtree(os.path.join(self.root, version))
+        print(f"Deleted {len(deleted)} model version(s){': ' + ', '.join(deleted) if deleted else ''}")
+        return deleted
+
+    def load(self, version=None, engine="native", mmap_mode='r'):
+        """
+        (model, transform, metadata) of a version (default: the current one), with the transform
+        restricted to the model's features. engine="compiled" loads the NumPy-only export.
+        """
+        path = self.path(version)
+        metadata = self.metadata(version)
+        transform = load_feature_transform(os.path.join(path, TRANSFORM_FILE))
+        transform.select_features(metadata['feature_names'])
+        if engine == "compiled":
+            model = load_compiled_model(os.path.join(path, COMPILED_DIR), mmap_mode=mmap_mode)
+        else:
+            model = joblib.load(os.path.join(path, MODEL_FILE), mmap_mode=mmap_mode)
+        return model, transform, metadata
+
+def _probe(models_dir, layout, engine):
+    """
+    Runs in a fresh interpreter: loads the artifacts the way the app / workers do, scores one row,
+    prints the timings as JSON and waits for stdin to close so the parent can inspect its memory.
+    """
+    from scoring import load_scoring_artifacts, load_flat_artifacts, predict_default_probability
+    start = time.perf_counter()
+    if layout == 'registry':
+        model, transform = load_scoring_artifacts(models_dir, engine=engine)
+    else:
+        model, transform = load_flat_artifacts(models_dir, engine=engine)
+    loaded = time.perf_counter()
+    predict_default_probability(model, transform, {})
+    print(json.dumps({'load_seconds': loaded - start,
+                      'first_predict_seconds': time.perf_counter() - loaded}), flush=True)
+    sys.stdin.read()
+
+def _memory_mb(pid):
+    """Rss and Pss (shared pages divided between the processes mapping them) of a process, from smaps_rollup."""
+    values = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in ('Rss', 'Pss'):
+                    values[name.lower() + '_mb'] = int(rest.split()[0]) / 1024
+    except OSError:
+        pass
+    return values
+
+def measure_cold_start(models_dir="../models", workers=4):
+    """
+    Starts `workers` fresh processes per (layout, engine) that load the model at the same time,
+    like a batch-scoring pool, and reports the time to a first prediction (ready_seconds includes
+    interpreter start-up and imports) and the memory per process. Pss counts pages shared between
+    the processes once in total, so its sum is what the pool really costs.
+    """
+    rows = []
+    for layout in ('legacy', 'registry'):
+        for engine in ('native', 'compiled'):
+            start = time.perf_counter()
+            processes = [subprocess.Popen([sys.executable, __file__, '_probe', '--models-dir', models_dir,
+                                           '--layout', layout, '--engine', engine],
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                         for _ in range(workers)]
+            results = [json.loads(process.stdout.readline()) for process in processes]
+            ready = time.perf_counter() - start
+            memory = [_memory_mb(process.pid) for process in processes]
+            for process in processes:
+                process.communicate('')
+            row = {'layout': layout, 'engine': engine, 'ready_seconds': ready}
+            for key in results[0]:
+                row[key] = max(result[key] for result in results)
+            row['rss_mb_per_process'] = max(m.get('rss_mb', 0) for m in memory)
+            row['pss_mb_total'] = sum(m.get('pss_mb', 0) for m in memory)
+            rows.append(row)
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and manage the versioned model registry.")
+    parser.add_argument("command", choices=["list", "show", "promote", "challengers", "prune", "cold-start", "_probe"])
+    parser.add_argument("versions", nargs="*", metavar="version",
+                        help="Version for show / promote (default: current); the new list for challengers")
+    parser.add_argument("--models-dir", default="../models")
+    parser.add_argument("--workers", type=int, default=4, help="Processes loading at once for cold-start")
+    parser.add_argument("--clear", action="store_true", help="challengers: stop shadow-scoring every challenger")
+    parser.add_argument("--keep", type=int, default=KEEP_VERSIONS,
+                        help="prune: newest versions to keep besides the current one and the challengers")
+    parser.add_argument("--layout", choices=["legacy", "registry"], default="registry", help=argparse.SUPPRESS)
+    parser.add_argument("--engine", choices=["native", "compiled"], default="native", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.models_dir)
+    version = args.versions[0] if args.versions else None
+    if args.command == "list":
+        # * current, + challenger
+        current = registry.current_version()
+        challengers = registry.challengers()
+        for version in registry.versions():
+            metadata = registry.metadata(version)
+            test = {row['Model']: row for row in metadata['metrics'].get('test', [])}.get(metadata['model_name'], {})
+            marker = '*' if version == current else '+' if version in challengers else ' '
+            print(f"{marker} {version}  {metadata['created']}  {metadata['model_name']:<20} "
+                  f"ROC-AUC {test.get('ROC-AUC', float('nan')):.4f}  data {str(metadata['data_hash'])[:12]}")
+    elif args.command == "show":
+        print(json.dumps(registry.metadata(version), indent=2))
+    elif args.command == "promote":
+        if not version:
+            parser.error("promote needs a version")
+        registry.promote(version)
+    elif args.command == "challengers":
+        if args.versions or args.clear:
+            registry.set_challengers(args.versions)
+        else:
+            print(', '.join(registry.challengers()) or 'No challengers')
+    elif args.command == "prune":
+        if args.keep < 1:
+            parser.error("--keep must be at least 1")
+        registry.prune(args.keep)
+    elif args.command == "cold-start":
+        print(pd.DataFrame(measure_cold_start(args.models_dir, args.workers)).round(3).to_string(index=False))
+    else:
+        _probe(args.models_dir, args.layout, args.engine)
@@ -0,0 +1,252 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from data_store import intermediate_path, FileHasher
+from instrumentation import span
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+RAW_PATH = "../data/raw/loan_default_data.csv"
+# Run state (stage keys, output fingerprints, file hash cache) and one log per stage
+STATE_DIR = "../.pipeline"
+# Environment variables that change what a stage writes, so they are part of every stage key
+KEY_ENV_VARS = ('LOAN_DATA_FORMAT',)
+
+class Stage:
+    """
+    One node of the pipeline DAG: a src/ script run as `python script *args` from src/.
+    `inputs` are the files (or columnar dataset directories) it reads, `outputs` the ones it must
+    leave behind, and `deps` the stages that produce its inputs.
+    """
+
+    def __init__(self, name, script, inputs=(), outputs=(), deps=(), args=()):
+        self.name = name
+        self.script = script
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.args = list(args)
+
+def build_stages(train_args=()):
+    """raw -> processed -> engineered -> trained -> evaluated, with EDA as a branch off the raw data."""
+    processed = intermediate_path("processed_loan_data")
+    engineered = intermediate_path("engineered_loan_data")
+    transform = "../models/feature_transform.pkl"
+    model_files = ["../models/best_model.pkl", "../models/feature_names.pkl", "../models/compiled_model.npz",
+                   "../models/risk_tiers.json", "../models/predictions_cache.npz"]
+    # Names the registry version train_model.py registered last
+    current_version = "../models/registry/CURRENT"
+    stages = [
+        Stage('preprocess', 'data_preprocessing.py', inputs=[RAW_PATH], outputs=[processed, transform]),
+        Stage('features', 'feature_engineering.py', inputs=[processed], outputs=[engineered], deps=['preprocess']),
+        Stage('eda', 'eda.py', inputs=[RAW_PATH],
+              outputs=[f"../visualizations/{name}.png" for name in
+                       ('class_distribution', 'correlation_heatmap', 'boxplots', 'default_rate_by_limit_bal')]),
+        Stage('train', 'train_model.py', inputs=[engineered, transform], deps=['features'], args=train_args,
+              outputs=model_files + [current_version, "../visualizations/roc_curves.png"]),
+        Stage('evaluate', 'test_saved_model.py', inputs=[transform, current_version] + model_files[:2], deps=['train']),
+    ]
+    return {stage.name: stage for stage in stages}
+
+def local_imports(script, src_dir=SRC_DIR):
+    """The script plus every src/ module it imports, directly or through other src/ modules (also inside functions)."""
+    found = set()
+    pending = [script]
+    while pending:
+        filename = pending.pop()
+        if filename in found:
+            continue
+        found.add(filename)
+        with open(os.path.join(src_dir, filename)) as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            pending += [name + '.py' for name in names if os.path.exists(os.path.join(src_dir, name + '.py'))]
+    return sorted(found)
+
+def output_fingerprint(path):
+    """(size, mtime) of a file, or of every file in a directory; cheap check that an output wasn't touched."""
+    if os.path.isdir(path):
+        return sorted([os.path.relpath(os.path.join(root, name), path), *output_fingerprint(os.path.join(root, name))]
+                      for root, _, files in os.walk(path) for name in files)
+    if os.path.exists(path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+    return None
+
+def stage_key(stage, hasher, src_dir=SRC_DIR):
+    """
+    Content hash of everything that determines a stage's outputs: its input files, the source of
+    the script and the src/ modules it imports, its arguments and the KEY_ENV_VARS.
+    """
+    parts = {'script': stage.script, 'args': stage.args,
+             'env': {var: os.environ.get(var) for var in KEY_ENV_VARS},
+             'code': {filename: hasher.digest(os.path.join(src_dir, filename))
+                      for filename in local_imports(stage.script, src_dir)},
+             'inputs': {path: hasher.digest(path) for path in stage.inputs}}
+    missing = [path for path, digest in parts['inputs'].items() if digest is None]
+    if missing:
+        raise FileNotFoundError(f"Stage '{stage.name}' is missing its inputs: {', '.join(missing)}")
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def is_current(stage, key, state):
+    """True when the stage last ran with this key and its outputs are still exactly what it left behind."""
+    record = state.get('stages', {}).get(stage.name)
+    return (record is not None and record['key'] == key
+            and all(output_fingerprint(path) == record['outputs'].get(path) for path in stage.outputs))
+
+def select_stages(stages, targets):
+    """The target stages plus everything upstream of them, in DAG order."""
+    selected = set()
+
+    def visit(name):
+        if name not in stages:
+            raise ValueError(f"Unknown stage '{name}' (stages: {', '.join(stages)})")
+        if name not in selected:
+            selected.add(name)
+            for dep in stages[name].deps:
+                visit(dep)
+
+    for name in targets:
+        visit(name)
+    return [name for name in stages if name in selected]
+
+def load_state(state_dir=STATE_DIR):
+    path = os.path.join(state_dir, 'state.json')
+    if not os.path.exists(path):
+        return {'stages': {}, 'hash_cache': {}}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(state, state_dir=STATE_DIR):
+    os.makedirs(state_dir, exist_ok=True)
+    path = os.path.join(state_dir, 'state.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def run_stage(stage, state_dir=STATE_DIR, src_dir=SRC_DIR):
+    """Runs the stage's script in a subprocess, logging its output to state_dir/logs/<stage>.log. Returns (ok, seconds)."""
+    log_dir = os.path.join(state_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    start = time.perf_counter()
+    with open(os.path.join(log_dir, f'{stage.name}.log'), 'w') as log, span('pipeline.stage', stage=stage.name):
+        process = subprocess.run([sys.executable, stage.script, *stage.args], cwd=src_dir,
+                                 stdout=log, stderr=subprocess.STDOUT)
+    return process.returncode == 0, time.perf_counter() - start
+
+def run_pipeline(stages, targets=None, force=(), jobs=2, dry_run=False, state_dir=STATE_DIR):
+    """
+    Runs the selected stages (the targets and everything upstream, default: all) as a DAG.
+
+    A stage becomes ready once its dependencies have finished; its key is then computed from the
+    current content of its inputs. Stages whose key matches the last successful run and whose
+    outputs are untouched are skipped, so a change only reruns the stages it reaches: a stage whose
+    upstream reran but produced identical files is skipped too. Up to `jobs` ready stages run at
+    once (EDA runs alongside training). `force` names stages to rerun regardless.
+    With dry_run=True nothing runs; stages that would run are listed.
+    Returns {stage name: 'skipped' | 'ran' | 'failed' | 'blocked' | 'would run'}.
+    """
+    names = select_stages(stages, targets or list(stages))
+    state = load_state(state_dir)
+    hasher = FileHasher(state.setdefault('hash_cache', {}))
+    status = {}
+    lock = threading.Lock()
+
+    def ready():
+        started = {name for name, _ in running.values()}
+        return [name for name in names if name not in status and name not in started
+                and all(status.get(dep) in ('skipped', 'ran', 'would run') for dep in stages[name].deps)]
+
+    def finish(name, key, ok, seconds):
+        stage = stages[name]
+        with lock:
+            if ok and all(os.path.exists(path) for path in stage.outputs):
+                state['stages'][name] = {'key': key, 'seconds': seconds, 'finished': time.time(),
+                                         'outputs': {path: output_fingerprint(path) for path in stage.outputs}}
+                status[name] = 'ran'
+            else:
+                if ok:
+                    print(f"  {name}: finished without writing {', '.join(p for p in stage.outputs if not os.path.exists(p))}")
+                state['stages'].pop(name, None)
+                status[name] = 'failed'
+            save_state(state, state_dir)
+        print(f"[{status[name]}] {name} ({seconds:.1f}s, log: {os.path.join(state_dir, 'logs', name + '.log')})")
+
+    def schedule(name, pool):
+        stage = stages[name]
+        if dry_run and any(status[dep] == 'would run' for dep in stage.deps):
+            status[name] = 'would run'
+            print(f"[would run] {name} (after upstream changes)")
+            return
+        try:
+            key = stage_key(stage, hasher)
+        except FileNotFoundError as e:
+            print(f"[failed] {name}: {e}")
+            status[name] = 'failed'
+            return
+        if name not in force and is_current(stage, key, state):
+            status[name] = 'skipped'
+            print(f"[skipped] {name} (unchanged, key {key[:12]})")
+        elif dry_run:
+            status[name] = 'would run'
+            print(f"[would run] {name}")
+        else:
+            print(f"[running] {name}: python {' '.join([stage.script, *stage.args])}")
+            running[pool.submit(run_stage, stage, state_dir)] = (name, key)
+
+    running = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while True:
+            # A skipped stage can make its dependents ready straight away
+            pending = ready()
+            while pending:
+                for name in pending:
+                    schedule(name, pool)
+                pending = ready()
+
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, key = running.pop(future)
+                finish(name, key, *future.result())
+
+    # Stages below a failure never became ready
+    for name in names:
+        status.setdefault(name, 'blocked')
+    if not dry_run:
+        with lock:
+            save_state(state, state_dir)
+        print(f"Pipeline finished in {time.perf_counter() - start:.1f}s: "
+              + ", ".join(f"{name} {status[name]}" for name in names))
+    return status
+
+if __name__ == "__main__":
+    stage_names = list(build_stages())
+    parser = argparse.ArgumentParser(description="Run the pipeline stages as a DAG, skipping stages whose inputs, code and parameters are unchanged.")
+    parser.add_argument("targets", nargs="*", help=f"Stages to bring up to date with their upstream stages (default: all of {', '.join(stage_names)})")
+    parser.add_argument("--force", nargs="+", default=[], metavar="STAGE", help="Rerun these stages even if unchanged")
+    parser.add_argument("--jobs", type=int, default=2, help="Independent stages run at the same time")
+    parser.add_argument("--train-args", default="", help='Extra train_model.py arguments, e.g. "--cores 4 --search"')
+    parser.add_argument("--dry-run", action="store_true", help="Only show which stages would run")
+    parser.add_argument("--state-dir", default=STATE_DIR)
+    args = parser.parse_args()
+
+    stages = build_stages(shlex.split(args.train_args))
+    status = run_pipeline(stages, args.targets, args.force, args.jobs, args.dry_run, args.state_dir)
+    sys.exit(1 if any(value in ('failed', 'blocked') for value in status.values()) else 0)
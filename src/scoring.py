@@ -0,0 +1,95 @@
+import json
+import os
+import warnings
+import joblib
+import numpy as np
+
+from feature_pipeline import load_feature_transform
+from compiled_model import load_compiled_model
+from model_registry import ModelRegistry
+from instrumentation import instrumented
+
+# Fallback probability cutoffs for the risk tiers, used until training has written tuned ones
+HIGH_RISK_THRESHOLD = 0.8
+MEDIUM_RISK_THRESHOLD = 0.5
+# Cutoffs tuned on out-of-fold predictions by train_model.py
+RISK_TIERS_FILE = "risk_tiers.json"
+RISK_TIERS = np.array(['LOW', 'MEDIUM', 'HIGH'])
+
+# Models are fitted on DataFrames but served plain arrays in feature_names order (checked on load)
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+def load_scoring_artifacts(models_dir="../models", single_threaded=False, engine="native", version=None):
+    """
+    Loads the saved model and its fitted feature transform, restricted to the features the model uses.
+    The model comes from the registry (model_registry.py: `version`, default the current one) with
+    its arrays memory-mapped, or from the flat files of models trained before the registry existed.
+    engine="compiled" loads the NumPy-only export of the model instead of unpickling the
+    sklearn/XGBoost estimator; it is much faster for single rows and small batches.
+    single_threaded=True pins the native model to one thread, for use inside worker processes where
+    n_jobs=-1 would oversubscribe the machine.
+    """
+    registry = ModelRegistry(models_dir)
+    if version is None and registry.current_version() is None:
+        return load_flat_artifacts(models_dir, single_threaded, engine)
+    model, transform, _ = registry.load(version, engine)
+    if single_threaded and engine != "compiled" and 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=1)
+    return model, transform
+
+def load_flat_artifacts(models_dir="../models", single_threaded=False, engine="native"):
+    """load_scoring_artifacts for the unversioned best_model.pkl / compiled_model.npz files in models_dir."""
+    feature_names = joblib.load(os.path.join(models_dir, "feature_names.pkl"))
+    transform = load_feature_transform(os.path.join(models_dir, "feature_transform.pkl"))
+    transform.select_features(feature_names)
+
+    if engine == "compiled":
+        model = load_compiled_model(os.path.join(models_dir, "compiled_model.npz"))
+        if model.feature_names != list(feature_names):
+            raise ValueError("compiled_model.npz was exported for a different feature layout. Re-run compiled_model.py.")
+        return model, transform
+
+    model = joblib.load(os.path.join(models_dir, "best_model.pkl"))
+    if single_threaded and 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=1)
+    return model, transform
+
+@instrumented('score.predict')
+def predict_default_probability(model, transform, raw, monitor=None, return_features=False):
+    """
+    Maps raw applicant rows through the fitted transform and returns P(default) per row.
+    A DriftMonitor (drift_monitor.py) passed as `monitor` also counts the rows and their scores.
+    return_features=True returns (probabilities, feature matrix), so callers that also need the
+    matrix (attributions) don't transform the rows a second time.
+    """
+    X = transform.transform(raw)
+    probabilities = model.predict_proba(X)[:, 1]
+    if monitor is not None:
+        monitor.update(X, probabilities)
+    return (probabilities, X) if return_features else probabilities
+
+def load_risk_thresholds(models_dir="../models"):
+    """
+    (medium, high) tier cutoffs of the current registry version (saved next to the model by
+    train_model.py for older models), or the fallback constants for models trained before the
+    cutoffs were tuned.
+    """
+    registry = ModelRegistry(models_dir)
+    if registry.current_version() is not None:
+        tiers = registry.metadata().get('risk_tiers')
+        if tiers:
+            return tiers['medium'], tiers['high']
+    path = os.path.join(models_dir, RISK_TIERS_FILE)
+    if not os.path.exists(path):
+        return MEDIUM_RISK_THRESHOLD, HIGH_RISK_THRESHOLD
+    with open(path) as f:
+        tiers = json.load(f)
+    return tiers['medium'], tiers['high']
+
+def assign_risk_tiers(probabilities, thresholds=None):
+    """
+    Vectorized LOW / MEDIUM / HIGH tiering of default probabilities; a probability equal to a
+    cutoff belongs to the higher tier. `thresholds` is (medium, high), see load_risk_thresholds.
+    """
+    thresholds = thresholds or (MEDIUM_RISK_THRESHOLD, HIGH_RISK_THRESHOLD)
+    return RISK_TIERS[np.searchsorted(thresholds, probabilities, side='right')]
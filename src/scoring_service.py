@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+import numpy as np
+
+from scoring import load_scoring_artifacts, load_risk_thresholds, predict_default_probability, assign_risk_tiers
+from drift_monitor import DriftMonitor, load_drift_reference
+from champion_challenger import load_multi_model_scorer
+from model_registry import ModelRegistry
+from instrumentation import span, prometheus_snapshot
+
+class LatencyStats:
+    """Rolling request latencies and a power-of-two histogram of scored batch sizes."""
+
+    def __init__(self, window=10_000):
+        self.latencies_ms = deque(maxlen=window)
+        self.batch_sizes = {}
+        self.requests = 0
+        self.batches = 0
+        self.rows = 0
+
+    def record_batch(self, size):
+        bucket = 1 << (size - 1).bit_length() # smallest power of two >= size
+        self.batch_sizes[bucket] = self.batch_sizes.get(bucket, 0) + 1
+        self.batches += 1
+        self.rows += size
+
+    def record_request(self, latency_ms):
+        self.latencies_ms.append(latency_ms)
+        self.requests += 1
+
+    def snapshot(self):
+        latencies = np.array(self.latencies_ms) if self.latencies_ms else np.zeros(1)
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'mean_batch_size': round(self.rows / max(self.batches, 1), 2),
+            'latency_ms': {'p50': round(float(np.percentile(latencies, 50)), 3),
+                           'p99': round(float(np.percentile(latencies, 99)), 3),
+                           'max': round(float(latencies.max()), 3)},
+            'batch_size_histogram': {f'<={k}': v for k, v in sorted(self.batch_sizes.items())},
+        }
+
+class MicroBatcher:
+    """
+    Collects concurrent scoring requests into one transform + predict_proba call.
+
+    When idle, the first request waits at most `window_ms` for company. While a batch is being
+    scored new requests keep queueing, so the next batch grows with the load on its own: under
+    light traffic batches stay small and latency stays close to a single call, under heavy
+    traffic the per-call overhead of the tree ensemble is shared by up to `max_batch_size` rows.
+    With a MultiModelScorer (champion_challenger.py) as `scorer`, each batch is scored through it, so
+    challengers shadow-score the batch in its background pool after the champion has answered.
+    """
+
+    def __init__(self, model, transform, stats, window_ms=2.0, max_batch_size=256, monitor=None, scorer=None):
+        self.model = model
+        self.transform = transform
+        self.stats = stats
+        self.monitor = monitor
+        self.scorer = scorer
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.queue = asyncio.Queue()
+
+    async def score(self, rows, ids=None):
+        """Queues raw rows (raw_columns order) and returns their default probabilities; `ids` label them in the shadow log."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((rows, ids if ids is not None else [''] * len(rows), future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            n_rows = len(batch[0][0])
+            deadline = loop.time() + self.window
+            while n_rows < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0 and self.queue.empty():
+                    break
+                try:
+                    item = self.queue.get_nowait() if not self.queue.empty() else \
+                        await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                n_rows += len(item[0])
+
+            # A malformed item fails its own request only, never the batch (or this task)
+            n_cols = len(self.transform.raw_columns)
+            valid = []
+            for item in batch:
+                if np.ndim(item[0]) == 2 and np.shape(item[0])[1] == n_cols and len(item[0]) == len(item[1]):
+                    valid.append(item)
+                else:
+                    item[2].set_exception(ValueError(f"Expected a (rows, {n_cols}) array and one ID per row"))
+            batch = valid
+            if not batch:
+                continue
+            try:
+                rows = np.concatenate([item[0] for item in batch])
+                ids = [row_id for item in batch for row_id in item[1]]
+                # Score off the event loop so connections keep being accepted meanwhile
+                probabilities = await loop.run_in_executor(None, self._predict, rows, ids)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.stats.record_batch(len(rows))
+            start = 0
+            for item_rows, _, future in batch:
+                future.set_result(probabilities[start:start + len(item_rows)])
+                start += len(item_rows)
+
+    def _predict(self, rows, ids):
+        with span('service.predict_batch', rows=len(rows)):
+            if self.scorer is not None:
+                return self.scorer.score(rows, ids, monitor=self.monitor)
+            return predict_default_probability(self.model, self.transform, rows, monitor=self.monitor)
+
+class ScoringService:
+    """Minimal HTTP/1.1 server (keep-alive, JSON) in front of a MicroBatcher."""
+
+    def __init__(self, models_dir="../models", window_ms=2.0, max_batch_size=256, engine="compiled", challengers=True):
+        # Shadow-score the registry's challenger versions next to the served model, if it lists any
+        self.scorer = None
+        registry = ModelRegistry(models_dir)
+        if challengers and registry.current_version() and registry.challengers():
+            self.scorer = load_multi_model_scorer(models_dir, engine=engine)
+            self.model, self.transform = self.scorer.champion, self.scorer.transform
+            print(f"Shadow-scoring challengers {', '.join(c.version for c in self.scorer.challengers)}")
+        else:
+            self.model, self.transform = load_scoring_artifacts(models_dir, engine=engine)
+        self.thresholds = load_risk_thresholds(models_dir)
+        reference = load_drift_reference(models_dir)
+        self.monitor = DriftMonitor(reference) if reference is not None else None
+        self.stats = LatencyStats()
+        self.window_ms = window_ms
+        self.max_batch_size = max_batch_size
+
+    def _parse_applicants(self, body):
+        """
+        Accepts one applicant object or {"applicants": [...]} in the raw UCI column layout.
+        Returns (rows, ids); an applicant's optional ID only labels its scores in the shadow log.
+        """
+        payload = json.loads(body)
+        applicants = payload['applicants'] if isinstance(payload, dict) and 'applicants' in payload else [payload]
+        if not isinstance(applicants, list) or not applicants:
+            raise ValueError("expected one applicant object or a non-empty 'applicants' list")
+        rows = np.array([[applicant.get(col, np.nan) for col in self.transform.raw_columns]
+                         for applicant in applicants], dtype=np.float64)
+        if rows.ndim != 2 or rows.shape[1] != len(self.transform.raw_columns):
+            raise ValueError("every applicant must be a flat object of raw column values")
+        return rows, [str(applicant.get('ID', '')) for applicant in applicants]
+
+    async def _route(self, method, path, body):
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'ok'}
+        if method == 'GET' and path == '/metrics':
+            return 200, self.stats.snapshot()
+        if method == 'GET' and path == '/metrics/prometheus':
+            # Span totals of this process (empty unless LOAN_INSTRUMENTATION is set) and the drift gauges
+            return 200, prometheus_snapshot() + (self.monitor.prometheus_snapshot() if self.monitor else '')
+        if method == 'GET' and path == '/metrics/drift':
+            if self.monitor is None:
+                return 404, {'error': 'The served model has no drift reference profile'}
+            return 200, {'rows': self.monitor.rows, 'features': self.monitor.report().round(6).to_dict('records')}
+        if method == 'GET' and path == '/metrics/challengers':
+            if self.scorer is None:
+                return 404, {'error': 'No challengers are being shadow-scored'}
+            return 200, self.scorer.summary()
+        if method == 'POST' and path == '/score':
+            start = time.perf_counter()
+            try:
+                rows, ids = self._parse_applicants(body)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                return 400, {'error': f'Invalid request body: {e}'}
+            try:
+                probabilities = await self.batcher.score(rows, ids)
+            except Exception as e:
+                return 500, {'error': f'Scoring failed: {e}'}
+            self.stats.record_request((time.perf_counter() - start) * 1000)
+            return 200, {'predictions': [{'default_probability': round(float(p), 6), 'risk_tier': str(tier)}
+                                         for p, tier in zip(probabilities, assign_risk_tiers(probabilities, self.thresholds))]}
+        return 404, {'error': 'Not found'}
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, payload = await self._route(method, path, body)
+                if isinstance(payload, str):
+                    data, content_type = payload.encode(), 'text/plain; version=0.0.4'
+                else:
+                    data, content_type = json.dumps(payload).encode(), 'application/json'
+                reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+                writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n'
+                             f'Content-Length: {len(data)}\r\n\r\n'.encode() + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        self.batcher = MicroBatcher(self.model, self.transform, self.stats, self.window_ms, self.max_batch_size,
+                                    self.monitor, self.scorer)
+        batch_task = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        print(f"Scoring service listening on http://{host}:{port} "
+              f"(batch window {self.window_ms} ms, max batch {self.max_batch_size})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batch_task.cancel()
+            if self.scorer is not None:
+                self.scorer.close()
+
+async def load_test(host='127.0.0.1', port=8000, concurrency=64, requests_per_client=50):
+    """Fires single-applicant requests from `concurrency` keep-alive clients and reports throughput."""
+    body = json.dumps({'LIMIT_BAL': 50000, 'AGE': 30, 'PAY_0': 1}).encode()
+    request = (f'POST /score HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+               f'Content-Length: {len(body)}\r\n\r\n').encode() + body
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        for _ in range(requests_per_client):
+            writer.write(request)
+            await writer.drain()
+            headers = {}
+            await reader.readline()
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                name, _, value = line.decode().partition(':')
+                headers[name.strip().lower()] = value.strip()
+            await reader.readexactly(int(headers['content-length']))
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    total = concurrency * requests_per_client
+    print(f"{total:,} requests in {elapsed:.2f}s -> {total / elapsed:,.0f} requests/sec")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Low-latency HTTP scoring service with micro-batching.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--models-dir", default="../models")
+    parser.add_argument("--batch-window-ms", type=float, default=2.0)
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--engine", choices=["native", "compiled"], default="compiled")
+    parser.add_argument("--no-challengers", action="store_true",
+                        help="Don't shadow-score the registry's challenger versions (model_registry.py challengers)")
+    parser.add_argument("--load-test", action="store_true", help="Benchmark a running service instead of starting one")
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.load_test:
+        asyncio.run(load_test(args.host, args.port, args.concurrency))
+    else:
+        service = ScoringService(args.models_dir, args.batch_window_ms, args.max_batch_size, args.engine,
+                                 challengers=not args.no_challengers)
+        asyncio.run(service.serve(args.host, args.port))
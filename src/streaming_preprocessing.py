@@ -0,0 +1,172 @@
+import argparse
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+
+from data_preprocessing import TARGET_COL, CATEGORICAL_COLS, RAW_SCHEMA, get_numerical_columns, read_raw_csv
+from feature_pipeline import FeatureTransform, encoded_columns
+from feature_engineering import ENGINEERED_COLS, FEATURE_REGISTRY
+from data_store import COLUMNAR_SUFFIX, ColumnarWriter, CsvWriter, intermediate_path
+from instrumentation import span
+
+class QuantileSketch:
+    """
+    Mergeable approximate quantile summary with bounded memory.
+
+    Each update is reduced to at most `capacity` weighted points; when the summary grows past
+    twice that it is compressed back to `capacity` equal-weight points. Memory is O(capacity)
+    regardless of how many values were seen, and the rank error is roughly 1 / capacity per
+    compression level.
+    """
+
+    def __init__(self, capacity=512):
+        self.capacity = capacity
+        self.values = np.empty(0)
+        self.weights = np.empty(0)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        if len(values) <= self.capacity:
+            points, weights = values, np.ones(len(values))
+        else:
+            points = np.quantile(values, np.linspace(0, 1, self.capacity))
+            weights = np.full(self.capacity, len(values) / self.capacity)
+        self.values = np.concatenate([self.values, points])
+        self.weights = np.concatenate([self.weights, weights])
+        if len(self.values) > 2 * self.capacity:
+            self._compress()
+
+    def _compress(self):
+        order = np.argsort(self.values, kind='stable')
+        values, weights = self.values[order], self.weights[order]
+        total = weights.sum()
+        targets = (np.arange(self.capacity) + 0.5) * total / self.capacity
+        positions = np.searchsorted(np.cumsum(weights), targets)
+        self.values = values[np.minimum(positions, len(values) - 1)]
+        self.weights = np.full(self.capacity, total / self.capacity)
+
+    def quantile(self, q):
+        if len(self.values) == 0:
+            return np.nan
+        order = np.argsort(self.values, kind='stable')
+        values, weights = self.values[order], self.weights[order]
+        # Rank of each point's centre, so a single chunk of raw values gives np.quantile's answer
+        centres = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return float(np.interp(q, centres, values))
+
+def iter_chunks(filepath, chunksize):
+    """Reads the raw CSV lazily with the RAW_SCHEMA dtypes, `chunksize` rows at a time."""
+    return read_raw_csv(filepath, chunksize=chunksize)
+
+def fit_streaming(filepath, chunksize=100_000, sketch_capacity=512, target_col=TARGET_COL):
+    """
+    First pass: accumulates everything encode_categorical, handle_missing_values and
+    normalize_numerical need without holding more than one chunk in memory.
+    Returns the fitted FeatureTransform plus the row count and per-column dtypes seen.
+    """
+    print(f"Pass 1: collecting statistics from {filepath} in chunks of {chunksize:,} rows...")
+    columns = None
+    n_rows = 0
+    for chunk in iter_chunks(filepath, chunksize):
+        if columns is None:
+            columns = list(chunk.columns)
+            raw_columns = [col for col in columns if col not in ('ID', target_col)]
+            sketches = {col: QuantileSketch(sketch_capacity) for col in raw_columns}
+            levels = {col: set() for col in CATEGORICAL_COLS}
+            # Scaler statistics are kept for every raw column; the scaled subset is chosen at the end
+            scaler = StandardScaler()
+            n_missing = np.zeros(len(raw_columns))
+            dtypes = {}
+
+        values = chunk[raw_columns].to_numpy(dtype=np.float64)
+        scaler.partial_fit(values)
+        n_missing += np.isnan(values).sum(axis=0)
+        for i, col in enumerate(raw_columns):
+            sketches[col].update(values[:, i])
+        for col in CATEGORICAL_COLS:
+            levels[col].update(chunk[col].dropna().unique().tolist())
+        for col in columns:
+            dtypes[col] = np.result_type(dtypes.get(col, chunk[col].dtype), chunk[col].dtype)
+        n_rows += len(chunk)
+        print(f"  scanned {n_rows:,} rows")
+
+    medians = np.array([sketches[col].quantile(0.5) for col in raw_columns])
+
+    # handle_missing_values imputes medians before scaling, so fold the imputed values into the
+    # mean and variance that partial_fit accumulated over the observed values only
+    n_seen = scaler.n_samples_seen_ if np.ndim(scaler.n_samples_seen_) else np.full(len(raw_columns), scaler.n_samples_seen_)
+    n_total = n_seen + n_missing
+    mean = (n_seen * scaler.mean_ + n_missing * medians) / n_total
+    var = (n_seen * (scaler.var_ + (scaler.mean_ - mean) ** 2) + n_missing * (medians - mean) ** 2) / n_total
+    scale = np.sqrt(var)
+    scale[scale == 0] = 1.0
+
+    categorical_levels = {col: np.array(sorted(levels[col])) for col in CATEGORICAL_COLS}
+    scaled_cols = get_numerical_columns(encoded_columns(columns, categorical_levels), target_col)
+    scaled_idx = [raw_columns.index(col) for col in scaled_cols]
+    transform = FeatureTransform(target_col)
+    transform.set_statistics(columns, medians, categorical_levels, mean[scaled_idx], scale[scaled_idx])
+    return transform, n_rows, dtypes
+
+def output_dtypes(transform, raw_dtypes, engineer=False):
+    """dtypes matching what the in-memory pipeline produces for each output column."""
+    dtypes = {}
+    for col in transform.encoded_columns:
+        if col in transform.scaled_cols:
+            dtypes[col] = np.dtype(np.float32)
+        elif col in raw_dtypes:
+            # Imputed columns take their schema dtype even if some chunks held NaN
+            dtypes[col] = np.dtype(RAW_SCHEMA.get(col, raw_dtypes[col]))
+        else:
+            dtypes[col] = np.dtype(bool) # one-hot indicator from get_dummies
+    if engineer:
+        for col in ENGINEERED_COLS:
+            # feature_engineering stores flags and counts as int8, everything else as float32
+            dtypes[col] = np.dtype(np.int8) if FEATURE_REGISTRY[col].integer else np.dtype(np.float32)
+    return dtypes
+
+def transform_streaming(filepath, output_path, transform, n_rows, raw_dtypes, chunksize=100_000, engineer=False):
+    """
+    Second pass: imputes, one-hot encodes with the fixed vocabulary from pass 1 and scales each
+    chunk, then writes it straight to `output_path`. With engineer=True the feature_engineering
+    columns are appended too, fusing the two stages into one pass.
+    """
+    print(f"Pass 2: transforming and writing to {output_path}...")
+    dtypes = output_dtypes(transform, raw_dtypes, engineer)
+    feature_index = {col: i for i, col in enumerate(transform.feature_names)}
+    if output_path.endswith(COLUMNAR_SUFFIX):
+        writer = ColumnarWriter(output_path, dtypes, n_rows)
+    else:
+        writer = CsvWriter(output_path, dtypes)
+
+    start = 0
+    for chunk in iter_chunks(filepath, chunksize):
+        features = transform.transform(chunk)
+        block = {}
+        for col, dtype in dtypes.items():
+            values = chunk[col].to_numpy() if col in ('ID', transform.target_col) else features[:, feature_index[col]]
+            block[col] = values.astype(dtype, copy=False)
+        writer.write(start, block)
+        start += len(chunk)
+        print(f"  wrote {start:,} / {n_rows:,} rows")
+    writer.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Out-of-core preprocessing for raw files larger than RAM.")
+    parser.add_argument("--input", default="../data/raw/loan_default_data.csv")
+    parser.add_argument("--output", default=None, help="Defaults to the configured intermediate format in data/processed/")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    parser.add_argument("--engineer", action="store_true", help="Also append feature_engineering columns (writes engineered_loan_data)")
+    parser.add_argument("--transform-path", default="../models/feature_transform.pkl")
+    args = parser.parse_args()
+
+    output_path = args.output or intermediate_path("engineered_loan_data" if args.engineer else "processed_loan_data")
+    with span('preprocess.streaming_fit') as fit_span:
+        transform, n_rows, raw_dtypes = fit_streaming(args.input, args.chunksize)
+        fit_span.set_rows(n_rows)
+    transform.save(args.transform_path)
+    with span('preprocess.streaming_transform', rows=n_rows, engineer=args.engineer):
+        transform_streaming(args.input, output_path, transform, n_rows, raw_dtypes, args.chunksize, args.engineer)
+    print(f"\nProcessed data saved to {output_path}")
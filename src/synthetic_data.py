@@ -0,0 +1,176 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+from scipy.stats import ks_2samp, rankdata
+
+from data_preprocessing import TARGET_COL, RAW_SCHEMA, read_raw_csv
+
+# Rows per generated chunk. Every chunk draws from its own random stream, so a file depends only
+# on the seed and the chunk size, never on how many workers produced it.
+DEFAULT_CHUNKSIZE = 500_000
+# Eigenvalue floor when repairing a copula correlation matrix, so its Cholesky factor always exists
+MIN_EIGENVALUE = 1e-6
+# Rows sampled for the fidelity report
+REPORT_ROWS = 100_000
+
+def _nearest_correlation(corr):
+    """Clips the eigenvalues of a symmetric matrix and rescales it to a positive definite correlation matrix."""
+    eigenvalues, eigenvectors = np.linalg.eigh(corr)
+    corr = (eigenvectors * np.maximum(eigenvalues, MIN_EIGENVALUE)) @ eigenvectors.T
+    scale = np.sqrt(np.diag(corr))
+    return corr / np.outer(scale, scale)
+
+class SyntheticCreditGenerator:
+    """
+    Gaussian-copula model of the UCI credit file, fitted separately for defaulters and non-defaulters.
+
+    For each class the Spearman rank correlations between all columns (including the month-to-month
+    correlations of PAY_x, BILL_AMTx and PAY_AMTx) are turned into the Gaussian copula correlations
+    that reproduce them. Sampling draws correlated normals, turns them into percentiles and reads each column's
+    value off that class's empirical distribution: categorical codes, ages and repayment statuses
+    take observed values with their observed frequencies, amounts are interpolated between
+    observed values and rounded to whole dollars. Rows are labelled default with the training
+    default rate, so class-conditional patterns (and the ~22% rate) carry over. No source row is
+    copied; only per-column distributions and one correlation matrix per class are stored.
+    """
+
+    def __init__(self, target_col=TARGET_COL):
+        self.target_col = target_col
+
+    def fit(self, df):
+        """Learns the marginals and copula correlations from a raw frame in the UCI layout."""
+        self.columns = list(df.columns)
+        self.feature_cols = [col for col in self.columns if col not in ('ID', self.target_col)]
+        # Integer columns of the schema are sampled from observed values only
+        self.discrete = np.array([np.dtype(RAW_SCHEMA.get(col, np.float32)).kind == 'i' for col in self.feature_cols])
+
+        df = df.dropna(subset=self.feature_cols + [self.target_col])
+        y = df[self.target_col].to_numpy()
+        self.default_rate = float(y.mean())
+        self.classes = {}
+        for label in (0, 1):
+            values = df.loc[y == label, self.feature_cols].to_numpy(dtype=np.float64)
+            spearman = np.nan_to_num(np.corrcoef(rankdata(values, axis=0), rowvar=False)) # constant columns correlate with nothing
+            np.fill_diagonal(spearman, 1.0)
+            # A Gaussian copula with correlation 2 sin(pi/6 * rho_s) has Spearman correlation rho_s
+            corr = _nearest_correlation(2 * np.sin(np.pi / 6 * spearman))
+            self.classes[label] = (np.sort(values, axis=0), np.linalg.cholesky(corr))
+        return self
+
+    def _sample_class(self, label, n_rows, rng):
+        sorted_values, cholesky = self.classes[label]
+        n = len(sorted_values)
+        percentiles = ndtr(rng.standard_normal((n_rows, len(self.feature_cols))) @ cholesky.T)
+        out = np.empty_like(percentiles)
+        for j, discrete in enumerate(self.discrete):
+            if discrete:
+                out[:, j] = sorted_values[np.minimum((percentiles[:, j] * n).astype(np.int64), n - 1), j]
+            else:
+                out[:, j] = np.round(np.interp(percentiles[:, j] * (n - 1), np.arange(n), sorted_values[:, j]))
+        return out
+
+    def sample(self, n_rows, rng, first_id=1):
+        """n_rows synthetic rows in the source's column layout, with IDs first_id, first_id + 1, ..."""
+        y = (rng.random(n_rows) < self.default_rate).astype(np.int8)
+        features = np.empty((n_rows, len(self.feature_cols)))
+        for label in self.classes:
+            rows = np.flatnonzero(y == label)
+            features[rows] = self._sample_class(label, len(rows), rng)
+
+        data = {col: features[:, j].astype(np.int64) if discrete else features[:, j]
+                for j, (col, discrete) in enumerate(zip(self.feature_cols, self.discrete))}
+        data['ID'] = np.arange(first_id, first_id + n_rows)
+        data[self.target_col] = y
+        return pd.DataFrame(data, columns=self.columns)
+
+# Each worker process gets the fitted generator once and keeps it for every chunk it produces
+_worker_generator = None
+_worker_seed = None
+
+def _init_worker(generator, seed):
+    global _worker_generator, _worker_seed
+    _worker_generator, _worker_seed = generator, seed
+
+def _generate_chunk(index, start, n_rows):
+    """Generates one chunk inside a worker and returns it as ready-to-write CSV text."""
+    rng = np.random.default_rng([_worker_seed, index])
+    return _worker_generator.sample(n_rows, rng, first_id=start + 1).to_csv(index=False, header=False)
+
+def generate_csv(generator, n_rows, output_path, seed=42, chunksize=DEFAULT_CHUNKSIZE, workers=None):
+    """
+    Writes n_rows synthetic rows to output_path as CSV. Chunks are generated in parallel by a
+    process pool and appended in order; the file is renamed into place once complete.
+    """
+    workers = workers or os.cpu_count()
+    chunks = [(index, start, min(chunksize, n_rows - start)) for index, start in enumerate(range(0, n_rows, chunksize))]
+    tmp_path = output_path + '.tmp'
+    start_time = time.perf_counter()
+    rows_written = 0
+    with open(tmp_path, 'w') as out:
+        out.write(','.join(generator.columns) + '\n')
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(generator, seed)) as pool:
+            # Keep a bounded number of chunks in flight so memory does not grow with n_rows
+            pending = []
+
+            def write_oldest():
+                nonlocal rows_written
+                future, size = pending.pop(0)
+                out.write(future.result())
+                rows_written += size
+                print(f"  wrote {rows_written:,} / {n_rows:,} rows")
+
+            for chunk in chunks:
+                pending.append((pool.submit(_generate_chunk, *chunk), chunk[2]))
+                if len(pending) >= 2 * workers:
+                    write_oldest()
+            while pending:
+                write_oldest()
+    os.replace(tmp_path, output_path)
+    elapsed = time.perf_counter() - start_time
+    print(f"Generated {n_rows:,} rows in {elapsed:.1f}s ({n_rows / max(elapsed, 1e-9):,.0f} rows/sec) "
+          f"with {workers} workers: {output_path}")
+
+def fidelity_report(real, synthetic, target_col=TARGET_COL):
+    """
+    Compares synthetic rows with the real ones: default rate, per-column mean / std / KS statistic,
+    and the largest gap between the rank (Spearman) and linear (Pearson) correlation matrices,
+    overall and across months. Pearson gaps on the heavy-tailed amounts are driven by a few extreme
+    rows; the rank correlations are what the copula reproduces.
+    """
+    feature_cols = [col for col in real.columns if col not in ('ID', target_col)]
+    report = pd.DataFrame({
+        'real_mean': real[feature_cols].mean(), 'synthetic_mean': synthetic[feature_cols].mean(),
+        'real_std': real[feature_cols].std(), 'synthetic_std': synthetic[feature_cols].std(),
+        'ks': [ks_2samp(real[col], synthetic[col]).statistic for col in feature_cols],
+    })
+    print(f"Default rate: real {real[target_col].mean():.4f}, synthetic {synthetic[target_col].mean():.4f}")
+    print(report.round(3).to_string())
+    for method in ('spearman', 'pearson'):
+        corr_gap = (real[feature_cols].corr(method) - synthetic[feature_cols].corr(method)).abs()
+        print(f"Largest {method} correlation difference: {corr_gap.to_numpy().max():.3f} "
+              f"(mean {corr_gap.to_numpy().mean():.3f})")
+        for prefix in ('PAY_', 'BILL_AMT', 'PAY_AMT'):
+            months = [col for col in feature_cols if col.startswith(prefix) and col[len(prefix):].isdigit()]
+            print(f"  across {prefix}x months: {corr_gap.loc[months, months].to_numpy().max():.3f}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic applicants with the UCI dataset's distributions.")
+    parser.add_argument("--rows", type=int, required=True, help="Number of rows to generate")
+    parser.add_argument("--output", required=True, help="CSV file to write (UCI column layout)")
+    parser.add_argument("--source", default="../data/raw/loan_default_data.csv", help="Real file to learn the distributions from")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--report", action="store_true", help="Print how closely a sample matches the source")
+    args = parser.parse_args()
+
+    real = read_raw_csv(args.source)
+    generator = SyntheticCreditGenerator().fit(real)
+    if args.report:
+        fidelity_report(real, generator.sample(REPORT_ROWS, np.random.default_rng(args.seed)))
+    generate_csv(generator, args.rows, args.output, args.seed, args.chunksize, args.workers)
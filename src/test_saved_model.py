@@ -1,26 +1,26 @@
-import joblib
-import pandas as pd
+import time
 import numpy as np
+from model_registry import ModelRegistry
+from scoring import load_scoring_artifacts
 
 def test_model():
     """Loads the saved models and tests predictions."""
-    model_path = "../models/best_model.pkl"
-    features_path = "../models/feature_names.pkl"
+    models_dir = "../models"
     
     print("Loading saved artifacts...")
-    model = joblib.load(model_path)
-    feature_names = joblib.load(features_path)
-    print(f"Model loaded successfully: {type(model).__name__}")
+    start = time.perf_counter()
+    model, transform = load_scoring_artifacts(models_dir)
+    version = ModelRegistry(models_dir).current_version() or "unversioned best_model.pkl"
+    print(f"Model loaded successfully: {type(model).__name__} ({version}) in {time.perf_counter() - start:.2f}s")
     
-    # Create a dummy row of data using the exact feature names expected
-    # We will just fill it with zeros, creating a "perfectly average/zero" customer
-    dummy_data = {feature: [0.0] for feature in feature_names}
-    df_fake = pd.DataFrame(dummy_data)
+    # Create a raw applicant with no fields filled in. The transform imputes every column
+    # with its training median, giving a "typical" customer in the model's feature space.
+    X_fake = transform.transform({})
     
-    print("\nRunning inference on fake data shape:", df_fake.shape)
+    print("\nRunning inference on fake data shape:", X_fake.shape)
     
-    prediction = model.predict(df_fake)
-    probability = model.predict_proba(df_fake)[0][1]
+    prediction = model.predict(X_fake)
+    probability = model.predict_proba(X_fake)[0][1]
     
     print(f"Prediction Output: {'Default' if prediction[0] == 1 else 'No Default'}")
     print(f"Probability of Default: {probability:.4f}")
@@ -1,25 +1,38 @@
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split, cross_val_score
+from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
 import xgboost as xgb
 import joblib
 import os
+import json
+import time
+import argparse
 
 # Import our custom evaluation metrics
-from evaluate_model import evaluate_predictions, plot_roc_curves, plot_feature_importance
+from evaluate_model import (ThresholdSweep, evaluate_predictions, plot_roc_curves, plot_feature_importance,
+                            save_prediction_cache)
+from feature_pipeline import load_feature_transform
+from data_store import intermediate_path, dataset_columns, load_dataset, memory_report
+from compiled_model import export_compiled_model, check_parity
+from model_registry import ModelRegistry
+from drift_monitor import ReferenceProfile
+from explanations import Explainer
+from hyperparameter_search import successive_halving_search
+from training_scheduler import (cv_folds, build_training_graph, run_training_graph, run_training_serially,
+                                summarize_cv, fold_models, out_of_fold_probabilities)
+from xgboost_training import train_xgboost_quantized
+from instrumentation import span
 
 def load_and_split_data(filepath):
     print("Loading engineered data...")
-    df = pd.read_csv(filepath)
-    
     # Target feature
     target_col = 'default.payment.next.month'
     
-    # Ensure ID is dropped if it exists
-    if 'ID' in df.columns:
-        df = df.drop('ID', axis=1)
+    # Ensure ID is never read; columnar datasets are memory-mapped column by column
+    columns = [col for col in dataset_columns(filepath) if col != 'ID']
+    df = load_dataset(filepath, columns)
         
     X = df.drop(target_col, axis=1)
     y = df[target_col]
@@ -30,53 +43,112 @@ def load_and_split_data(filepath):
     
     print(f"Training set size: {X_train.shape}")
     print(f"Testing set size: {X_test.shape}")
+    memory_report(X_train, "training features")
     
     return X_train, X_test, y_train, y_test, X.columns
 
-def train_and_evaluate():
-    filepath = "../data/processed/engineered_loan_data.csv"
+def build_models(scale_pos_weight):
+    """The candidate models with their default settings, unfitted."""
+    return {
+        "Logistic Regression": LogisticRegression(class_weight='balanced', max_iter=1000, random_state=42),
+        "Random Forest": RandomForestClassifier(n_estimators=100, class_weight='balanced', random_state=42, n_jobs=-1),
+        "XGBoost": xgb.XGBClassifier(scale_pos_weight=scale_pos_weight, random_state=42, use_label_encoder=False, eval_metric='logloss', n_jobs=-1)
+    }
+
+def train_and_evaluate(parallel=True, core_budget=None, search=False, search_budget=600, search_candidates=27,
+                       quantized_xgboost=True, external_memory=None, register_challengers=True):
+    """
+    Trains, cross-validates and evaluates all models and saves the best one.
+    parallel=True runs the CV folds and final fits through the core-budget-aware scheduler in
+    training_scheduler.py; parallel=False runs them one at a time (serial baseline).
+    Also returns the fitted fold estimators per model; their out-of-fold probabilities and the
+    test-set probabilities are cached in models/predictions_cache.npz.
+    search=True first tunes the models' hyperparameters with a budgeted successive-halving search
+    (hyperparameter_search.py, at most `search_budget` seconds) and trains the tuned versions.
+    quantized_xgboost=True trains XGBoost on pre-quantized hist matrices (xgboost_training.py)
+    instead of through the scheduler; external_memory forces (True) or disables (False) its
+    out-of-core mode, None decides from the free RAM.
+    register_challengers=True also registers the other models and makes them the registry's
+    challengers, which the scoring service shadow-scores next to the best one.
+    """
+    filepath = intermediate_path("engineered_loan_data")
     X_train, X_test, y_train, y_test, feature_names = load_and_split_data(filepath)
     
+    # The fitted preprocessing transform is served next to the model, so it must be able to produce this layout
+    load_feature_transform("../models/feature_transform.pkl").select_features(feature_names)
+    
     # Class weights for imbalanced data. 
     # The default class is ~22%, so we assign higher weight to the minority class (1).
     scale_pos_weight = (len(y_train) - sum(y_train)) / sum(y_train)
     
     print("\n--- Initializing Models ---")
-    models = {
-        "Logistic Regression": LogisticRegression(class_weight='balanced', max_iter=1000, random_state=42),
-        "Random Forest": RandomForestClassifier(n_estimators=100, class_weight='balanced', random_state=42, n_jobs=-1),
-        "XGBoost": xgb.XGBClassifier(scale_pos_weight=scale_pos_weight, random_state=42, use_label_encoder=False, eval_metric='logloss', n_jobs=-1)
-    }
+    models = build_models(scale_pos_weight)
+    
+    if search:
+        print(f"\n--- Hyperparameter Search ({search_candidates} candidates per model, {search_budget}s budget) ---")
+        search_start = time.perf_counter()
+        models, trials = successive_halving_search(models, X_train, y_train, n_candidates=search_candidates,
+                                                   time_budget=search_budget, core_budget=core_budget)
+        trials_path = "../models/search_trials.csv"
+        trials.to_csv(trials_path, index=False)
+        print(f"Search finished in {time.perf_counter() - search_start:.1f}s, {len(trials)} trials logged to {trials_path}")
     
     trained_models = {}
     evaluation_results = []
     
-    print("\n--- Training and Cross-Validating Models ---")
-    for name, model in models.items():
-        print(f"\nTraining {name}...")
-        
-        # Perform 5-Fold Cross Validation on the training set using ROC-AUC as the primary metric
-        cv_scores = cross_val_score(model, X_train, y_train, cv=5, scoring='roc_auc')
-        print(f"{name} 5-Fold CV ROC-AUC: {cv_scores.mean():.4f} (+/- {cv_scores.std() * 2:.4f})")
-        
-        # Fit the model on the full training set
-        model.fit(X_train, y_train)
-        trained_models[name] = model
+    training_start = time.perf_counter()
+    # Every (model x fold) fit plus the final fits form one task graph. Fold fits are kept together
+    # with their out-of-fold probabilities instead of being thrown away after scoring.
+    xgboost_names = [name for name, model in models.items()
+                     if quantized_xgboost and isinstance(model, xgb.XGBClassifier)]
+    tasks = build_training_graph({name: model for name, model in models.items() if name not in xgboost_names},
+                                 X_train, y_train, n_folds=5)
+    if parallel:
+        print(f"\n--- Training and Cross-Validating Models (parallel, {core_budget or os.cpu_count()} cores) ---")
+        task_results, schedule = run_training_graph(tasks, X_train, y_train, core_budget)
+        print(f"Scheduled {schedule['tasks']} fits on {schedule['core_budget']} cores in {schedule['wall_seconds']:.1f}s "
+              f"(sum of fit times {schedule['task_seconds']:.1f}s, {schedule['concurrency']:.1f} fits running on average)")
+    else:
+        print("\n--- Training and Cross-Validating Models ---")
+        task_results, schedule = run_training_serially(tasks, X_train, y_train)
+    # XGBoost sketches its feature quantiles once and reuses them for every fold and the final fit
+    for name in xgboost_names:
+        task_results.update(train_xgboost_quantized(models[name], X_train, y_train, cv_folds(X_train, y_train, 5),
+                                                    name, external_memory))
+    # Compare against a `--serial` run for the baseline
+    print(f"Training wall time: {time.perf_counter() - training_start:.1f}s")
+    
+    cv_models = {}
+    oof_probabilities = {}
+    test_probabilities = {}
+    for name in models:
+        # 5-Fold Cross Validation on the training set using ROC-AUC as the primary metric
+        cv_scores = summarize_cv(task_results, name)
+        oof_probabilities[name] = out_of_fold_probabilities(task_results, name, len(y_train))
+        oof_auc = ThresholdSweep(y_train, oof_probabilities[name]).roc_auc()
+        print(f"{name} 5-Fold CV ROC-AUC: {cv_scores.mean():.4f} (+/- {cv_scores.std() * 2:.4f}), out-of-fold ROC-AUC: {oof_auc:.4f}")
+        cv_models[name] = fold_models(task_results, name)
+        trained_models[name] = model = task_results[(name, 'final')]['model']
         
-        # Predict on Test Set
-        y_pred = model.predict(X_test)
-        y_prob = model.predict_proba(X_test)[:, 1]
+        # Predict on Test Set once; metrics, ROC plot and model selection all share these probabilities.
+        # predict() is exactly proba > 0.5 for these binary classifiers, so it is derived rather than recomputed.
+        with span('evaluate.predict_test', rows=len(X_test), model=name):
+            y_prob = model.predict_proba(X_test)[:, 1]
+        y_pred = (y_prob > 0.5).astype(int)
+        test_probabilities[name] = y_prob
         
         # Evaluate
         metrics = evaluate_predictions(y_test, y_pred, y_prob, model_name=name)
         evaluation_results.append(metrics)
         
+    save_prediction_cache("../models/predictions_cache.npz", y_train, y_test, oof_probabilities, test_probabilities)
+    
     print("\n--- FINAL TEST SET RESULTS ---")
     results_df = pd.DataFrame(evaluation_results)
     print(results_df.to_string(index=False))
     
     # Plot ROC Curves for all models
-    plot_roc_curves(trained_models, X_test, y_test)
+    plot_roc_curves(trained_models, X_test, y_test, probabilities=test_probabilities)
     
     # Plot Feature Importance for Random Forest and XGBoost
     if "Random Forest" in trained_models:
@@ -99,8 +171,87 @@ def train_and_evaluate():
     features_path = "../models/feature_names.pkl"
     joblib.dump(list(feature_names), features_path)
     print(f"Saved feature names to {features_path}")
+    
+    # Risk-tier cutoffs are tuned on the out-of-fold predictions, so the test set stays untouched
+    tiers = ThresholdSweep(y_train, oof_probabilities[best_model_name]).tier_boundaries()
+    tiers['model'] = best_model_name
+    test_sweep = ThresholdSweep(y_test, test_probabilities[best_model_name])
+    for tier in ('medium', 'high'):
+        tier_metrics = test_sweep.metrics_at(tiers[tier])
+        print(f"{tier.upper()} tier from P(default) >= {tiers[tier]:.3f}: flags {float(tier_metrics['flagged_rate']):.1%} "
+              f"of the test set, precision {float(tier_metrics['precision']):.3f}, recall {float(tier_metrics['recall']):.3f}")
+    tiers_path = "../models/risk_tiers.json"
+    with open(tiers_path, 'w') as f:
+        json.dump(tiers, f, indent=2)
+    print(f"Saved risk-tier cutoffs to {tiers_path}")
+    
+    # Bootstrap 95% intervals on the test set at the default 0.5 cutoff
+    with span('evaluate.bootstrap_ci', rows=len(y_test), model=best_model_name):
+        intervals = test_sweep.bootstrap_ci(threshold=0.5, inclusive=False)
+    print("Test set 95% bootstrap intervals: " + ", ".join(f"{metric} [{low:.4f}, {high:.4f}]" for metric, (low, high)
+                                                          in intervals.items() if metric in ('roc_auc', 'precision', 'recall', 'f1')))
+    
+    # Export a NumPy-only copy of the best model for low-latency serving, verified on the test set
+    compiled = export_compiled_model(best_model, feature_names)
+    check_parity(compiled, best_model, X_test)
+    compiled.save("../models/compiled_model.npz")
+    
+    # New registry version with everything needed to serve (and audit) this model; the flat files
+    # above stay for tools that read them directly
+    # Out-of-fold rather than in-sample probabilities: a forest's scores on its own training rows are
+    # far more confident than anything it will produce on new applicants
+    drift_reference = ReferenceProfile.from_data(X_train, oof_probabilities[best_model_name], feature_names)
+    # Per-node expected outputs (or feature means) for per-applicant attributions, so serving never recomputes them
+    explainer = Explainer.from_background(compiled, X_train)
+    cv_summary = {name: {'mean': float(scores.mean()), 'std': float(scores.std())}
+                  for name, scores in ((name, summarize_cv(task_results, name)) for name in models)}
+    metrics = {'test': evaluation_results, 'cv_roc_auc': cv_summary}
+    registry = ModelRegistry("../models")
+    registry.register(best_model, best_model_name, feature_names, "../models/feature_transform.pkl",
+                      compiled=compiled, risk_tiers=tiers, data_path=filepath,
+                      drift_reference=drift_reference, explainer=explainer, holdout=(X_test, y_test), metrics=metrics)
+    
+    # The runners-up are registered too (not promoted) and shadow-scored next to the best model in
+    # production (champion_challenger.py), with their own tier cutoffs, drift profile and attributions
+    if register_challengers:
+        challengers = []
+        runners_up = [row['Model'] for row in sorted(evaluation_results, key=lambda row: -row['ROC-AUC'])
+                      if row['Model'] != best_model_name]
+        for name in runners_up:
+            model = trained_models[name]
+            challenger_compiled = export_compiled_model(model, feature_names)
+            check_parity(challenger_compiled, model, X_test)
+            challenger_tiers = ThresholdSweep(y_train, oof_probabilities[name]).tier_boundaries()
+            challenger_tiers['model'] = name
+            challengers.append(registry.register(
+                model, name, feature_names, "../models/feature_transform.pkl", compiled=challenger_compiled,
+                risk_tiers=challenger_tiers, data_path=filepath,
+                drift_reference=ReferenceProfile.from_data(X_train, oof_probabilities[name], feature_names),
+                explainer=Explainer.from_background(challenger_compiled, X_train), holdout=(X_test, y_test),
+                metrics=metrics, promote=False))
+        registry.set_challengers(challengers)
 
-    return trained_models, results_df, X_train.columns
+    return trained_models, results_df, X_train.columns, cv_models
 
 if __name__ == "__main__":
-    trained_models, results_df, feature_names = train_and_evaluate()
+    parser = argparse.ArgumentParser(description="Train, cross-validate and evaluate all models.")
+    parser.add_argument("--cores", type=int, default=None, help="Core budget for parallel training (default: all cores)")
+    parser.add_argument("--serial", action="store_true", help="Train one model at a time, as a baseline")
+    parser.add_argument("--search", action="store_true", help="Tune hyperparameters with successive halving first")
+    parser.add_argument("--search-budget", type=float, default=600, help="Wall-clock budget of the search in seconds")
+    parser.add_argument("--search-candidates", type=int, default=27, help="Random candidates per model")
+    parser.add_argument("--sklearn-xgboost", action="store_true",
+                        help="Train XGBoost through the sklearn wrapper like the other models instead of the quantized path")
+    parser.add_argument("--external-memory", choices=["auto", "on", "off"], default="auto",
+                        help="Out-of-core quantized XGBoost training (auto: only when the data doesn't fit in RAM)")
+    parser.add_argument("--no-challengers", action="store_true",
+                        help="Register only the best model, without the others as shadow-scored challengers")
+    args = parser.parse_args()
+    
+    with span('train.train_and_evaluate'):
+        trained_models, results_df, feature_names, cv_models = train_and_evaluate(
+            parallel=not args.serial, core_budget=args.cores, search=args.search,
+            search_budget=args.search_budget, search_candidates=args.search_candidates,
+            quantized_xgboost=not args.sklearn_xgboost,
+            external_memory={"auto": None, "on": True, "off": False}[args.external_memory],
+            register_challengers=not args.no_challengers)
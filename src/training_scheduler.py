@@ -0,0 +1,180 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold
+from threadpoolctl import threadpool_limits
+
+from evaluate_model import ThresholdSweep
+from instrumentation import span, emit
+
+# Estimators that can use more than one thread per fit (n_jobs); everything else gets one core
+MULTITHREADED_ESTIMATORS = ('RandomForestClassifier', 'XGBClassifier')
+# Rough relative fit cost, used to start the longest tasks first and shorten the tail
+ESTIMATOR_COST = {'RandomForestClassifier': 10, 'XGBClassifier': 4, 'LogisticRegression': 1}
+
+class TrainingTask:
+    """One fit in the training graph: a CV fold (fold is an int) or the final full-data fit (fold is None)."""
+
+    def __init__(self, model_name, model, fold=None, train_idx=None, valid_idx=None):
+        self.model_name = model_name
+        self.model = model
+        self.fold = fold
+        self.train_idx = train_idx
+        self.valid_idx = valid_idx
+        self.multithreaded = type(model).__name__ in MULTITHREADED_ESTIMATORS
+        self.cost = ESTIMATOR_COST.get(type(model).__name__, 5)
+
+    @property
+    def key(self):
+        return (self.model_name, 'final' if self.fold is None else self.fold)
+
+# Training data is shipped to each worker once by the pool initializer, tasks only carry indices
+_worker_X = None
+_worker_y = None
+
+def _init_worker(X, y):
+    global _worker_X, _worker_y
+    _worker_X, _worker_y = X, y
+
+def _subset(data, idx):
+    if idx is None:
+        return data
+    return data.iloc[idx] if hasattr(data, 'iloc') else data[idx]
+
+def _run_task(task, threads):
+    """
+    Fits one task inside a worker with at most `threads` threads (None leaves the model's own
+    n_jobs alone) and returns the fitted model. Fold tasks also return their out-of-fold
+    probabilities, so CV never has to be re-predicted. XGBoost models configured with
+    early_stopping_rounds stop boosting once their validation fold stops improving.
+    With instrumentation enabled the fit's span record comes back as result['span'] for the
+    parent process to emit.
+    """
+    start = time.perf_counter()
+    model = task.model
+    n_jobs = model.get_params().get('n_jobs')
+    limit_threads = threads is not None and task.multithreaded
+    if limit_threads:
+        model.set_params(n_jobs=threads)
+    fit_params = {}
+    early_stopping = task.fold is not None and model.get_params().get('early_stopping_rounds')
+    if early_stopping:
+        fit_params = {'eval_set': [(_subset(_worker_X, task.valid_idx), _subset(_worker_y, task.valid_idx))],
+                      'verbose': False}
+    n_rows = len(task.train_idx) if task.train_idx is not None else len(_worker_y)
+    # Caps BLAS/OpenMP pools too, so a 1-thread task really stays on one core
+    with threadpool_limits(limits=threads), span('train.fit', rows=n_rows, emit=False, model=task.model_name,
+                                                  fold=task.key[1], threads=threads) as fit_span:
+        model.fit(_subset(_worker_X, task.train_idx), _subset(_worker_y, task.train_idx), **fit_params)
+        result = {'model': model}
+        if task.fold is not None:
+            y_valid = _subset(_worker_y, task.valid_idx)
+            y_prob = model.predict_proba(_subset(_worker_X, task.valid_idx))[:, 1]
+            result.update({'valid_idx': task.valid_idx, 'valid_prob': y_prob,
+                           'score': ThresholdSweep(y_valid, y_prob).roc_auc()})
+        if early_stopping:
+            result['best_iteration'] = model.best_iteration
+    if limit_threads:
+        model.set_params(n_jobs=n_jobs) # the saved model keeps its own setting for inference
+    result['seconds'] = time.perf_counter() - start
+    result['threads'] = threads
+    result['span'] = fit_span.record
+    return result
+
+def cv_folds(X, y, n_folds=5):
+    """
+    (train_idx, valid_idx) pairs: the same StratifiedKFold splits cross_val_score(cv=5) uses, so
+    the scores match the serial loop.
+    """
+    return list(StratifiedKFold(n_splits=n_folds).split(X, y))
+
+def build_training_graph(models, X, y, n_folds=5):
+    """(model x fold) CV tasks plus one final fit per model, on the cv_folds splits."""
+    folds = cv_folds(X, y, n_folds)
+    tasks = []
+    for name, model in models.items():
+        for fold, (train_idx, valid_idx) in enumerate(folds):
+            tasks.append(TrainingTask(name, clone(model), fold, train_idx, valid_idx))
+        tasks.append(TrainingTask(name, clone(model)))
+    return tasks
+
+def run_training_graph(tasks, X, y, core_budget=None, deadline=None):
+    """
+    Runs the training tasks in a process pool without ever using more than `core_budget` cores.
+
+    Tasks start longest-first. Whenever cores free up, the next task gets an even share of them:
+    early on every task runs single-threaded side by side, and in the tail the last RandomForest
+    or XGBoost fits get the cores the finished tasks left behind instead of leaving them idle.
+    With a `deadline` (a time.perf_counter() value) no new task starts after it; tasks already
+    running finish, the rest are skipped and left out of the results.
+    Returns {task.key: result} and a timing summary.
+    """
+    core_budget = core_budget or os.cpu_count()
+    queue = sorted(tasks, key=lambda task: task.cost, reverse=True)
+    results = {}
+    running = {}
+    free_cores = core_budget
+    skipped = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=core_budget, initializer=_init_worker, initargs=(X, y)) as pool:
+        while queue or running:
+            if deadline is not None and queue and time.perf_counter() >= deadline:
+                skipped, queue = len(queue), []
+                if not running:
+                    break
+            while queue and free_cores > 0:
+                task = queue.pop(0)
+                # Share the free cores between the tasks that could start now
+                threads = max(1, free_cores // min(len(queue) + 1, free_cores)) if task.multithreaded else 1
+                running[pool.submit(_run_task, task, threads)] = (task, threads)
+                free_cores -= threads
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task, threads = running.pop(future)
+                free_cores += threads
+                results[task.key] = future.result()
+                emit(results[task.key].pop('span'))
+
+    wall_time = time.perf_counter() - start
+    task_time = sum(result['seconds'] for result in results.values())
+    summary = {'core_budget': core_budget, 'tasks': len(tasks), 'skipped': skipped, 'wall_seconds': wall_time,
+               'task_seconds': task_time, 'concurrency': task_time / max(wall_time, 1e-9)}
+    return results, summary
+
+def run_training_serially(tasks, X, y):
+    """
+    Serial baseline: runs the same tasks one after another in this process, each model using
+    its own n_jobs setting (the original train-one-model-at-a-time behaviour).
+    """
+    _init_worker(X, y)
+    start = time.perf_counter()
+    results = {}
+    for task in tasks:
+        results[task.key] = _run_task(task, None)
+        emit(results[task.key].pop('span'))
+    wall_time = time.perf_counter() - start
+    summary = {'core_budget': os.cpu_count(), 'tasks': len(tasks), 'skipped': 0, 'wall_seconds': wall_time,
+               'task_seconds': wall_time, 'concurrency': 1.0}
+    return results, summary
+
+def _fold_keys(results, model_name):
+    return sorted(key for key in results if key[0] == model_name and key[1] != 'final')
+
+def summarize_cv(results, model_name):
+    """Fold ROC-AUC scores of one model, in fold order."""
+    return np.array([results[key]['score'] for key in _fold_keys(results, model_name)])
+
+def fold_models(results, model_name):
+    """The fitted fold estimators of one model, in fold order."""
+    return [results[key]['model'] for key in _fold_keys(results, model_name)]
+
+def out_of_fold_probabilities(results, model_name, n_rows):
+    """Reassembles the fold predictions into one out-of-fold P(default) per training row."""
+    oof = np.full(n_rows, np.nan)
+    for key in _fold_keys(results, model_name):
+        oof[results[key]['valid_idx']] = results[key]['valid_prob']
+    return oof
@@ -0,0 +1,204 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.linear_model import SGDClassifier
+from sklearn.utils.class_weight import compute_class_weight, compute_sample_weight
+from sklearn.model_selection import train_test_split
+
+from data_preprocessing import TARGET_COL, read_raw_csv
+from data_store import intermediate_path
+from evaluate_model import evaluate_predictions
+from compiled_model import export_compiled_model, check_parity
+from model_registry import ModelRegistry, TRANSFORM_FILE
+from drift_monitor import ReferenceProfile
+from explanations import Explainer
+from train_model import load_and_split_data
+from xgboost_training import SKLEARN_ONLY_PARAMS
+from instrumentation import span
+
+# Trees a RandomForest grows on each new batch (the existing trees are kept as they are)
+NEW_TREES = 20
+# Boosting rounds XGBoost adds on top of the registered booster per batch, and their learning rate:
+# at the training default (0.3) a few rounds on one month already overfit it and cost holdout AUC
+NEW_ROUNDS = 20
+XGB_ETA = 0.01
+# Passes of SGD over each new batch, and its (small, constant) step size so one month nudges the
+# coefficients instead of overwriting what the full history taught them
+SGD_EPOCHS = 5
+SGD_ETA = 1e-4
+SGD_ALPHA = 1e-4
+# Share of the new rows kept out of the update and added to the holdout the guard scores on
+NEW_HOLDOUT_FRACTION = 0.2
+# The update is promoted unless its holdout ROC-AUC is more than this below the current model's
+MAX_AUC_DROP = 0.0
+
+def update_random_forest(model, X, y, new_trees=NEW_TREES, max_trees=None):
+    """
+    Grows `new_trees` more trees on the new rows only (warm_start keeps the fitted ones). With
+    max_trees the oldest trees beyond that count are dropped, so the forest follows recent months.
+    A 'balanced' class_weight is resolved to explicit weights for the new rows, which is what
+    sklearn asks for when warm-started trees see only part of the data.
+    """
+    class_weight = model.class_weight
+    if class_weight == 'balanced':
+        classes = np.unique(y)
+        model.set_params(class_weight=dict(zip(classes, compute_class_weight('balanced', classes=classes, y=y))))
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + new_trees)
+    model.fit(X, y)
+    if max_trees and len(model.estimators_) > max_trees:
+        model.estimators_ = model.estimators_[-max_trees:]
+    model.set_params(warm_start=False, n_estimators=len(model.estimators_), class_weight=class_weight)
+    return model
+
+def update_xgboost(model, X, y, rounds=NEW_ROUNDS):
+    """Continues boosting the registered booster for `rounds` more rounds on the new rows."""
+    params = {key: value for key, value in model.get_xgb_params().items()
+              if value is not None and key not in SKLEARN_ONLY_PARAMS}
+    params.setdefault('tree_method', 'hist')
+    params['learning_rate'] = XGB_ETA
+    booster = model.get_booster().copy()
+    # An early-stopped booster would otherwise keep predicting with its old best round only
+    booster.set_attr(best_iteration=None, best_score=None)
+    matrix = xgb.QuantileDMatrix(np.ascontiguousarray(X, dtype=np.float32), np.asarray(y),
+                                 max_bin=params.get('max_bin', 256), feature_names=booster.feature_names)
+    booster = xgb.train(params, matrix, num_boost_round=rounds, xgb_model=booster)
+    updated = type(model)(**{**model.get_params(), 'n_estimators': booster.num_boosted_rounds()})
+    updated.load_model(bytearray(booster.save_raw('ubj')))
+    return updated
+
+def update_linear(model, X, y, epochs=SGD_EPOCHS):
+    """
+    `epochs` log-loss SGD passes over the new rows with class-balanced sample weights, starting from
+    the current coefficients (a LogisticRegression becomes the equivalent SGDClassifier on its first
+    update). The passes run on X / std so one large-valued feature can't make the steps diverge,
+    and the scale is folded back into the coefficients, so the result still takes unscaled rows.
+    """
+    # A frame, so the SGDClassifier keeps the feature names like the fitted LogisticRegression
+    X = pd.DataFrame(X).astype(np.float64)
+    scale = X.std(axis=0, ddof=0).replace(0, 1.0).to_numpy()
+    sgd = SGDClassifier(loss='log_loss', alpha=SGD_ALPHA, learning_rate='constant', eta0=SGD_ETA,
+                        max_iter=epochs, tol=None, random_state=42)
+    sgd.fit(X / scale, y, coef_init=model.coef_ * scale, intercept_init=model.intercept_,
+            sample_weight=compute_sample_weight('balanced', y))
+    sgd.coef_ = sgd.coef_ / scale
+    return sgd
+
+def update_model(model, X, y, new_trees=NEW_TREES, rounds=NEW_ROUNDS, epochs=SGD_EPOCHS, max_trees=None):
+    """Warm-start update of any model train_model.py registers, on the new rows only."""
+    name = type(model).__name__
+    if name == 'RandomForestClassifier':
+        return update_random_forest(model, X, y, new_trees, max_trees)
+    if name == 'XGBClassifier':
+        return update_xgboost(model, X, y, rounds)
+    if name in ('LogisticRegression', 'SGDClassifier'):
+        return update_linear(model, X, y, epochs)
+    raise ValueError(f"Don't know how to warm-start a {name}")
+
+def promotion_guard(y_holdout, champion_prob, candidate_prob, champion_name, candidate_name, max_auc_drop=MAX_AUC_DROP):
+    """
+    Scores the current model and the update on the same holdout with evaluate_predictions.
+    Returns (passed, [champion metrics, candidate metrics]); the update passes unless its ROC-AUC
+    is more than max_auc_drop below the current model's.
+    """
+    champion = evaluate_predictions(y_holdout, (champion_prob > 0.5).astype(int), champion_prob, champion_name)
+    candidate = evaluate_predictions(y_holdout, (candidate_prob > 0.5).astype(int), candidate_prob, candidate_name)
+    return candidate['ROC-AUC'] >= champion['ROC-AUC'] - max_auc_drop, [champion, candidate]
+
+def load_holdout(registry, version, feature_names):
+    """
+    The holdout saved with the version (the test split train_model.py evaluated it on, plus the new
+    rows earlier updates held out), restricted to its features. Versions registered before holdouts
+    were saved fall back to re-splitting the whole engineered history.
+    """
+    holdout = registry.holdout(version)
+    if holdout is None:
+        print(f"{version} has no saved holdout; re-splitting the engineered data")
+        _, X_test, _, y_test, _ = load_and_split_data(intermediate_path("engineered_loan_data"))
+        holdout = X_test, y_test
+    X_test, y_test = holdout
+    # float32 like the transform's output, so the two parts of the holdout concatenate cleanly
+    return X_test[list(feature_names)].astype(np.float32), np.asarray(y_test)
+
+def warm_start_update(new_data_path, models_dir="../models", new_trees=NEW_TREES, rounds=NEW_ROUNDS, epochs=SGD_EPOCHS,
+                      max_trees=None, max_auc_drop=MAX_AUC_DROP, promote=True):
+    """
+    Updates the current registry version with a file of newly labelled applicants (raw UCI layout)
+    instead of retraining on the whole history, so the cost follows the size of the new file.
+
+    The new rows go through the version's own feature transform. A stratified NEW_HOLDOUT_FRACTION
+    of them is held out and added to the holdout saved with the current version; the current model
+    and the update are both scored on that holdout, and the update (registered as a new version
+    either way, for the record, with the extended holdout) only becomes current when
+    promotion_guard passes. Returns (version, passed).
+    """
+    registry = ModelRegistry(models_dir)
+    parent = registry.current_version()
+    if parent is None:
+        raise FileNotFoundError(f"No registered model in {models_dir}. Run train_model.py first.")
+    model, transform, metadata = registry.load(parent, mmap_mode=None)
+    feature_names = metadata['feature_names']
+    model_name = metadata['model_name']
+
+    raw = read_raw_csv(new_data_path)
+    X_new = pd.DataFrame(transform.transform(raw), columns=feature_names)
+    y_new = raw[TARGET_COL].to_numpy()
+    X_update, X_new_holdout, y_update, y_new_holdout = train_test_split(
+        X_new, y_new, test_size=NEW_HOLDOUT_FRACTION, random_state=42, stratify=y_new)
+    X_test, y_test = load_holdout(registry, parent, feature_names)
+    X_holdout = pd.concat([X_test, X_new_holdout], ignore_index=True)
+    y_holdout = np.concatenate([y_test, y_new_holdout])
+    print(f"{parent} ({model_name}): updating on {len(X_update):,} new rows, holdout {len(X_holdout):,} rows "
+          f"({len(X_test):,} from {parent} + {len(X_new_holdout):,} new)")
+
+    # Before the update: warm-started forests and partial_fit change the model in place
+    champion_prob = model.predict_proba(X_holdout)[:, 1]
+    start = time.perf_counter()
+    with span('train.warm_start', rows=len(X_update), model=model_name):
+        updated = update_model(model, X_update, y_update, new_trees, rounds, epochs, max_trees)
+    update_seconds = time.perf_counter() - start
+    print(f"Updated {type(updated).__name__} in {update_seconds:.2f}s")
+
+    candidate_prob = updated.predict_proba(X_holdout)[:, 1]
+    passed, results = promotion_guard(y_holdout, champion_prob, candidate_prob, f"{model_name} ({parent})",
+                                      model_name, max_auc_drop)
+    print(pd.DataFrame(results).to_string(index=False))
+
+    compiled = export_compiled_model(updated, feature_names)
+    check_parity(compiled, updated, X_holdout)
+    # Out-of-sample scores of the updated model describe what it will see in production
+    drift_reference = ReferenceProfile.from_data(X_holdout, candidate_prob, feature_names)
+    explainer = Explainer.from_background(compiled, X_holdout)
+    warm_start = {'parent_version': parent, 'new_rows': len(X_update), 'holdout_rows': len(X_holdout),
+                  'update_seconds': update_seconds, 'max_auc_drop': max_auc_drop, 'passed': bool(passed)}
+    # Risk-tier cutoffs stay those tuned for the parent; a full train_model.py run re-tunes them
+    version = registry.register(updated, model_name, feature_names, os.path.join(registry.path(parent), TRANSFORM_FILE),
+                                compiled=compiled, risk_tiers=metadata.get('risk_tiers'), data_path=new_data_path,
+                                drift_reference=drift_reference, explainer=explainer, holdout=(X_holdout, y_holdout),
+                                metrics={'test': results, 'warm_start': warm_start}, promote=False)
+    if passed and promote:
+        registry.promote(version)
+    elif passed:
+        print(f"{version} passed the promotion guard; promote it with `python model_registry.py promote {version}`.")
+    else:
+        print(f"{version} is worse than {parent} on the holdout, {parent} stays current.")
+    return version, passed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm-start the current model on newly labelled applicants.")
+    parser.add_argument("--new-data", required=True, help="Raw CSV (UCI layout, with the target) of the new months")
+    parser.add_argument("--models-dir", default="../models")
+    parser.add_argument("--new-trees", type=int, default=NEW_TREES, help="Trees a RandomForest adds")
+    parser.add_argument("--max-trees", type=int, default=None, help="Drop a RandomForest's oldest trees beyond this count")
+    parser.add_argument("--rounds", type=int, default=NEW_ROUNDS, help="Boosting rounds XGBoost adds")
+    parser.add_argument("--epochs", type=int, default=SGD_EPOCHS, help="SGD passes for a linear model")
+    parser.add_argument("--max-auc-drop", type=float, default=MAX_AUC_DROP,
+                        help="Largest holdout ROC-AUC loss against the current model that is still promoted")
+    parser.add_argument("--no-promote", action="store_true", help="Register the update without making it current")
+    args = parser.parse_args()
+
+    with span('train.warm_start_update'):
+        version, passed = warm_start_update(args.new_data, args.models_dir, args.new_trees, args.rounds, args.epochs,
+                                            args.max_trees, args.max_auc_drop, promote=not args.no_promote)
@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import xgboost as xgb
+
+from evaluate_model import ThresholdSweep
+from instrumentation import span
+
+# Rows handed to XGBoost per batch when building quantized matrices and predicting
+BATCH_ROWS = 100_000
+# Switch to external memory when the float32 features would take more than this share of free RAM
+MEMORY_FRACTION = 0.5
+# Booster parameters of the sklearn wrapper that xgb.train doesn't understand
+SKLEARN_ONLY_PARAMS = ('use_label_encoder', 'early_stopping_rounds')
+
+def available_memory():
+    """Free physical memory in bytes, or None where the platform doesn't report it."""
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def needs_external_memory(n_rows, n_cols):
+    """True when a float32 copy of an (n_rows x n_cols) feature matrix would not comfortably fit in RAM."""
+    free = available_memory()
+    return free is not None and n_rows * n_cols * 4 > free * MEMORY_FRACTION
+
+def _rows(X, idx):
+    """Rows `idx` of a frame or array as float32; memory-mapped frames only read the pages they touch."""
+    return np.asarray(X.iloc[idx] if hasattr(X, 'iloc') else X[idx], dtype=np.float32)
+
+class RowBatches(xgb.DataIter):
+    """
+    Feeds the rows `rows` of X (a DataFrame, possibly memory-mapped, or an array) and y to XGBoost
+    BATCH_ROWS at a time, so the float feature matrix never has to exist in one piece.
+    With a `cache_prefix`, XGBoost keeps the quantized pages on disk (external memory).
+    """
+
+    def __init__(self, X, y, rows, cache_prefix=None):
+        self.X = X
+        self.y = np.asarray(y)
+        self.rows = np.sort(rows)
+        self._start = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._start >= len(self.rows):
+            return False
+        batch = self.rows[self._start:self._start + BATCH_ROWS]
+        input_data(data=_rows(self.X, batch), label=self.y[batch])
+        self._start += BATCH_ROWS
+        return True
+
+    def reset(self):
+        self._start = 0
+
+class QuantizedXGBoostTrainer:
+    """
+    Cross-validates and fits an XGBClassifier's configuration on pre-quantized 'hist' matrices.
+
+    The quantile sketch (the bin boundaries of every feature) is computed once, on all training
+    rows. Each fold's training matrix is then quantized against those same boundaries
+    (QuantileDMatrix ref=) instead of being re-sketched from a pandas frame per fit, and the final
+    model trains on the full matrix itself. When the data doesn't fit in RAM the same matrices are
+    built as ExtMemQuantileDMatrix from batched iterators, with quantized pages cached on disk.
+    Time spent per phase is collected in self.timings.
+    """
+
+    def __init__(self, model, X, y, external_memory=None, cache_dir=None):
+        self.model = model
+        self.y = np.asarray(y)
+        self.external_memory = needs_external_memory(*X.shape) if external_memory is None else external_memory
+        self.timings = {'convert': 0.0, 'sketch': 0.0, 'quantize_folds': 0.0, 'train': 0.0, 'predict': 0.0}
+
+        params = {key: value for key, value in model.get_xgb_params().items()
+                  if value is not None and key not in SKLEARN_ONLY_PARAMS}
+        params.setdefault('tree_method', 'hist')
+        self.max_bin = params.setdefault('max_bin', 256)
+        self.params = params
+        self.num_boost_round = model.get_num_boosting_rounds()
+
+        start = time.perf_counter()
+        if self.external_memory:
+            # Batches are read straight from X (memory-mapped columns stay on disk)
+            self.X = X
+            self.cache_dir = tempfile.mkdtemp(prefix='xgb_cache_', dir=cache_dir)
+        else:
+            # One float32 conversion for every fold and the final fit
+            self.X = np.ascontiguousarray(X, dtype=np.float32)
+            self.cache_dir = None
+        self.timings['convert'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.full_matrix = self._quantize(np.arange(len(self.y)), ref=None, name='full')
+        self.timings['sketch'] += time.perf_counter() - start
+
+    def _quantize(self, rows, ref, name):
+        if self.external_memory:
+            batches = RowBatches(self.X, self.y, rows, cache_prefix=os.path.join(self.cache_dir, name))
+            return xgb.ExtMemQuantileDMatrix(batches, max_bin=self.max_bin, ref=ref)
+        rows = np.sort(rows)
+        return xgb.QuantileDMatrix(self.X[rows], self.y[rows], max_bin=self.max_bin, ref=ref)
+
+    def _fit(self, matrix):
+        start = time.perf_counter()
+        booster = xgb.train(self.params, matrix, num_boost_round=self.num_boost_round)
+        self.timings['train'] += time.perf_counter() - start
+        return booster
+
+    def _predict(self, booster, rows):
+        start = time.perf_counter()
+        prob = np.concatenate([booster.inplace_predict(_rows(self.X, rows[i:i + BATCH_ROWS]))
+                               for i in range(0, len(rows), BATCH_ROWS)]) if len(rows) else np.zeros(0)
+        self.timings['predict'] += time.perf_counter() - start
+        return prob
+
+    def _as_classifier(self, booster):
+        """Wraps a trained booster in an XGBClassifier with the original settings, for saving and scoring."""
+        classifier = type(self.model)(**self.model.get_params())
+        classifier.load_model(bytearray(booster.save_raw('ubj')))
+        return classifier
+
+    def run(self, folds, model_name):
+        """
+        Fits every (train_idx, valid_idx) fold and the final model. Returns results keyed like
+        training_scheduler.run_training_graph: {(model_name, fold): ..., (model_name, 'final'): ...}.
+        """
+        results = {}
+        for fold, (train_idx, valid_idx) in enumerate(folds):
+            fold_start = time.perf_counter()
+            with span('train.fit', rows=len(train_idx), model=model_name, fold=fold, threads=self.params.get('n_jobs')):
+                quantize_start = time.perf_counter()
+                matrix = self._quantize(train_idx, ref=self.full_matrix, name=f'fold{fold}')
+                self.timings['quantize_folds'] += time.perf_counter() - quantize_start
+                booster = self._fit(matrix)
+                del matrix
+                valid_idx = np.sort(valid_idx)
+                valid_prob = self._predict(booster, valid_idx)
+            results[(model_name, fold)] = {'model': self._as_classifier(booster), 'valid_idx': valid_idx,
+                                           'valid_prob': valid_prob,
+                                           'score': ThresholdSweep(self.y[valid_idx], valid_prob).roc_auc(),
+                                           'seconds': time.perf_counter() - fold_start, 'threads': None}
+
+        final_start = time.perf_counter()
+        with span('train.fit', rows=len(self.y), model=model_name, fold='final', threads=self.params.get('n_jobs')):
+            booster = self._fit(self.full_matrix)
+        results[(model_name, 'final')] = {'model': self._as_classifier(booster),
+                                          'seconds': time.perf_counter() - final_start, 'threads': None}
+        return results
+
+    def close(self):
+        """Releases the quantized matrices and removes the external-memory page cache."""
+        self.full_matrix = None
+        if self.cache_dir:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+def train_xgboost_quantized(model, X, y, folds, model_name="XGBoost", external_memory=None):
+    """
+    Runs the quantized XGBoost path for one model and prints its per-phase timings.
+    external_memory=None decides from the free RAM; True/False forces either path.
+    """
+    trainer = QuantizedXGBoostTrainer(model, X, y, external_memory)
+    try:
+        results = trainer.run(folds, model_name)
+    finally:
+        trainer.close()
+    mode = 'external memory' if trainer.external_memory else 'in memory'
+    phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in trainer.timings.items())
+    print(f"{model_name} quantized hist training ({mode}, max_bin={trainer.max_bin}): {phases}")
+    return results